@@ -0,0 +1,97 @@
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+from svl.localization.feature_cache import FeatureCache
+from svl.localization.map_reader import SatelliteMapReader
+from svl.localization.packed_map import PackedMap
+
+
+def compile_map(args: argparse.Namespace) -> int:
+    from svl.keypoint_pipeline.detection_and_description import SuperPointAlgorithm
+    from svl.keypoint_pipeline.typing import SuperPointConfig
+
+    superpoint_algorithm = SuperPointAlgorithm(
+        SuperPointConfig(
+            device=args.device,
+            nms_radius=args.nms_radius,
+            keypoint_threshold=args.keypoint_threshold,
+            max_keypoints=args.max_keypoints,
+        )
+    )
+    map_reader = SatelliteMapReader(
+        db_path=args.db_path,
+        resize_size=tuple(args.resize_size),
+        logger=logging.getLogger("%s.SatelliteMapReader" % __name__),  # noqa
+    )
+    map_reader.initialize_db()
+    map_reader.setup_db()
+    map_reader.resize_db_images()
+    feature_cache = FeatureCache(
+        cache_dir=args.cache_dir,
+        logger=logging.getLogger("%s.FeatureCache" % __name__),  # noqa
+    )
+    map_reader.describe_db_images(superpoint_algorithm, feature_cache=feature_cache)
+
+    packed_map = PackedMap.compile(
+        args.output,
+        map_reader,
+        features=feature_cache.describe_config(
+            superpoint_algorithm, map_reader.resize_size
+        ),
+        logger=logging.getLogger("%s.PackedMap" % __name__),  # noqa
+    )
+    return verify_map(argparse.Namespace(path=packed_map.path))
+
+
+def verify_map(args: argparse.Namespace) -> int:
+    logger = logging.getLogger("%s.verify" % __name__)
+    start = time.perf_counter()
+    map_reader = SatelliteMapReader(
+        db_path=Path(args.path).parent,
+        resize_size=None,
+        logger=logging.getLogger("%s.SatelliteMapReader" % __name__),  # noqa
+    )
+    packed_map = map_reader.load_packed_map(args.path)
+    logger.info(f"Packed map opened in {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+    errors = packed_map.verify()
+    for error in errors:
+        logger.error(error)
+    if errors:
+        return 1
+    logger.info(
+        f"Packed map is valid: {len(packed_map)} images, "
+        f"{len(packed_map.keypoints)} keypoints, features {packed_map.header['features']}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(format=format, level=logging.INFO, datefmt="%H:%M:%S")
+
+    parser = argparse.ArgumentParser(
+        description="Compile a georeference folder into a packed map and verify it"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compile_parser = subparsers.add_parser("compile", help="compile a packed map")
+    compile_parser.add_argument("db_path", help="georeference folder")
+    compile_parser.add_argument("output", help="packed map file to write")
+    compile_parser.add_argument("--resize-size", type=int, nargs="+", default=[800])
+    compile_parser.add_argument("--device", default="cuda")
+    compile_parser.add_argument("--nms-radius", type=int, default=4)
+    compile_parser.add_argument("--keypoint-threshold", type=float, default=0.01)
+    compile_parser.add_argument("--max-keypoints", type=int, default=-1)
+    compile_parser.add_argument("--cache-dir", default="./dataset/cache/features/")
+    compile_parser.set_defaults(func=compile_map)
+
+    verify_parser = subparsers.add_parser("verify", help="verify a packed map")
+    verify_parser.add_argument("path", help="packed map file")
+    verify_parser.set_defaults(func=verify_map)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
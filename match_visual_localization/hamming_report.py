@@ -0,0 +1,78 @@
+import argparse
+import json
+import logging
+
+from svl.keypoint_pipeline.classical import ClassicalKeyPointAlgorithm
+from svl.keypoint_pipeline.detection_and_description import SuperPointAlgorithm
+from svl.keypoint_pipeline.evaluation import (
+    add_dataset_arguments,
+    evaluate_retrieval,
+    load_images,
+    log_report,
+)
+from svl.keypoint_pipeline.hamming import HammingLSHMatcher
+from svl.keypoint_pipeline.matcher import SuperGlueMatcher
+from svl.keypoint_pipeline.typing import (
+    HammingLSHConfig,
+    ORBConfig,
+    SuperGlueConfig,
+    SuperPointConfig,
+)
+
+if __name__ == "__main__":
+    format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(format=format, level=logging.INFO, datefmt="%H:%M:%S")
+    logger = logging.getLogger("%s.report" % __name__)
+
+    parser = argparse.ArgumentParser(
+        description="Compare ORB with the Hamming LSH matcher against SuperPoint "
+        "with SuperGlue on a georeference folder, a rotated and scaled copy of each "
+        "image being localized among all the images"
+    )
+    add_dataset_arguments(parser)
+    parser.add_argument(
+        "--max-keypoints", type=int, default=2000, help="Keypoints of both detectors"
+    )
+    parser.add_argument("--num-tables", type=int, default=8)
+    parser.add_argument("--key-bits", type=int, default=16)
+    parser.add_argument("--probe-radius", type=int, default=1)
+    parser.add_argument(
+        "--skip-superglue", action="store_true", help="Only run the binary matchers"
+    )
+    args = parser.parse_args()
+
+    images = load_images(args)
+    orb = ClassicalKeyPointAlgorithm(ORBConfig(max_keypoints=args.max_keypoints))
+    lsh_config = HammingLSHConfig(
+        num_tables=args.num_tables,
+        key_bits=args.key_bits,
+        probe_radius=args.probe_radius,
+    )
+    report = {
+        "orb_hamming_lsh": evaluate_retrieval(
+            images, orb, HammingLSHMatcher(lsh_config)
+        ),
+        "orb_hamming_exhaustive": evaluate_retrieval(
+            images, orb, HammingLSHMatcher(HammingLSHConfig(num_tables=0))
+        ),
+    }
+    if not args.skip_superglue:
+        report["superpoint_superglue"] = evaluate_retrieval(
+            images,
+            SuperPointAlgorithm(
+                SuperPointConfig(device=args.device, max_keypoints=args.max_keypoints)
+            ),
+            SuperGlueMatcher(
+                SuperGlueConfig(
+                    device=args.device,
+                    weights=args.weights,
+                    sinkhorn_iterations=args.sinkhorn_iterations,
+                )
+            ),
+        )
+
+    logger.info(f"Hamming LSH report, {len(images)} images")
+    log_report(logger, report)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"lsh": vars(lsh_config), **report}, file, indent=2)
@@ -3,6 +3,7 @@ from pathlib import Path
 
 from svl.localization.map_reader import SatelliteMapReader
 from svl.localization.drone_streamer import DroneImageStreamer
+from svl.localization.feature_cache import FeatureCache
 from svl.localization.preprocessing import QueryProcessor
 # from svl.localization.pipeline import Pipeline, PipelineConfig
 from svl.localization.pipeline import Pipeline, PipelineConfig
@@ -45,7 +46,12 @@ if __name__ == "__main__":
     map_reader.initialize_db()
     map_reader.setup_db()
     map_reader.resize_db_images() # ???? Unable to find it
-    map_reader.describe_db_images(superpoint_algorithm)
+    feature_cache = FeatureCache(
+        cache_dir="./dataset/cache/features/",
+        logger=logging.getLogger("%s.FeatureCache" % __name__),  # noqa
+    )
+    map_reader.describe_db_images(superpoint_algorithm, feature_cache=feature_cache)
+    map_reader.precompute_matcher(superglue_matcher)
 
 
 
@@ -0,0 +1,86 @@
+import argparse
+import json
+import logging
+from pathlib import Path
+
+from svl.keypoint_pipeline.detection_and_description import SuperPointAlgorithm
+from svl.keypoint_pipeline.evaluation import (
+    add_dataset_arguments,
+    build_warped_pairs,
+    compare_detectors,
+    compare_matchers,
+    load_images,
+    log_report,
+)
+from svl.keypoint_pipeline.export import export_superglue_onnx, export_superpoint_onnx
+from svl.keypoint_pipeline.matcher import SuperGlueMatcher
+from svl.keypoint_pipeline.onnx_backend import (
+    OnnxSuperGlueMatcher,
+    OnnxSuperPointAlgorithm,
+)
+from svl.keypoint_pipeline.typing import (
+    OnnxSuperGlueConfig,
+    OnnxSuperPointConfig,
+    SuperGlueConfig,
+    SuperPointConfig,
+)
+
+if __name__ == "__main__":
+    format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(format=format, level=logging.INFO, datefmt="%H:%M:%S")
+    logger = logging.getLogger("%s.report" % __name__)
+
+    parser = argparse.ArgumentParser(
+        description="Export SuperPoint and SuperGlue to ONNX and compare the "
+        "latency of ONNX Runtime against torch on a georeference folder, each "
+        "image being matched with a rotated and scaled copy of itself. The "
+        "parity of the outputs is tested in tests/test_onnx_parity.py"
+    )
+    add_dataset_arguments(parser)
+    parser.add_argument("--model-dir", default="./dataset/cache/models/")
+    parser.add_argument(
+        "--export", action="store_true", help="Export the ONNX files even if present"
+    )
+    parser.add_argument("--intra-op-threads", type=int, default=0)
+    parser.add_argument("--inter-op-threads", type=int, default=0)
+    args = parser.parse_args()
+
+    detector = SuperPointAlgorithm(SuperPointConfig())
+    matcher = SuperGlueMatcher(
+        SuperGlueConfig(weights=args.weights, sinkhorn_iterations=args.sinkhorn_iterations)
+    )
+
+    model_dir = Path(args.model_dir)
+    model_dir.mkdir(parents=True, exist_ok=True)
+    superpoint_path = model_dir / "superpoint.onnx"
+    superglue_path = (
+        model_dir / f"superglue_{args.weights}_{args.sinkhorn_iterations}.onnx"
+    )
+    if args.export or not superpoint_path.exists():
+        export_superpoint_onnx(detector.detector, superpoint_path)
+        logger.info(f"Exported SuperPoint to {superpoint_path}")
+    if args.export or not superglue_path.exists():
+        export_superglue_onnx(matcher.matcher, superglue_path)
+        logger.info(f"Exported SuperGlue to {superglue_path}")
+
+    threads = {
+        "intra_op_num_threads": args.intra_op_threads,
+        "inter_op_num_threads": args.inter_op_threads,
+    }
+    onnx_detector = OnnxSuperPointAlgorithm(
+        OnnxSuperPointConfig(model_path=str(superpoint_path), **threads)
+    )
+    onnx_matcher = OnnxSuperGlueMatcher(
+        OnnxSuperGlueConfig(model_path=str(superglue_path), **threads)
+    )
+
+    images = load_images(args)
+    report = {"superpoint": compare_detectors(images, detector, onnx_detector)}
+    pairs = build_warped_pairs(images, detector)
+    report["superglue"] = compare_matchers(pairs, matcher, onnx_matcher)
+
+    logger.info(f"ONNX Runtime report, torch against ONNX Runtime, {len(images)} images")
+    log_report(logger, report)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
@@ -0,0 +1,69 @@
+import argparse
+import json
+import logging
+
+from svl.keypoint_pipeline.detection_and_description import SuperPointAlgorithm
+from svl.keypoint_pipeline.evaluation import (
+    add_dataset_arguments,
+    build_warped_pairs,
+    compare_detectors,
+    compare_matchers,
+    evaluate_matcher,
+    load_images,
+    log_report,
+)
+from svl.keypoint_pipeline.matcher import SuperGlueMatcher
+from svl.keypoint_pipeline.typing import SuperGlueConfig, SuperPointConfig
+
+if __name__ == "__main__":
+    format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(format=format, level=logging.INFO, datefmt="%H:%M:%S")
+    logger = logging.getLogger("%s.report" % __name__)
+
+    parser = argparse.ArgumentParser(
+        description="Compare reduced precision inference against fp32 on a "
+        "georeference folder, each image being matched with a rotated and scaled "
+        "copy of itself"
+    )
+    add_dataset_arguments(parser)
+    parser.add_argument("--precision", default="bf16")
+    args = parser.parse_args()
+
+    images = load_images(args)
+    detectors = {
+        precision: SuperPointAlgorithm(
+            SuperPointConfig(device=args.device, precision=precision)
+        )
+        for precision in ["fp32", args.precision]
+    }
+    matchers = {
+        precision: SuperGlueMatcher(
+            SuperGlueConfig(
+                device=args.device,
+                weights=args.weights,
+                sinkhorn_iterations=args.sinkhorn_iterations,
+                precision=precision,
+            )
+        )
+        for precision in ["fp32", args.precision]
+    }
+
+    report = {
+        "superpoint": compare_detectors(
+            images, detectors["fp32"], detectors[args.precision]
+        )
+    }
+    reference_pairs = build_warped_pairs(images, detectors["fp32"])
+    report["superglue"] = compare_matchers(
+        reference_pairs, matchers["fp32"], matchers[args.precision]
+    )
+    report["end_to_end_fp32"] = evaluate_matcher(reference_pairs, matchers["fp32"])
+    report[f"end_to_end_{args.precision}"] = evaluate_matcher(
+        build_warped_pairs(images, detectors[args.precision]), matchers[args.precision]
+    )
+
+    logger.info(f"Precision report, fp32 against {args.precision}, {len(images)} images")
+    log_report(logger, report)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"precision": args.precision, **report}, file, indent=2)
@@ -0,0 +1,52 @@
+import argparse
+import json
+import logging
+
+from svl.keypoint_pipeline.detection_and_description import SuperPointAlgorithm
+from svl.keypoint_pipeline.evaluation import (
+    add_dataset_arguments,
+    build_warped_pairs,
+    compare_matchers,
+    load_images,
+    log_report,
+)
+from svl.keypoint_pipeline.matcher import SuperGlueMatcher
+from svl.keypoint_pipeline.typing import SuperGlueConfig, SuperPointConfig
+
+if __name__ == "__main__":
+    format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(format=format, level=logging.INFO, datefmt="%H:%M:%S")
+    logger = logging.getLogger("%s.report" % __name__)
+
+    parser = argparse.ArgumentParser(
+        description="Compare the int8 quantized SuperGlue against fp32 on a "
+        "georeference folder, each image being matched with a rotated and scaled "
+        "copy of itself"
+    )
+    add_dataset_arguments(parser)
+    parser.add_argument("--cache-dir", default="./dataset/cache/models/")
+    args = parser.parse_args()
+
+    images = load_images(args)
+    detector = SuperPointAlgorithm(SuperPointConfig(device=args.device))
+    matchers = {
+        quantize: SuperGlueMatcher(
+            SuperGlueConfig(
+                device=args.device,
+                weights=args.weights,
+                sinkhorn_iterations=args.sinkhorn_iterations,
+                quantize=quantize,
+                cache_dir=args.cache_dir,
+            )
+        )
+        for quantize in [False, True]
+    }
+
+    pairs = build_warped_pairs(images, detector)
+    report = {"superglue_int8": compare_matchers(pairs, matchers[False], matchers[True])}
+
+    logger.info(f"Quantization report, fp32 against int8, {len(images)} images")
+    log_report(logger, report)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
@@ -42,7 +42,7 @@
 
 from copy import deepcopy
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 import torch
 from torch import nn
@@ -72,6 +72,14 @@ def normalize_keypoints(kpts, image_shape):
     return (kpts - center[:, None, :]) / scaling[:, None, :]
 
 
+def normalize_keypoints_sizes(kpts, image_sizes):
+    """ Normalize keypoints locations based on per-item (height, width) sizes"""
+    size = image_sizes.to(kpts).flip(-1)
+    center = size / 2
+    scaling = size.max(1, keepdim=True).values * 0.7
+    return (kpts - center[:, None, :]) / scaling[:, None, :]
+
+
 class KeypointEncoder(nn.Module):
     """ Joint encoding of visual appearance and location using MLPs"""
     def __init__(self, feature_dim: int, layers: List[int]) -> None:
@@ -84,9 +92,11 @@ class KeypointEncoder(nn.Module):
         return self.encoder(torch.cat(inputs, dim=1))
 
 
-def attention(query: torch.Tensor, key: torch.Tensor, value: torch.Tensor) -> Tuple[torch.Tensor,torch.Tensor]:
+def attention(query: torch.Tensor, key: torch.Tensor, value: torch.Tensor, mask: Optional[torch.Tensor] = None) -> Tuple[torch.Tensor,torch.Tensor]:
     dim = query.shape[1]
     scores = torch.einsum('bdhn,bdhm->bhnm', query, key) / dim**.5
+    if mask is not None:  # ignore the padded keys
+        scores = scores.masked_fill(~mask[:, None, None, :], float('-inf'))
     prob = torch.nn.functional.softmax(scores, dim=-1)
     return torch.einsum('bhnm,bdhm->bdhn', prob, value), prob
 
@@ -101,11 +111,11 @@ class MultiHeadedAttention(nn.Module):
         self.merge = nn.Conv1d(d_model, d_model, kernel_size=1)
         self.proj = nn.ModuleList([deepcopy(self.merge) for _ in range(3)])
 
-    def forward(self, query: torch.Tensor, key: torch.Tensor, value: torch.Tensor) -> torch.Tensor:
+    def forward(self, query: torch.Tensor, key: torch.Tensor, value: torch.Tensor, mask: Optional[torch.Tensor] = None) -> torch.Tensor:
         batch_dim = query.size(0)
         query, key, value = [l(x).view(batch_dim, self.dim, self.num_heads, -1)
                              for l, x in zip(self.proj, (query, key, value))]
-        x, _ = attention(query, key, value)
+        x, _ = attention(query, key, value, mask)
         return self.merge(x.contiguous().view(batch_dim, self.dim*self.num_heads, -1))
 
 
@@ -116,8 +126,8 @@ class AttentionalPropagation(nn.Module):
         self.mlp = MLP([feature_dim*2, feature_dim*2, feature_dim])
         nn.init.constant_(self.mlp[-1].bias, 0.0)
 
-    def forward(self, x: torch.Tensor, source: torch.Tensor) -> torch.Tensor:
-        message = self.attn(x, source, source)
+    def forward(self, x: torch.Tensor, source: torch.Tensor, mask: Optional[torch.Tensor] = None) -> torch.Tensor:
+        message = self.attn(x, source, source, mask)
         return self.mlp(torch.cat([x, message], dim=1))
 
 
@@ -129,28 +139,117 @@ class AttentionalGNN(nn.Module):
             for _ in range(len(layer_names))])
         self.names = layer_names
 
-    def forward(self, desc0: torch.Tensor, desc1: torch.Tensor) -> Tuple[torch.Tensor,torch.Tensor]:
-        for layer, name in zip(self.layers, self.names):
+    def encode(self, desc: torch.Tensor, num_layers: int, mask: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """ Run the first num_layers layers, all 'self', on the descriptors of one image """
+        for layer, name in zip(self.layers[:num_layers], self.names[:num_layers]):
+            assert name == 'self'
+            desc = desc + layer(desc, desc, mask)
+        return desc
+
+    def forward(self, desc0: torch.Tensor, desc1: torch.Tensor, mask0: Optional[torch.Tensor] = None, mask1: Optional[torch.Tensor] = None, start: int = 0) -> Tuple[torch.Tensor,torch.Tensor]:
+        for layer, name in zip(self.layers[start:], self.names[start:]):
             if name == 'cross':
                 src0, src1 = desc1, desc0
+                smask0, smask1 = mask1, mask0
             else:  # if name == 'self':
                 src0, src1 = desc0, desc1
-            delta0, delta1 = layer(desc0, src0), layer(desc1, src1)
+                smask0, smask1 = mask0, mask1
+            delta0, delta1 = layer(desc0, src0, smask0), layer(desc1, src1, smask1)
             desc0, desc1 = (desc0 + delta0), (desc1 + delta1)
         return desc0, desc1
 
 
-def log_sinkhorn_iterations(Z: torch.Tensor, log_mu: torch.Tensor, log_nu: torch.Tensor, iters: int) -> torch.Tensor:
-    """ Perform Sinkhorn Normalization in Log-space for stability"""
+def sinkhorn_marginal_error(Z: torch.Tensor, u: torch.Tensor, v: torch.Tensor, log_mu: torch.Tensor, valid0: Optional[torch.Tensor] = None) -> torch.Tensor:
+    """ L1 error of the row marginals of the couplings, the largest of the batch
+
+    The column marginals are exact right after the update of v.
+    """
+    rows = torch.logsumexp(Z + v.unsqueeze(1), dim=2) + u
+    error = (rows.exp() - log_mu.exp()).abs()
+    if valid0 is not None:
+        error = error.masked_fill(~valid0, 0.)
+    return error.sum(1).max()
+
+
+def log_sinkhorn_iterations(Z: torch.Tensor, log_mu: torch.Tensor, log_nu: torch.Tensor, iters: int, tol: float = 0., check_every: int = 10) -> Tuple[torch.Tensor, int]:
+    """ Perform Sinkhorn Normalization in Log-space for stability
+
+    With a positive tol, the marginal error is checked every check_every
+    iterations and the normalization stops once it is below tol, iters being
+    the maximum number of iterations. Returns the normalized couplings and the
+    number of iterations run.
+    """
+    u, v = torch.zeros_like(log_mu), torch.zeros_like(log_nu)
+    num_iters = iters
+    for i in range(iters):
+        u = log_mu - torch.logsumexp(Z + v.unsqueeze(1), dim=2)
+        v = log_nu - torch.logsumexp(Z + u.unsqueeze(2), dim=1)
+        if tol > 0 and (i + 1) % check_every == 0 and i + 1 < iters:
+            if sinkhorn_marginal_error(Z, u, v, log_mu) < tol:
+                num_iters = i + 1
+                break
+    return Z + u.unsqueeze(2) + v.unsqueeze(1), num_iters
+
+
+def log_sinkhorn_iterations_masked(Z: torch.Tensor, log_mu: torch.Tensor, log_nu: torch.Tensor, iters: int, valid0: torch.Tensor, valid1: torch.Tensor, tol: float = 0., check_every: int = 10) -> Tuple[torch.Tensor, int]:
+    """ Perform Sinkhorn Normalization in Log-space on padded couplings
+
+    The couplings of the padded rows and columns are -inf and their potentials
+    are kept at 0, so that they take no mass and do not produce NaNs. The
+    normalization stops early as in log_sinkhorn_iterations(), once every item
+    of the batch has converged.
+    """
     u, v = torch.zeros_like(log_mu), torch.zeros_like(log_nu)
-    for _ in range(iters):
+    num_iters = iters
+    for i in range(iters):
         u = log_mu - torch.logsumexp(Z + v.unsqueeze(1), dim=2)
+        u = u.masked_fill(~valid0, 0.)
         v = log_nu - torch.logsumexp(Z + u.unsqueeze(2), dim=1)
-    return Z + u.unsqueeze(2) + v.unsqueeze(1)
+        v = v.masked_fill(~valid1, 0.)
+        if tol > 0 and (i + 1) % check_every == 0 and i + 1 < iters:
+            if sinkhorn_marginal_error(Z, u, v, log_mu, valid0) < tol:
+                num_iters = i + 1
+                break
+    return Z + u.unsqueeze(2) + v.unsqueeze(1), num_iters
+
 
+def log_optimal_transport_masked(scores: torch.Tensor, alpha: torch.Tensor, iters: int, mask0: torch.Tensor, mask1: torch.Tensor, tol: float = 0., check_every: int = 10) -> Tuple[torch.Tensor, int]:
+    """ Perform Optimal Transport in Log-space on a batch of padded score matrices
 
-def log_optimal_transport(scores: torch.Tensor, alpha: torch.Tensor, iters: int) -> torch.Tensor:
-    """ Perform Differentiable Optimal Transport in Log-space for stability"""
+    Each item of the batch has its own number of valid keypoints, given by the
+    masks, and is normalized as if it was run alone. Returns the log assignment
+    and the number of Sinkhorn iterations run.
+    """
+    b, m, n = scores.shape
+    ms = mask0.sum(1).to(scores)
+    ns = mask1.sum(1).to(scores)
+
+    bins0 = alpha.expand(b, m, 1)
+    bins1 = alpha.expand(b, 1, n)
+    alpha = alpha.expand(b, 1, 1)
+
+    couplings = torch.cat([torch.cat([scores, bins0], -1),
+                           torch.cat([bins1, alpha], -1)], 1)
+    valid0 = torch.cat([mask0, mask0.new_ones(b, 1)], 1)
+    valid1 = torch.cat([mask1, mask1.new_ones(b, 1)], 1)
+    couplings = couplings.masked_fill(
+        ~(valid0[:, :, None] & valid1[:, None, :]), float('-inf'))
+
+    norm = - (ms + ns).log()
+    log_mu = torch.cat([norm[:, None].expand(b, m), (ns.log() + norm)[:, None]], 1)
+    log_nu = torch.cat([norm[:, None].expand(b, n), (ms.log() + norm)[:, None]], 1)
+
+    Z, num_iters = log_sinkhorn_iterations_masked(
+        couplings, log_mu, log_nu, iters, valid0, valid1, tol, check_every)
+    Z = Z - norm[:, None, None]  # multiply probabilities by M+N
+    return Z, num_iters
+
+
+def log_optimal_transport(scores: torch.Tensor, alpha: torch.Tensor, iters: int, tol: float = 0., check_every: int = 10) -> Tuple[torch.Tensor, int]:
+    """ Perform Differentiable Optimal Transport in Log-space for stability
+
+    Returns the log assignment and the number of Sinkhorn iterations run.
+    """
     b, m, n = scores.shape
     one = scores.new_tensor(1)
     ms, ns = (m*one).to(scores), (n*one).to(scores)
@@ -167,9 +266,10 @@ def log_optimal_transport(scores: torch.Tensor, alpha: torch.Tensor, iters: int)
     log_nu = torch.cat([norm.expand(n), ms.log()[None] + norm])
     log_mu, log_nu = log_mu[None].expand(b, -1), log_nu[None].expand(b, -1)
 
-    Z = log_sinkhorn_iterations(couplings, log_mu, log_nu, iters)
+    Z, num_iters = log_sinkhorn_iterations(
+        couplings, log_mu, log_nu, iters, tol, check_every)
     Z = Z - norm  # multiply probabilities by M+N
-    return Z
+    return Z, num_iters
 
 
 def arange_like(x, dim: int):
@@ -200,6 +300,8 @@ class SuperGlue(nn.Module):
         'keypoint_encoder': [32, 64, 128, 256],
         'GNN_layers': ['self', 'cross'] * 9,
         'sinkhorn_iterations': 100,
+        'sinkhorn_tolerance': 0.,
+        'sinkhorn_check_interval': 10,
         'match_threshold': 0.2,
     }
 
@@ -227,10 +329,47 @@ class SuperGlue(nn.Module):
         print('Loaded SuperGlue model (\"{}\" weights)'.format(
             self.config['weights']))
 
+    @property
+    def num_image_layers(self) -> int:
+        """ Number of leading GNN layers that depend on a single image """
+        num_layers = 0
+        for name in self.config['GNN_layers']:
+            if name != 'self':
+                break
+            num_layers += 1
+        return num_layers
+
+    def encode(self, kpts, scores, desc, image_size, mask=None):
+        """Run the stages of SuperGlue that depend on a single image
+
+        The keypoint normalization, the keypoint encoder and the leading self
+        layers of the GNN only see one image, so their output can be computed
+        once per image and passed to forward() as 'encoded0' or 'encoded1'.
+        image_size holds the (height, width) of the images, shape (B, 2).
+        """
+        kpts = normalize_keypoints_sizes(kpts, image_size)
+        desc = desc + self.kenc(kpts, scores)
+        return self.gnn.encode(desc, self.num_image_layers, mask)
+
     def forward(self, data):
-        """Run SuperGlue on a pair of keypoints and descriptors"""
-        desc0, desc1 = data['descriptors0'], data['descriptors1']
+        """Run SuperGlue on a pair of keypoints and descriptors
+
+        A batch of pairs with different numbers of keypoints is padded to a
+        common length, with the boolean masks 'mask0' and 'mask1' of shape
+        (B, N) marking the valid keypoints, and the (height, width) of each
+        image given in 'image_size0' and 'image_size1' of shape (B, 2). Every
+        item must have at least one valid keypoint. The output of encode() may
+        be given in 'encoded0' and 'encoded1' instead of the descriptors and
+        scores, the keypoints are still required. With a positive
+        'sinkhorn_tolerance', the optimal transport stops once its marginals have
+        converged, and the number of iterations run is in 'sinkhorn_iterations'.
+        """
         kpts0, kpts1 = data['keypoints0'], data['keypoints1']
+        mask0, mask1 = data.get('mask0'), data.get('mask1')
+        is_masked = mask0 is not None or mask1 is not None
+        if is_masked:
+            mask0 = mask0 if mask0 is not None else kpts0.new_ones(kpts0.shape[:-1], dtype=torch.bool)
+            mask1 = mask1 if mask1 is not None else kpts1.new_ones(kpts1.shape[:-1], dtype=torch.bool)
 
         if kpts0.shape[1] == 0 or kpts1.shape[1] == 0:  # no keypoints
             shape0, shape1 = kpts0.shape[:-1], kpts1.shape[:-1]
@@ -239,18 +378,27 @@ class SuperGlue(nn.Module):
                 'matches1': kpts1.new_full(shape1, -1, dtype=torch.int),
                 'matching_scores0': kpts0.new_zeros(shape0),
                 'matching_scores1': kpts1.new_zeros(shape1),
+                'sinkhorn_iterations': 0,
             }
 
-        # Keypoint normalization.
-        kpts0 = normalize_keypoints(kpts0, data['image0'].shape)
-        kpts1 = normalize_keypoints(kpts1, data['image1'].shape)
-
-        # Keypoint MLP encoder.
-        desc0 = desc0 + self.kenc(kpts0, data['scores0'])
-        desc1 = desc1 + self.kenc(kpts1, data['scores1'])
+        # Keypoint normalization, MLP encoder and leading self layers.
+        encoded = []
+        for i, (kpts, mask) in enumerate([(kpts0, mask0), (kpts1, mask1)]):
+            if 'encoded{}'.format(i) in data:
+                encoded.append(data['encoded{}'.format(i)])
+                continue
+            image_size = data.get('image_size{}'.format(i))
+            if image_size is None:
+                _, _, height, width = data['image{}'.format(i)].shape
+                image_size = kpts.new_tensor([[height, width]]).expand(len(kpts), 2)
+            encoded.append(self.encode(
+                kpts, data['scores{}'.format(i)], data['descriptors{}'.format(i)],
+                image_size, mask))
+        desc0, desc1 = encoded
 
         # Multi-layer Transformer network.
-        desc0, desc1 = self.gnn(desc0, desc1)
+        desc0, desc1 = self.gnn(
+            desc0, desc1, mask0, mask1, start=self.num_image_layers)
 
         # Final MLP projection.
         mdesc0, mdesc1 = self.final_proj(desc0), self.final_proj(desc1)
@@ -259,10 +407,21 @@ class SuperGlue(nn.Module):
         scores = torch.einsum('bdn,bdm->bnm', mdesc0, mdesc1)
         scores = scores / self.config['descriptor_dim']**.5
 
-        # Run the optimal transport.
-        scores = log_optimal_transport(
-            scores, self.bin_score,
-            iters=self.config['sinkhorn_iterations'])
+        # Run the optimal transport, in fp32 under autocast.
+        scores = scores.float()
+        with torch.autocast(device_type=scores.device.type, enabled=False):
+            sinkhorn = {
+                'iters': self.config['sinkhorn_iterations'],
+                'tol': self.config['sinkhorn_tolerance'],
+                'check_every': self.config['sinkhorn_check_interval'],
+            }
+            if is_masked:
+                scores, num_iters = log_optimal_transport_masked(
+                    scores, self.bin_score.float(), mask0=mask0, mask1=mask1,
+                    **sinkhorn)
+            else:
+                scores, num_iters = log_optimal_transport(
+                    scores, self.bin_score.float(), **sinkhorn)
 
         # Get the matches with score above "match_threshold".
         max0, max1 = scores[:, :-1, :-1].max(2), scores[:, :-1, :-1].max(1)
@@ -274,6 +433,10 @@ class SuperGlue(nn.Module):
         mscores1 = torch.where(mutual1, mscores0.gather(1, indices1), zero)
         valid0 = mutual0 & (mscores0 > self.config['match_threshold'])
         valid1 = mutual1 & valid0.gather(1, indices1)
+        if is_masked:
+            valid0, valid1 = valid0 & mask0, valid1 & mask1
+            mscores0 = torch.where(mask0, mscores0, zero)
+            mscores1 = torch.where(mask1, mscores1, zero)
         indices0 = torch.where(valid0, indices0, indices0.new_tensor(-1))
         indices1 = torch.where(valid1, indices1, indices1.new_tensor(-1))
 
@@ -282,4 +445,5 @@ class SuperGlue(nn.Module):
             'matches1': indices1, # use -1 for invalid match
             'matching_scores0': mscores0,
             'matching_scores1': mscores1,
+            'sinkhorn_iterations': num_iters,
         }
@@ -142,10 +142,10 @@ class SuperPoint(nn.Module):
 
         print('Loaded SuperPoint model')
 
-    def forward(self, data):
-        """ Compute keypoints, scores, descriptors for image """
+    def compute_heads(self, image):
+        """ Compute the dense keypoint scores before NMS and the dense descriptors """
         # Shared Encoder
-        x = self.relu(self.conv1a(data['image']))
+        x = self.relu(self.conv1a(image))
         x = self.relu(self.conv1b(x))
         x = self.pool(x)
         x = self.relu(self.conv2a(x))
@@ -157,46 +157,84 @@ class SuperPoint(nn.Module):
         x = self.relu(self.conv4a(x))
         x = self.relu(self.conv4b(x))
 
-        # Compute the dense keypoint scores
+        # Compute the dense keypoint scores, in fp32 under autocast
         cPa = self.relu(self.convPa(x))
-        scores = self.convPb(cPa)
+        scores = self.convPb(cPa).float()
         scores = torch.nn.functional.softmax(scores, 1)[:, :-1]
         b, _, h, w = scores.shape
         scores = scores.permute(0, 2, 3, 1).reshape(b, h, w, 8, 8)
         scores = scores.permute(0, 1, 3, 2, 4).reshape(b, h*8, w*8)
-        scores = simple_nms(scores, self.config['nms_radius'])
-
-        # Extract keypoints
-        keypoints = [
-            torch.nonzero(s > self.config['keypoint_threshold'])
-            for s in scores]
-        scores = [s[tuple(k.t())] for s, k in zip(scores, keypoints)]
-
-        # Discard keypoints near the image borders
-        keypoints, scores = list(zip(*[
-            remove_borders(k, s, self.config['remove_borders'], h*8, w*8)
-            for k, s in zip(keypoints, scores)]))
-
-        # Keep the k keypoints with highest score
-        if self.config['max_keypoints'] >= 0:
-            keypoints, scores = list(zip(*[
-                top_k_keypoints(k, s, self.config['max_keypoints'])
-                for k, s in zip(keypoints, scores)]))
-
-        # Convert (h, w) to (x, y)
-        keypoints = [torch.flip(k, [1]).float() for k in keypoints]
 
         # Compute the dense descriptors
         cDa = self.relu(self.convDa(x))
-        descriptors = self.convDb(cDa)
+        descriptors = self.convDb(cDa).float()
         descriptors = torch.nn.functional.normalize(descriptors, p=2, dim=1)
+        return scores, descriptors
+
+    def compute_dense(self, image):
+        """ Compute the dense keypoint scores after NMS and the dense descriptors """
+        scores, descriptors = self.compute_heads(image)
+        return simple_nms(scores, self.config['nms_radius']), descriptors
+
+    def extract(self, scores, descriptors):
+        """ Extract keypoints, scores and descriptors of a batch at once
+
+        The thresholding, border removal, top-k selection and descriptor
+        sampling run on the whole batch instead of image by image. The
+        keypoints of each image are kept in raster order.
+        """
+        b, h, w = scores.shape
+        border = self.config['remove_borders']
+
+        # Discard keypoints below the threshold or near the image borders
+        valid = scores > self.config['keypoint_threshold']
+        valid[:, :border] = False
+        valid[:, h - border:] = False
+        valid[:, :, :border] = False
+        valid[:, :, w - border:] = False
+        indices = torch.nonzero(valid)
+        batch = indices[:, 0]
+        kpt_scores = scores[batch, indices[:, 1], indices[:, 2]]
+        counts = torch.bincount(batch, minlength=b)
+
+        # Keep the k keypoints with highest score of each image
+        k = self.config['max_keypoints']
+        if k >= 0 and len(batch) > 0:
+            _, order = torch.sort(kpt_scores, descending=True, stable=True)
+            _, by_image = torch.sort(batch[order], stable=True)
+            order = order[by_image]
+            starts = torch.cumsum(counts, 0) - counts
+            rank = torch.empty_like(order)
+            rank[order] = (torch.arange(len(order), device=order.device)
+                           - starts[batch[order]])
+            keep = rank < k
+            indices, batch, kpt_scores = indices[keep], batch[keep], kpt_scores[keep]
+            counts = torch.clamp(counts, max=k)
 
-        # Extract descriptors
-        descriptors = [sample_descriptors(k[None], d[None], 8)[0]
-                       for k, d in zip(keypoints, descriptors)]
-
+        # Convert (h, w) to (x, y)
+        keypoints = torch.flip(indices[:, 1:], [1]).float()
+
+        # Extract descriptors, padding the keypoints of each image to sample
+        # the whole batch in one call
+        n_max = int(counts.max()) if b > 0 else 0
+        if n_max > 0:
+            starts = torch.cumsum(counts, 0) - counts
+            position = torch.arange(len(batch), device=batch.device) - starts[batch]
+            grid = keypoints.new_zeros((b, n_max, 2))
+            grid[batch, position] = keypoints
+            sampled = sample_descriptors(grid, descriptors, 8)
+            sampled = sampled[batch, :, position]
+        else:
+            sampled = descriptors.new_zeros((0, descriptors.shape[1]))
+
+        counts = counts.tolist()
         return {
-            'keypoints': keypoints,
-            'scores': scores,
-            'descriptors': descriptors,
+            'keypoints': list(keypoints.split(counts)),
+            'scores': list(kpt_scores.split(counts)),
+            'descriptors': [d.t() for d in sampled.split(counts)],
         }
+
+    def forward(self, data):
+        """ Compute keypoints, scores, descriptors for image """
+        scores, descriptors = self.compute_dense(data['image'])
+        return self.extract(scores, descriptors)
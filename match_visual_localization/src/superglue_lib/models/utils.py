@@ -48,7 +48,10 @@ from collections import OrderedDict
 from threading import Thread
 import numpy as np
 import cv2
-import torch
+try:
+    import torch
+except ImportError:  # only needed by the tensor helpers
+    torch = None
 import matplotlib.pyplot as plt
 import matplotlib
 matplotlib.use('Agg')
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from typing import List, Tuple
 
 import numpy as np
 
@@ -61,4 +62,88 @@ class CombinedKeyPointAlgorithm(ABC):
         ImageKeyPoints
             keypoints and descriptors
         """
-        pass
\ No newline at end of file
+        pass
+
+    def detect_and_describe_keypoints_batch(
+        self, images: List[np.ndarray]
+    ) -> List[ImageKeyPoints]:
+        """
+        Detect and describe keypoints in several images. The default implementation
+        describes the images one by one, algorithms able to process a batch at once
+        should override it.
+
+        Parameters
+        ----------
+        images : List[np.ndarray]
+            images to detect and describe keypoints in
+
+        Returns
+        -------
+        List[ImageKeyPoints]
+            keypoints and descriptors of each image, in the order of the images
+        """
+        return [self.detect_and_describe_keypoints(image) for image in images]
+
+
+class KeyPointMatcher(ABC):
+    """Abstract class for keypoint matching."""
+
+    def __init__(self) -> None:
+        super().__init__()
+
+    @abstractmethod
+    def match_keypoints(
+        self, keypoints_1: ImageKeyPoints, keypoints_2: ImageKeyPoints
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Match keypoints between two images.
+
+        Parameters
+        ----------
+        keypoints_1 : ImageKeyPoints
+            keypoints from the first image
+        keypoints_2 : ImageKeyPoints
+            keypoints from the second image
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            index of the match in the second image of each keypoint of the first
+            image, -1 if unmatched, and the confidence of the matches
+        """
+        pass
+
+    def match_many(
+        self, query: ImageKeyPoints, candidates: List[ImageKeyPoints]
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Match the keypoints of a query image against several images. The default
+        implementation matches the pairs one by one, matchers able to process a
+        batch at once should override it.
+
+        Parameters
+        ----------
+        query : ImageKeyPoints
+            keypoints from the query image
+        candidates : List[ImageKeyPoints]
+            keypoints from the images to match the query against
+
+        Returns
+        -------
+        List[Tuple[np.ndarray, np.ndarray]]
+            matches and confidence of each candidate, see match_keypoints()
+        """
+        return [self.match_keypoints(query, candidate) for candidate in candidates]
+
+    def precompute(self, key_points: ImageKeyPoints) -> None:
+        """
+        Precompute the state of the matcher that depends on a single image and store
+        it in the cache of the keypoints, so that it is reused by every match
+        involving them. The default implementation does nothing.
+
+        Parameters
+        ----------
+        key_points : ImageKeyPoints
+            keypoints of the image
+        """
+        pass
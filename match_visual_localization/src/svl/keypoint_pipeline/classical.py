@@ -0,0 +1,210 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Union
+
+import cv2
+import numpy as np
+
+from svl.keypoint_pipeline.base import CombinedKeyPointAlgorithm
+from svl.keypoint_pipeline.typing import ImageKeyPoints, ORBConfig, SIFTConfig
+
+ClassicalConfig = Union[SIFTConfig, ORBConfig]
+
+# Detector of a worker process, created once by _init_worker()
+_worker_detector = None
+
+
+def create_detector(config: ClassicalConfig) -> cv2.Feature2D:
+    """Create the OpenCV detector of a configuration"""
+    if isinstance(config, SIFTConfig):
+        return cv2.SIFT_create(
+            nfeatures=config.max_keypoints,
+            contrastThreshold=config.contrast_threshold,
+            edgeThreshold=config.edge_threshold,
+        )
+    if isinstance(config, ORBConfig):
+        return cv2.ORB_create(
+            nfeatures=config.max_keypoints,
+            scaleFactor=config.scale_factor,
+            nlevels=config.num_levels,
+            fastThreshold=config.fast_threshold,
+        )
+    raise ValueError(f"Unsupported classical detector config {config}")
+
+
+def convert_descriptors(
+    config: ClassicalConfig, descriptors: Optional[np.ndarray]
+) -> np.ndarray:
+    """Convert the descriptors computed by OpenCV, None when there are none.
+
+    The SIFT descriptors are float32, L2 normalized, with the RootSIFT mapping if
+    enabled. The ORB descriptors are the packed uint8 bits, 32 bytes per keypoint.
+    """
+    if isinstance(config, ORBConfig):
+        return descriptors if descriptors is not None else np.zeros((0, 32), np.uint8)
+    if descriptors is None:
+        return np.zeros((0, 128), dtype=np.float32)
+    descriptors = descriptors.astype(np.float32)
+    if config.root_sift:
+        descriptors /= np.maximum(descriptors.sum(axis=1, keepdims=True), 1e-12)
+        return np.sqrt(descriptors)
+    return descriptors / np.maximum(
+        np.linalg.norm(descriptors, axis=1, keepdims=True), 1e-12
+    )
+
+
+def detect_and_describe(
+    detector: cv2.Feature2D, config: ClassicalConfig, image: np.ndarray
+) -> ImageKeyPoints:
+    """Detect and describe the keypoints of an image with an OpenCV detector
+
+    Parameters
+    ----------
+    detector : cv2.Feature2D
+        detector created by create_detector()
+    config : ClassicalConfig
+        configuration of the detector
+    image : np.ndarray
+        grayscale image
+
+    Returns
+    -------
+    ImageKeyPoints
+        keypoints with their responses as scores, see convert_descriptors() for
+        the descriptors
+    """
+    cv_keypoints, descriptors = detector.detectAndCompute(image, None)
+    keypoints = np.array([kp.pt for kp in cv_keypoints], dtype=np.float32).reshape(
+        -1, 2
+    )
+    scores = np.array([kp.response for kp in cv_keypoints], dtype=np.float32)
+    return ImageKeyPoints(
+        keypoints=keypoints,
+        descriptors=convert_descriptors(config, descriptors),
+        scores=scores,
+        image_size=list(image.shape[:2]),
+    )
+
+
+def _init_worker(config: ClassicalConfig) -> None:
+    global _worker_detector
+    # One OpenCV thread per worker, the parallelism is over the images
+    cv2.setNumThreads(1)
+    _worker_detector = create_detector(config)
+
+
+def _worker_detect_and_describe(
+    config: ClassicalConfig, image: np.ndarray
+) -> ImageKeyPoints:
+    return detect_and_describe(_worker_detector, config, image)
+
+
+@CombinedKeyPointAlgorithm.register
+class ClassicalKeyPointAlgorithm(CombinedKeyPointAlgorithm):
+    """SIFT or ORB keypoint algorithm from OpenCV, which does not need torch.
+
+    With num_workers in the config, the batches are described on a pool of
+    processes, each with its own detector. The pool is created on the first
+    batch and kept until close() is called.
+
+    Parameters
+    ----------
+    config : ClassicalConfig
+        configuration of SIFT or ORB
+    """
+
+    def __init__(self, config: ClassicalConfig) -> None:
+        super().__init__()
+        self.config = config
+        self.detector = create_detector(config)
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def close(self) -> None:
+        """Shut down the process pool, if any"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def detect_and_describe_keypoints(self, image: np.ndarray) -> ImageKeyPoints:
+        """
+        Detect and describe keypoints in an image.
+
+        Parameters
+        ----------
+        image : np.ndarray
+            grayscale image to detect keypoints in
+
+        Returns
+        -------
+        ImageKeyPoints
+            keypoints with their descriptors
+        """
+        return detect_and_describe(self.detector, self.config, image)
+
+    def detect_and_describe_keypoints_batch(
+        self, images: List[np.ndarray]
+    ) -> List[ImageKeyPoints]:
+        """
+        Detect and describe keypoints in several images, on the process pool if
+        the config has workers.
+
+        Parameters
+        ----------
+        images : List[np.ndarray]
+            grayscale images to detect keypoints in
+
+        Returns
+        -------
+        List[ImageKeyPoints]
+            keypoints with their descriptors, in the order of the images
+        """
+        if self.config.num_workers <= 1 or len(images) <= 1:
+            return [self.detect_and_describe_keypoints(image) for image in images]
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.config.num_workers,
+                initializer=_init_worker,
+                initargs=(self.config,),
+            )
+        return list(
+            self._pool.map(
+                _worker_detect_and_describe, [self.config] * len(images), images
+            )
+        )
+
+    def detect_keypoints(self, image: np.ndarray) -> np.ndarray:
+        """
+        Detect keypoints in an image.
+
+        Parameters
+        ----------
+        image : np.ndarray
+            image to detect keypoints in
+
+        Returns
+        -------
+        np.ndarray
+            keypoints
+        """
+        return self.detect_and_describe_keypoints(image).keypoints
+
+    def describe_keypoints(self, image: np.ndarray, keypoints: np.ndarray) -> np.ndarray:
+        """
+        Describe keypoints in an image.
+
+        Parameters
+        ----------
+        image : np.ndarray
+            image to describe keypoints in
+        keypoints : np.ndarray
+            (x, y) keypoints to describe, shape (N, 2)
+
+        Returns
+        -------
+        np.ndarray
+            descriptors, in the format of detect_and_describe_keypoints(). OpenCV
+            may drop the keypoints it cannot describe, e.g. near the borders.
+        """
+        size = 31.0 if isinstance(self.config, ORBConfig) else 8.0
+        cv_keypoints = [cv2.KeyPoint(float(x), float(y), size) for x, y in keypoints]
+        _, descriptors = self.detector.compute(image, cv_keypoints)
+        return convert_descriptors(self.config, descriptors)
@@ -0,0 +1,429 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from svl.keypoint_pipeline.typing import ImageKeyPoints
+
+
+def simple_nms(scores: np.ndarray, nms_radius: int) -> np.ndarray:
+    """Non-maximum suppression of a dense score map, same as the one of SuperPoint
+
+    Parameters
+    ----------
+    scores : np.ndarray
+        dense scores, shape (H, W), float32
+    nms_radius : int
+        radius of the suppression in pixels
+
+    Returns
+    -------
+    np.ndarray
+        scores with the suppressed pixels set to 0
+    """
+    kernel = np.ones((nms_radius * 2 + 1, nms_radius * 2 + 1), dtype=np.uint8)
+
+    def max_pool(x: np.ndarray) -> np.ndarray:
+        return cv2.dilate(x, kernel)
+
+    zeros = np.zeros_like(scores)
+    max_mask = scores == max_pool(scores)
+    for _ in range(2):
+        supp_mask = max_pool(max_mask.astype(np.float32)) > 0
+        supp_scores = np.where(supp_mask, zeros, scores)
+        new_max_mask = supp_scores == max_pool(supp_scores)
+        max_mask = max_mask | (new_max_mask & ~supp_mask)
+    return np.where(max_mask, scores, zeros)
+
+
+def sample_descriptors(
+    keypoints: np.ndarray, descriptors: np.ndarray, s: int = 8
+) -> np.ndarray:
+    """Bilinear interpolation of the dense descriptors at keypoint locations, same
+    as the grid sampling of SuperPoint
+
+    Parameters
+    ----------
+    keypoints : np.ndarray
+        (x, y) keypoints in pixels, shape (N, 2)
+    descriptors : np.ndarray
+        dense descriptors, shape (D, H / s, W / s)
+    s : int, optional
+        size of the cells of the dense descriptors, by default 8
+
+    Returns
+    -------
+    np.ndarray
+        L2 normalized descriptors, shape (N, D)
+    """
+    _, h, w = descriptors.shape
+    # Pixel to cell coordinates, as grid_sample with align_corners=True
+    x = (keypoints[:, 0] - s / 2 + 0.5) / (w * s - s / 2 - 0.5) * (w - 1)
+    y = (keypoints[:, 1] - s / 2 + 0.5) / (h * s - s / 2 - 0.5) * (h - 1)
+    x0, y0 = np.floor(x).astype(np.int64), np.floor(y).astype(np.int64)
+
+    sampled = np.zeros((descriptors.shape[0], len(keypoints)), dtype=np.float32)
+    for dx in (0, 1):
+        for dy in (0, 1):
+            xi, yi = x0 + dx, y0 + dy
+            weight = (1 - np.abs(x - xi)) * (1 - np.abs(y - yi))
+            # Zero padding outside of the map
+            inside = (xi >= 0) & (xi < w) & (yi >= 0) & (yi < h)
+            weight = np.where(inside, weight, 0).astype(np.float32)
+            sampled += (
+                descriptors[:, np.clip(yi, 0, h - 1), np.clip(xi, 0, w - 1)] * weight
+            )
+    norm = np.linalg.norm(sampled, axis=0, keepdims=True)
+    return (sampled / np.maximum(norm, 1e-12)).T
+
+
+def extract_keypoints(
+    scores: np.ndarray,
+    descriptors: np.ndarray,
+    keypoint_threshold: float,
+    max_keypoints: int,
+    remove_borders: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Extract the keypoints of one image from the dense outputs of SuperPoint
+    after NMS, same as SuperPoint.extract()
+
+    Parameters
+    ----------
+    scores : np.ndarray
+        dense scores after NMS, shape (H, W)
+    descriptors : np.ndarray
+        dense descriptors, shape (D, H / 8, W / 8)
+    keypoint_threshold : float
+        minimum score of the keypoints
+    max_keypoints : int
+        maximum number of keypoints, -1 for no limit
+    remove_borders : int
+        width in pixels of the borders without keypoints
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        (x, y) keypoints (N, 2) in raster order, scores (N,) and descriptors (N, D)
+    """
+    h, w = scores.shape
+    valid = scores > keypoint_threshold
+    valid[:remove_borders] = False
+    valid[h - remove_borders :] = False
+    valid[:, :remove_borders] = False
+    valid[:, w - remove_borders :] = False
+    ys, xs = np.nonzero(valid)
+    kpt_scores = scores[ys, xs]
+
+    # Keep the k keypoints with highest score, in raster order
+    if 0 <= max_keypoints < len(kpt_scores):
+        keep = np.sort(np.argsort(-kpt_scores, kind="stable")[:max_keypoints])
+        ys, xs, kpt_scores = ys[keep], xs[keep], kpt_scores[keep]
+
+    keypoints = np.stack([xs, ys], axis=1).astype(np.float32)
+    return keypoints, kpt_scores, sample_descriptors(keypoints, descriptors)
+
+
+@dataclass
+class DenseHeads:
+    """Dense outputs of SuperPoint for one image, before NMS and extraction.
+
+    Parameters
+    ----------
+    scores : np.ndarray
+        dense keypoint scores before NMS, shape (H, W), float32
+    descriptors : np.ndarray
+        dense L2 normalized descriptors, shape (D, H / 8, W / 8), float32
+    """
+
+    scores: np.ndarray
+    descriptors: np.ndarray
+
+    @property
+    def image_size(self) -> List[int]:
+        """Size (height, width) of the image"""
+        return list(self.scores.shape)
+
+    @property
+    def nbytes(self) -> int:
+        """Number of bytes of the outputs"""
+        return self.scores.nbytes + self.descriptors.nbytes
+
+    def extract(
+        self,
+        nms_radius: int,
+        keypoint_threshold: float,
+        max_keypoints: int,
+        remove_borders: int = 4,
+    ) -> ImageKeyPoints:
+        """
+        Extract the keypoints of the image, same as SuperPoint after its heads.
+
+        Parameters
+        ----------
+        nms_radius : int
+            radius of the non-maximum suppression in pixels
+        keypoint_threshold : float
+            minimum score of the keypoints
+        max_keypoints : int
+            maximum number of keypoints, -1 for no limit
+        remove_borders : int, optional
+            width in pixels of the borders without keypoints, by default 4
+
+        Returns
+        -------
+        ImageKeyPoints
+            keypoints with their descriptors
+        """
+        if max_keypoints == 0 or max_keypoints < -1:
+            raise ValueError('"max_keypoints" must be positive or "-1"')
+        keypoints, scores, descriptors = extract_keypoints(
+            simple_nms(self.scores, nms_radius),
+            self.descriptors,
+            keypoint_threshold,
+            max_keypoints,
+            remove_borders,
+        )
+        return ImageKeyPoints(
+            keypoints=keypoints,
+            descriptors=descriptors,
+            scores=scores,
+            image_size=self.image_size,
+        )
+
+
+class DenseHeadsCache:
+    """Cache of the dense outputs of SuperPoint, in memory and optionally on disk.
+
+    The memory cache is a least recently used cache bounded by a byte budget. On
+    disk, the entries are grouped in one directory per model, named after a
+    fingerprint of its description, e.g. its weights and precision, see
+    `namespace`. Each entry is a compressed `.npz` file named after its key, so
+    the keys must be valid file names, e.g. the names of the map images. Like
+    in the FeatureCache, an entry holds the hash of the image it was computed
+    on and is stale when the image under its key changes. The detection
+    parameters are applied when the keypoints are extracted from the entries.
+
+    Parameters
+    ----------
+    cache_dir : Union[str, Path], optional
+        directory of the entries on disk, created if missing, by default None to
+        only cache in memory
+    max_bytes : int, optional
+        maximum number of bytes held in memory, by default None for no limit
+    half : bool, optional
+        store the entries on disk in float16, halving their size, and round them
+        to float16 in memory too, by default False
+    logger : logging.Logger, optional
+        logger to use for logging, by default None
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[Union[str, Path]] = None,
+        max_bytes: Optional[int] = None,
+        half: bool = False,
+        logger: logging.Logger = None,
+    ) -> None:
+        if max_bytes is not None and max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.half = half
+        if logger is None:
+            logger = logging.getLogger(__name__)
+        self.logger = logger
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[str, DenseHeads]]" = (
+            OrderedDict()
+        )
+        self._nbytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self) -> int:
+        """Number of bytes held in memory"""
+        return self._nbytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def hash_image(image: np.ndarray) -> str:
+        """Hash of the content of an image array, including its shape and dtype
+
+        Parameters
+        ----------
+        image : np.ndarray
+            image given to the model
+
+        Returns
+        -------
+        str
+            hexadecimal digest of the image
+        """
+        image = np.ascontiguousarray(image)
+        sha1 = hashlib.sha1(f"{image.dtype.str}{image.shape}".encode("utf-8"))
+        sha1.update(memoryview(image).cast("B"))
+        return sha1.hexdigest()
+
+    def namespace(self, model: Dict[str, Any]) -> str:
+        """Get the namespace of the entries computed by a model.
+
+        The namespace is a fingerprint of the description of the model and of the
+        storage precision of the entries. With a cache directory, the directory
+        of the namespace is created along with a `config.json` file holding the
+        description if it does not exist yet.
+
+        Parameters
+        ----------
+        model : Dict[str, Any]
+            JSON serializable description of the model, e.g. the signature of its
+            weights and its precision, see SuperPointAlgorithm.dense_config()
+
+        Returns
+        -------
+        str
+            fingerprint of the model
+        """
+        description = {
+            "model": model,
+            "storage": "float16" if self.half else "float32",
+        }
+        encoded = json.dumps(description, sort_keys=True, default=str).encode("utf-8")
+        namespace = hashlib.sha1(encoded).hexdigest()[:16]
+        if self.cache_dir is not None and not (self.cache_dir / namespace).exists():
+            (self.cache_dir / namespace).mkdir(parents=True, exist_ok=True)
+            with open(self.cache_dir / namespace / "config.json", "w") as file:
+                json.dump(description, file, indent=2, default=str)
+        return namespace
+
+    def path(self, namespace: str, key: str) -> Optional[Path]:
+        """Path of the entry of a key on disk, None without cache directory"""
+        if self.cache_dir is None:
+            return None
+        return self.cache_dir / namespace / f"{key}.npz"
+
+    def get(self, namespace: str, key: str, content_hash: str) -> Optional[DenseHeads]:
+        """Get the dense outputs of an image, from memory or else from disk
+
+        Parameters
+        ----------
+        namespace : str
+            namespace of the model, see `namespace`
+        key : str
+            key of the image
+        content_hash : str
+            hash of the image, see `hash_image`
+
+        Returns
+        -------
+        Optional[DenseHeads]
+            the dense outputs, None if they are not cached or stale
+        """
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is not None and entry[0] == content_hash:
+                self._entries.move_to_end((namespace, key))
+                self.hits += 1
+                return entry[1]
+
+        path = self.path(namespace, key)
+        if path is None or not path.exists():
+            self.misses += 1
+            return None
+        try:
+            with np.load(path) as data:
+                if str(data["content_hash"]) != content_hash:
+                    self.misses += 1
+                    return None
+                heads = DenseHeads(
+                    scores=data["scores"].astype(np.float32),
+                    descriptors=data["descriptors"].astype(np.float32),
+                )
+        except (OSError, ValueError, KeyError) as error:
+            self.logger.warning(f"Ignoring unreadable dense cache entry {path}: {error}")
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._remember(namespace, key, content_hash, heads)
+        return heads
+
+    def put(
+        self, namespace: str, key: str, content_hash: str, heads: DenseHeads
+    ) -> DenseHeads:
+        """Store the dense outputs of an image in memory and on disk
+
+        With half, the outputs are rounded to float16 in memory too, so that the
+        keypoints extracted from an entry do not depend on where it is read from.
+
+        Parameters
+        ----------
+        namespace : str
+            namespace of the model, see `namespace`
+        key : str
+            key of the image
+        content_hash : str
+            hash of the image, see `hash_image`
+        heads : DenseHeads
+            the dense outputs
+
+        Returns
+        -------
+        DenseHeads
+            the stored outputs, to use instead of `heads`
+        """
+        dtype = np.float16 if self.half else np.float32
+        if self.half:
+            heads = DenseHeads(
+                scores=heads.scores.astype(dtype).astype(np.float32),
+                descriptors=heads.descriptors.astype(dtype).astype(np.float32),
+            )
+        self._remember(namespace, key, content_hash, heads)
+        path = self.path(namespace, key)
+        if path is None:
+            return heads
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as file:
+            np.savez_compressed(
+                file,
+                content_hash=np.array(content_hash),
+                scores=heads.scores.astype(dtype),
+                descriptors=heads.descriptors.astype(dtype),
+            )
+        os.replace(tmp_path, path)
+        return heads
+
+    def _remember(
+        self, namespace: str, key: str, content_hash: str, heads: DenseHeads
+    ) -> None:
+        with self._lock:
+            previous = self._entries.pop((namespace, key), None)
+            if previous is not None:
+                self._nbytes -= previous[1].nbytes
+            self._entries[(namespace, key)] = (content_hash, heads)
+            self._nbytes += heads.nbytes
+            # Evict the least recently used entries, always keeping the newest one
+            while (
+                self.max_bytes is not None
+                and self._nbytes > self.max_bytes
+                and len(self._entries) > 1
+            ):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+
+    def clear(self) -> None:
+        """Empty the memory cache, the entries on disk are kept"""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
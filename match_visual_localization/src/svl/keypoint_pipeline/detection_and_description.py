@@ -1,18 +1,25 @@
 import dataclasses
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import numpy as np
 import torch
 
+import superglue_lib.models.superpoint as superpoint_module
 from superglue_lib.models.superpoint import SuperPoint
-from superglue_lib.models.utils import frame2tensor
 
 from svl.keypoint_pipeline.typing import ImageKeyPoints, SuperPointConfig
-from svl.keypoint_pipeline.base import (
-    CombinedKeyPointAlgorithm,
-    KeyPointDescriptor,
-    KeyPointDetector,
+from svl.keypoint_pipeline.base import CombinedKeyPointAlgorithm
+from svl.keypoint_pipeline.dense import DenseHeads, DenseHeadsCache
+from svl.keypoint_pipeline.export import export_or_fallback, trace_superpoint
+from svl.keypoint_pipeline.model_cache import ModelCache
+from svl.keypoint_pipeline.precision import autocast, check_precision
+
+SUPERPOINT_WEIGHTS = (
+    Path(superpoint_module.__file__).parent / "weights/superpoint_v1.pth"
 )
 
+
 @CombinedKeyPointAlgorithm.register
 class SuperPointAlgorithm(CombinedKeyPointAlgorithm):
     """SuperPoint Keypoint Algorithm that can be used to detect and describe keypoints.
@@ -20,15 +27,47 @@ class SuperPointAlgorithm(CombinedKeyPointAlgorithm):
     Parameters
     ----------
     config : SuperPointConfig
-        configuration for SuperPoint
+        configuration for SuperPoint. With a reduced precision, the encoder runs
+        under autocast and the keypoint extraction runs in fp32. With jit, the
+        encoder and the NMS run as a traced TorchScript module, cached in
+        cache_dir if given, and the eager model is used if tracing fails.
     """
 
     def __init__(self, config: SuperPointConfig) -> None:
         super().__init__()
+        check_precision(config.precision)
         self.config = config
         self.detector = SuperPoint(dataclasses.asdict(config))
         self.detector = self.detector.eval()
         self.detector = self.detector.to(config.device)
+        self.compute_dense = self.detector.compute_dense
+        if config.jit:
+            traced = export_or_fallback("SuperPoint", self._load_traced)
+            if traced is not None:
+                self.compute_dense = traced
+
+    def _load_traced(self) -> torch.jit.ScriptModule:
+        """Trace the dense part of SuperPoint, or load it from the model cache"""
+        if self.config.precision != "fp32":
+            raise ValueError("Traced SuperPoint does not support autocast")
+
+        def build() -> torch.jit.ScriptModule:
+            return trace_superpoint(self.detector, self.config.device)
+
+        if self.config.cache_dir is None:
+            return build()
+        config = {
+            "nms_radius": self.config.nms_radius,
+            "device": self.config.device,
+            "weights_file": ModelCache.file_signature(SUPERPOINT_WEIGHTS),
+        }
+        return ModelCache(self.config.cache_dir).load_or_build(
+            "superpoint_traced",
+            config,
+            build,
+            save=lambda model, path: torch.jit.save(model, str(path)),
+            load=lambda path: torch.jit.load(str(path), map_location=self.config.device),
+        )
 
     def detect_and_describe_keypoints(self, image: np.ndarray) -> ImageKeyPoints:
         """
@@ -45,17 +84,204 @@ class SuperPointAlgorithm(CombinedKeyPointAlgorithm):
             keypoints with their descriptors
         """
 
-        tensor = frame2tensor(image, self.config.device)
-        data = {
-            "image": tensor,
+        return self.detect_and_describe_keypoints_batch([image])[0]
+
+    def detect_and_describe_keypoints_batch(
+        self, images: List[np.ndarray]
+    ) -> List[ImageKeyPoints]:
+        """
+        Detect keypoints in several grayscale images using SuperPoint.
+
+        The images are grouped by shape and each group runs through a single
+        forward pass, with the keypoint extraction vectorized over the group.
+
+        Parameters
+        ----------
+        images : List[np.ndarray]
+            grayscale images to detect keypoints in
+
+        Returns
+        -------
+        List[ImageKeyPoints]
+            keypoints with their descriptors, in the order of the images
+        """
+        key_points = [None] * len(images)
+        for indices, tensor in self._shape_batches(images):
+            height, width = tensor.shape[-2:]
+            with torch.no_grad():
+                with autocast(self.config.device, self.config.precision):
+                    scores, descriptors = self.compute_dense(tensor)
+                outputs = self.detector.extract(scores, descriptors)
+            for position, idx in enumerate(indices):
+                key_points[idx] = (
+                    ImageKeyPoints(
+                        keypoints=outputs["keypoints"][position],
+                        descriptors=outputs["descriptors"][position].transpose(1, 0),
+                        scores=outputs["scores"][position],
+                        image_size=[height, width],
+                    )
+                    .to("cpu")
+                    .numpy()
+                )
+        return key_points
+
+    def _shape_batches(
+        self, images: List[np.ndarray]
+    ) -> Iterator[Tuple[List[int], torch.Tensor]]:
+        """Group images by shape, yielding the index of the images of each group
+        and their normalized tensor on the device, shape (B, 1, H, W)"""
+        buckets: Dict[Tuple[int, int], List[int]] = {}
+        for idx, image in enumerate(images):
+            buckets.setdefault(image.shape[:2], []).append(idx)
+        for indices in buckets.values():
+            batch = np.stack([images[idx] for idx in indices])
+            tensor = torch.from_numpy(batch).float().div_(255.0)[:, None]
+            yield indices, tensor.to(self.config.device)
+
+    def dense_config(self) -> Dict[str, Any]:
+        """Description of the model computing the dense outputs, which namespaces
+        them in a DenseHeadsCache
+
+        Returns
+        -------
+        Dict[str, Any]
+            JSON serializable description of the weights and of the precision
+        """
+        return {
+            "algorithm": self.__class__.__name__,
+            "weights_file": ModelCache.file_signature(SUPERPOINT_WEIGHTS),
+            "precision": self.config.precision,
         }
-        with torch.no_grad():
-            outputs = self.detector(data)
-        outputs = {k: v[0] for k, v in outputs.items()}
-        outputs["descriptors"] = outputs["descriptors"].transpose(1, 0)
-        outputs["image_size"] = [image.shape[0], image.shape[1]]
-        outputs = ImageKeyPoints(**outputs).to("cpu").numpy()
-        return outputs
+
+    def compute_heads_batch(self, images: List[np.ndarray]) -> List[DenseHeads]:
+        """
+        Compute the dense outputs of SuperPoint, before NMS and keypoint
+        extraction, see extract_from_heads().
+
+        The heads always come from the eager model, as the traced one only
+        outputs the scores after NMS.
+
+        Parameters
+        ----------
+        images : List[np.ndarray]
+            grayscale images
+
+        Returns
+        -------
+        List[DenseHeads]
+            dense outputs on the CPU, in the order of the images
+        """
+        heads = [None] * len(images)
+        for indices, tensor in self._shape_batches(images):
+            with torch.no_grad():
+                with autocast(self.config.device, self.config.precision):
+                    scores, descriptors = self.detector.compute_heads(tensor)
+            scores = scores.float().cpu().numpy()
+            descriptors = descriptors.float().cpu().numpy()
+            for position, idx in enumerate(indices):
+                heads[idx] = DenseHeads(
+                    scores=scores[position], descriptors=descriptors[position]
+                )
+        return heads
+
+    def extract_from_heads(
+        self,
+        heads: DenseHeads,
+        nms_radius: Optional[int] = None,
+        keypoint_threshold: Optional[float] = None,
+        max_keypoints: Optional[int] = None,
+    ) -> ImageKeyPoints:
+        """
+        Extract the keypoints of an image from its dense outputs in NumPy,
+        without running the network. With the parameters of the config, the
+        keypoints are the ones of detect_and_describe_keypoints().
+
+        Parameters
+        ----------
+        heads : DenseHeads
+            dense outputs of the image, see compute_heads_batch()
+        nms_radius : Optional[int], optional
+            radius of the non-maximum suppression, by default the one of the config
+        keypoint_threshold : Optional[float], optional
+            minimum score of the keypoints, by default the one of the config
+        max_keypoints : Optional[int], optional
+            maximum number of keypoints, -1 for no limit, by default the one of
+            the config
+
+        Returns
+        -------
+        ImageKeyPoints
+            keypoints with their descriptors
+        """
+        if nms_radius is None:
+            nms_radius = self.config.nms_radius
+        if keypoint_threshold is None:
+            keypoint_threshold = self.config.keypoint_threshold
+        if max_keypoints is None:
+            max_keypoints = self.config.max_keypoints
+        return heads.extract(
+            nms_radius,
+            keypoint_threshold,
+            max_keypoints,
+            self.detector.config["remove_borders"],
+        )
+
+    def detect_and_describe_keypoints_cached(
+        self,
+        images: List[np.ndarray],
+        keys: List[str],
+        cache: DenseHeadsCache,
+        nms_radius: Optional[int] = None,
+        keypoint_threshold: Optional[float] = None,
+        max_keypoints: Optional[int] = None,
+    ) -> List[ImageKeyPoints]:
+        """
+        Detect keypoints in several images, running the network only on the
+        images whose dense outputs are not in the cache yet. The entries are
+        namespaced by the weights and the precision of the model, see
+        dense_config(), and checked against the hash of the images, so a changed
+        image under the same key is computed again. The detection parameters can
+        change between calls, e.g. for a parameter sweep or an adaptive keypoint
+        budget, without invalidating the cache.
+
+        Parameters
+        ----------
+        images : List[np.ndarray]
+            grayscale images to detect keypoints in
+        keys : List[str]
+            key of each image in the cache, e.g. its name
+        cache : DenseHeadsCache
+            cache of the dense outputs
+        nms_radius : Optional[int], optional
+            radius of the non-maximum suppression, by default the one of the config
+        keypoint_threshold : Optional[float], optional
+            minimum score of the keypoints, by default the one of the config
+        max_keypoints : Optional[int], optional
+            maximum number of keypoints, -1 for no limit, by default the one of
+            the config
+
+        Returns
+        -------
+        List[ImageKeyPoints]
+            keypoints with their descriptors, in the order of the images
+        """
+        if len(images) != len(keys):
+            raise ValueError("images and keys must have the same length")
+        namespace = cache.namespace(self.dense_config())
+        content_hashes = [cache.hash_image(image) for image in images]
+        heads = [
+            cache.get(namespace, key, content_hash)
+            for key, content_hash in zip(keys, content_hashes)
+        ]
+        missing = [idx for idx, entry in enumerate(heads) if entry is None]
+        if missing:
+            computed = self.compute_heads_batch([images[idx] for idx in missing])
+            for idx, entry in zip(missing, computed):
+                heads[idx] = cache.put(namespace, keys[idx], content_hashes[idx], entry)
+        return [
+            self.extract_from_heads(entry, nms_radius, keypoint_threshold, max_keypoints)
+            for entry in heads
+        ]
 
     def detect_keypoints(self, image: np.ndarray) -> np.ndarray:
         """
@@ -71,17 +297,7 @@ class SuperPointAlgorithm(CombinedKeyPointAlgorithm):
         np.ndarray
             keypoints
         """
-        tensor = frame2tensor(image, self.config.device)
-        data = {
-            "image": tensor,
-        }
-        with torch.no_grad():
-            outputs = self.detector(data)
-        outputs = {k: v[0] for k, v in outputs.items()}
-        outputs["descriptors"] = outputs["descriptors"].transpose(1, 0)
-        outputs["image_size"] = [image.shape[0], image.shape[1]]
-        outputs = ImageKeyPoints(**outputs).to("cpu").numpy()
-        return outputs.keypoints
+        return self.detect_and_describe_keypoints(image).keypoints
 
     def describe_keypoints(self, image: np.ndarray, keypoints: np.ndarray) -> np.ndarray:
         raise NotImplementedError("SuperPoint does not support describing keypoints.")
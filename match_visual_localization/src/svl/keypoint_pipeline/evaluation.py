@@ -0,0 +1,363 @@
+import argparse
+import logging
+import time
+from typing import Callable, Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+from svl.keypoint_pipeline.base import CombinedKeyPointAlgorithm, KeyPointMatcher
+from svl.keypoint_pipeline.typing import ImageKeyPoints
+
+Pair = Tuple[ImageKeyPoints, ImageKeyPoints, np.ndarray]
+
+
+def keypoint_agreement(
+    reference: ImageKeyPoints, candidate: ImageKeyPoints, radius: float = 1.0
+) -> Dict[str, float]:
+    """Compare the keypoints of an image extracted by two variants of a detector
+
+    Parameters
+    ----------
+    reference : ImageKeyPoints
+        keypoints of the reference variant, e.g. in fp32
+    candidate : ImageKeyPoints
+        keypoints of the compared variant
+    radius : float, optional
+        distance in pixels under which two keypoints are the same, by default 1.0
+
+    Returns
+    -------
+    Dict[str, float]
+        number of keypoints of both variants, fraction of the reference keypoints
+        found by the candidate (repeatability) and mean cosine similarity of the
+        descriptors of the keypoints found by both
+    """
+    reference, candidate = reference.numpy(), candidate.numpy()
+    result = {
+        "reference_keypoints": float(len(reference)),
+        "candidate_keypoints": float(len(candidate)),
+        "repeatability": 0.0,
+        "descriptor_similarity": 0.0,
+    }
+    if len(reference) == 0 or len(candidate) == 0:
+        return result
+
+    distances = np.linalg.norm(
+        reference.keypoints[:, None, :] - candidate.keypoints[None, :, :], axis=-1
+    )
+    nearest = distances.argmin(axis=1)
+    found = distances[np.arange(len(reference)), nearest] <= radius
+    result["repeatability"] = float(found.mean())
+    if found.any():
+        similarity = np.sum(
+            reference.descriptors[found] * candidate.descriptors[nearest[found]],
+            axis=1,
+        )
+        result["descriptor_similarity"] = float(similarity.mean())
+    return result
+
+
+def match_agreement(
+    reference_matches: np.ndarray, candidate_matches: np.ndarray
+) -> Dict[str, float]:
+    """Compare the matches of the same keypoints given by two variants of a matcher
+
+    Parameters
+    ----------
+    reference_matches : np.ndarray
+        matches of the reference variant, -1 for unmatched keypoints
+    candidate_matches : np.ndarray
+        matches of the compared variant, -1 for unmatched keypoints
+
+    Returns
+    -------
+    Dict[str, float]
+        number of matches of both variants and Jaccard index of the match sets,
+        1.0 when both are empty
+    """
+    reference = {
+        (i, int(reference_matches[i])) for i in np.flatnonzero(reference_matches > -1)
+    }
+    candidate = {
+        (i, int(candidate_matches[i])) for i in np.flatnonzero(candidate_matches > -1)
+    }
+    union = reference | candidate
+    return {
+        "reference_matches": float(len(reference)),
+        "candidate_matches": float(len(candidate)),
+        "jaccard": len(reference & candidate) / len(union) if union else 1.0,
+    }
+
+
+def warp_image(
+    image: np.ndarray, angle: float = 15.0, scale: float = 0.9
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Rotate and scale an image around its center to build a pair with a known
+    transform
+
+    Parameters
+    ----------
+    image : np.ndarray
+        image to warp
+    angle : float, optional
+        rotation in degrees, by default 15.0
+    scale : float, optional
+        scale factor, by default 0.9
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        warped image and affine transform from the image to the warped image,
+        shape (2, 3)
+    """
+    height, width = image.shape[:2]
+    transform = cv2.getRotationMatrix2D((width / 2, height / 2), angle, scale)
+    return cv2.warpAffine(image, transform, (width, height)), transform
+
+
+def match_precision(
+    keypoints_1: ImageKeyPoints,
+    keypoints_2: ImageKeyPoints,
+    matches: np.ndarray,
+    transform: np.ndarray,
+    threshold: float = 3.0,
+) -> Dict[str, float]:
+    """Measure the matches of a pair related by a known affine transform
+
+    Parameters
+    ----------
+    keypoints_1 : ImageKeyPoints
+        keypoints of the first image
+    keypoints_2 : ImageKeyPoints
+        keypoints of the second image
+    matches : np.ndarray
+        index of the match in the second image of each keypoint of the first
+        image, -1 if unmatched
+    transform : np.ndarray
+        affine transform from the first to the second image, shape (2, 3)
+    threshold : float, optional
+        reprojection error in pixels under which a match is correct, by default 3.0
+
+    Returns
+    -------
+    Dict[str, float]
+        number of matches, number of correct matches and their fraction
+    """
+    valid = matches > -1
+    points_1 = keypoints_1.numpy().keypoints[valid]
+    points_2 = keypoints_2.numpy().keypoints[matches[valid]]
+    projected = points_1 @ transform[:, :2].T + transform[:, 2]
+    correct = np.linalg.norm(projected - points_2, axis=1) <= threshold
+    return {
+        "matches": float(valid.sum()),
+        "correct_matches": float(correct.sum()),
+        "precision": float(correct.mean()) if len(correct) else 0.0,
+    }
+
+
+def timed(fct: Callable, *args) -> Tuple[object, float]:
+    """Call a function and measure its duration in seconds"""
+    start = time.perf_counter()
+    result = fct(*args)
+    return result, time.perf_counter() - start
+
+
+def mean_metrics(rows: List[Dict[str, float]]) -> Dict[str, float]:
+    """Average metrics computed on several images or pairs"""
+    return {key: float(np.mean([row[key] for row in rows])) for key in rows[0]}
+
+
+def build_warped_pairs(
+    images: List[np.ndarray], algorithm: CombinedKeyPointAlgorithm
+) -> List[Pair]:
+    """Pair each image with a rotated and scaled copy of itself, see warp_image()
+
+    Parameters
+    ----------
+    images : List[np.ndarray]
+        images to build the pairs from
+    algorithm : CombinedKeyPointAlgorithm
+        algorithm describing both images of the pairs
+
+    Returns
+    -------
+    List[Pair]
+        keypoints of the image, keypoints of the warped image and transform
+    """
+    pairs = []
+    for image in images:
+        warped, transform = warp_image(image)
+        key_points = algorithm.detect_and_describe_keypoints_batch([image, warped])
+        pairs.append((key_points[0], key_points[1], transform))
+    return pairs
+
+
+def compare_detectors(
+    images: List[np.ndarray],
+    reference: CombinedKeyPointAlgorithm,
+    candidate: CombinedKeyPointAlgorithm,
+) -> Dict[str, float]:
+    """Compare two variants of a detector, see keypoint_agreement()
+
+    Returns
+    -------
+    Dict[str, float]
+        mean keypoint agreement and mean latency of both variants in milliseconds
+    """
+    rows = []
+    for image in images:
+        reference_kp, reference_time = timed(
+            reference.detect_and_describe_keypoints, image
+        )
+        candidate_kp, candidate_time = timed(
+            candidate.detect_and_describe_keypoints, image
+        )
+        row = keypoint_agreement(reference_kp, candidate_kp)
+        row.update(reference_ms=reference_time * 1e3, candidate_ms=candidate_time * 1e3)
+        rows.append(row)
+    return mean_metrics(rows)
+
+
+def compare_matchers(
+    pairs: List[Pair], reference: KeyPointMatcher, candidate: KeyPointMatcher
+) -> Dict[str, float]:
+    """Compare two variants of a matcher on the same keypoints, see
+    match_agreement() and match_precision()
+
+    Returns
+    -------
+    Dict[str, float]
+        mean match agreement, mean match precision and mean latency of both
+        variants in milliseconds
+    """
+    rows = []
+    for keypoints_1, keypoints_2, transform in pairs:
+        (reference_matches, _), reference_time = timed(
+            reference.match_keypoints, keypoints_1, keypoints_2
+        )
+        (candidate_matches, _), candidate_time = timed(
+            candidate.match_keypoints, keypoints_1, keypoints_2
+        )
+        row = match_agreement(reference_matches, candidate_matches)
+        row.update(
+            reference_precision=match_precision(
+                keypoints_1, keypoints_2, reference_matches, transform
+            )["precision"],
+            candidate_precision=match_precision(
+                keypoints_1, keypoints_2, candidate_matches, transform
+            )["precision"],
+            reference_ms=reference_time * 1e3,
+            candidate_ms=candidate_time * 1e3,
+        )
+        rows.append(row)
+    return mean_metrics(rows)
+
+
+def evaluate_matcher(pairs: List[Pair], matcher: KeyPointMatcher) -> Dict[str, float]:
+    """Mean match precision of a matcher on pairs with a known transform"""
+    rows = []
+    for keypoints_1, keypoints_2, transform in pairs:
+        matches, _ = matcher.match_keypoints(keypoints_1, keypoints_2)
+        rows.append(match_precision(keypoints_1, keypoints_2, matches, transform))
+    return mean_metrics(rows)
+
+
+def evaluate_retrieval(
+    images: List[np.ndarray],
+    algorithm: CombinedKeyPointAlgorithm,
+    matcher: KeyPointMatcher,
+) -> Dict[str, float]:
+    """Localize a rotated and scaled copy of each image among all the images, as
+    the pipeline does with a drone image and the map tiles
+
+    The map keypoints are described and precomputed once, each query is matched
+    against all of them with match_many() and the image with the most matches is
+    the retrieved one.
+
+    Parameters
+    ----------
+    images : List[np.ndarray]
+        map images, also warped to build the queries, see warp_image()
+    algorithm : CombinedKeyPointAlgorithm
+        algorithm describing the map images and the queries
+    matcher : KeyPointMatcher
+        matcher of the queries against the map images
+
+    Returns
+    -------
+    Dict[str, float]
+        hit rate of the retrieval, mean match precision with the true image, and
+        mean latency of the description and of the matching of a query in
+        milliseconds
+    """
+    map_key_points = algorithm.detect_and_describe_keypoints_batch(images)
+    for key_points in map_key_points:
+        matcher.precompute(key_points)
+
+    rows = []
+    for idx, image in enumerate(images):
+        warped, transform = warp_image(image)
+        query, describe_time = timed(algorithm.detect_and_describe_keypoints, warped)
+        results, match_time = timed(matcher.match_many, query, map_key_points)
+        num_matches = [np.sum(matches > -1) for matches, _ in results]
+        # Matches go from the warped image to the image, invert the transform
+        inverse = cv2.invertAffineTransform(transform)
+        rows.append(
+            {
+                "hit_rate": float(np.argmax(num_matches) == idx),
+                "precision": match_precision(
+                    query, map_key_points[idx], results[idx][0], inverse
+                )["precision"],
+                "describe_ms": describe_time * 1e3,
+                "match_ms": match_time * 1e3,
+            }
+        )
+    return mean_metrics(rows)
+
+
+def add_dataset_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the arguments shared by the report scripts to a parser"""
+    parser.add_argument("--db-path", default="./dataset/georeference/")
+    parser.add_argument("--resize-size", type=int, nargs="+", default=[800])
+    parser.add_argument("--max-images", type=int, default=None)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--weights", default="outdoor")
+    parser.add_argument("--sinkhorn-iterations", type=int, default=20)
+    parser.add_argument("--output", default=None, help="JSON file of the report")
+
+
+def load_images(args: argparse.Namespace) -> List[np.ndarray]:
+    """Load the resized images of the georeference folder given to a report script
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        arguments of the script, see add_dataset_arguments()
+
+    Returns
+    -------
+    List[np.ndarray]
+        the first max_images images of the folder
+    """
+    # Imported here to keep the keypoint pipeline independent of the localization
+    from svl.localization.map_reader import SatelliteMapReader
+
+    map_reader = SatelliteMapReader(
+        db_path=args.db_path,
+        resize_size=tuple(args.resize_size),
+        logger=logging.getLogger("%s.SatelliteMapReader" % __name__),  # noqa
+    )
+    map_reader.initialize_db()
+    map_reader.setup_db()
+    map_reader.resize_db_images()
+    count = min(len(map_reader), args.max_images or len(map_reader))
+    return [map_reader[idx].image for idx in range(count)]
+
+
+def log_report(logger: logging.Logger, report: Dict[str, Dict[str, float]]) -> None:
+    """Log the sections of a report, one metric per line"""
+    for section, values in report.items():
+        logger.info(section)
+        for key, value in values.items():
+            logger.info(f"    {key:>24}: {value:.4f}")
@@ -0,0 +1,335 @@
+import inspect
+import logging
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+import torch
+from torch import nn
+
+from superglue_lib.models.superglue import (
+    AttentionalGNN,
+    SuperGlue,
+    log_optimal_transport,
+)
+from superglue_lib.models.superpoint import SuperPoint
+
+
+class ExportError(RuntimeError):
+    """Raised when a traced model does not reproduce the eager model."""
+
+
+class SuperPointDense(nn.Module):
+    """Dense part of SuperPoint, from the image to the NMS scores and descriptors.
+
+    The keypoint extraction that follows has a data dependent number of keypoints
+    and stays eager.
+    """
+
+    def __init__(self, superpoint: SuperPoint) -> None:
+        super().__init__()
+        self.superpoint = superpoint
+
+    def forward(self, image: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        return self.superpoint.compute_dense(image)
+
+
+class SuperPointHeads(nn.Module):
+    """Encoder and heads of SuperPoint, from the image to the dense scores before
+    NMS and the dense descriptors, as exported to ONNX.
+    """
+
+    def __init__(self, superpoint: SuperPoint) -> None:
+        super().__init__()
+        self.superpoint = superpoint
+
+    def forward(self, image: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        return self.superpoint.compute_heads(image)
+
+
+class SuperGlueScores(nn.Module):
+    """SuperGlue from the keypoints of a pair to the log assignment matrix after
+    the optimal transport, as exported to ONNX. The mutual check and the
+    thresholding of the matches are left to the caller.
+    """
+
+    def __init__(self, superglue: SuperGlue) -> None:
+        super().__init__()
+        self.superglue = superglue
+
+    def forward(
+        self,
+        keypoints0: torch.Tensor,
+        scores0: torch.Tensor,
+        descriptors0: torch.Tensor,
+        image_size0: torch.Tensor,
+        keypoints1: torch.Tensor,
+        scores1: torch.Tensor,
+        descriptors1: torch.Tensor,
+        image_size1: torch.Tensor,
+    ) -> torch.Tensor:
+        superglue = self.superglue
+        desc0 = superglue.encode(keypoints0, scores0, descriptors0, image_size0)
+        desc1 = superglue.encode(keypoints1, scores1, descriptors1, image_size1)
+        desc0, desc1 = superglue.gnn(
+            desc0, desc1, None, None, superglue.num_image_layers
+        )
+        mdesc0, mdesc1 = superglue.final_proj(desc0), superglue.final_proj(desc1)
+        scores = torch.einsum("bdn,bdm->bnm", mdesc0, mdesc1)
+        scores = scores / superglue.config["descriptor_dim"] ** 0.5
+        assignment, _ = log_optimal_transport(
+            scores, superglue.bin_score, iters=superglue.config["sinkhorn_iterations"]
+        )
+        return assignment
+
+
+class GNNFromLayer(nn.Module):
+    """Layers of the SuperGlue GNN starting at a given layer, without padding masks"""
+
+    def __init__(self, gnn: AttentionalGNN, start: int) -> None:
+        super().__init__()
+        self.gnn = gnn
+        self.start = start
+
+    def forward(
+        self, desc0: torch.Tensor, desc1: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        return self.gnn(desc0, desc1, None, None, self.start)
+
+
+class TracedGNN(nn.Module):
+    """SuperGlue GNN running a traced module on the unmasked pairs.
+
+    The traced module only covers the layers from `start` without padding masks,
+    the masked batches of match_many() and the single-image encoding run the
+    eager GNN.
+
+    Parameters
+    ----------
+    gnn : AttentionalGNN
+        eager GNN
+    traced : torch.jit.ScriptModule
+        traced GNNFromLayer
+    start : int
+        first layer of the traced module
+    """
+
+    def __init__(
+        self, gnn: AttentionalGNN, traced: torch.jit.ScriptModule, start: int
+    ) -> None:
+        super().__init__()
+        self.gnn = gnn
+        self.traced = traced
+        self.start = start
+
+    def encode(
+        self, desc: torch.Tensor, num_layers: int, mask: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        return self.gnn.encode(desc, num_layers, mask)
+
+    def forward(
+        self,
+        desc0: torch.Tensor,
+        desc1: torch.Tensor,
+        mask0: Optional[torch.Tensor] = None,
+        mask1: Optional[torch.Tensor] = None,
+        start: int = 0,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        if mask0 is None and mask1 is None and start == self.start:
+            return self.traced(desc0, desc1)
+        return self.gnn(desc0, desc1, mask0, mask1, start)
+
+
+def _check_close(
+    name: str,
+    expected: Tuple[torch.Tensor, ...],
+    actual: Tuple[torch.Tensor, ...],
+    atol: float,
+) -> None:
+    for expected_tensor, actual_tensor in zip(expected, actual):
+        if expected_tensor.shape != actual_tensor.shape or not torch.allclose(
+            expected_tensor, actual_tensor, atol=atol
+        ):
+            raise ExportError(f"Traced {name} does not match the eager model")
+
+
+def trace_superpoint(
+    superpoint: SuperPoint, device: str, atol: float = 1e-4
+) -> torch.jit.ScriptModule:
+    """Trace the dense part of SuperPoint and check it on another image size
+
+    Parameters
+    ----------
+    superpoint : SuperPoint
+        SuperPoint model in eval mode
+    device : str
+        device of the model
+    atol : float, optional
+        tolerance of the check against the eager model, by default 1e-4
+
+    Returns
+    -------
+    torch.jit.ScriptModule
+        traced SuperPointDense
+    """
+    dense = SuperPointDense(superpoint).eval()
+    example = torch.rand(1, 1, 240, 320, device=device)
+    check = torch.rand(2, 1, 256, 352, device=device)
+    with torch.no_grad():
+        traced = torch.jit.trace(dense, example, check_trace=False)
+        _check_close("SuperPoint", dense(check), traced(check), atol)
+    return traced
+
+
+def trace_superglue_gnn(
+    superglue: SuperGlue, device: str, atol: float = 1e-4
+) -> torch.jit.ScriptModule:
+    """Trace the pair stage of the SuperGlue GNN and check it on other keypoint
+    counts, since the number of keypoints changes with every image
+
+    Parameters
+    ----------
+    superglue : SuperGlue
+        SuperGlue model in eval mode
+    device : str
+        device of the model
+    atol : float, optional
+        tolerance of the check against the eager model, by default 1e-4
+
+    Returns
+    -------
+    torch.jit.ScriptModule
+        traced GNNFromLayer
+    """
+    gnn = GNNFromLayer(superglue.gnn, superglue.num_image_layers).eval()
+    dim = superglue.config["descriptor_dim"]
+    example = (torch.randn(1, dim, 64, device=device), torch.randn(1, dim, 48, device=device))
+    check = (torch.randn(2, dim, 100, device=device), torch.randn(2, dim, 37, device=device))
+    with torch.no_grad():
+        traced = torch.jit.trace(gnn, example, check_trace=False)
+        _check_close("SuperGlue GNN", gnn(*check), traced(*check), atol)
+    return traced
+
+
+def _onnx_export(*args, **kwargs) -> None:
+    """torch.onnx.export with the TorchScript based exporter, which handles the
+    dynamic axes without onnxscript on the torch versions where it is not the
+    default
+    """
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False
+    torch.onnx.export(*args, **kwargs)
+
+
+def export_superpoint_onnx(
+    superpoint: SuperPoint, path: Union[str, Path], opset_version: int = 17
+) -> None:
+    """Export the encoder and heads of SuperPoint to ONNX, see SuperPointHeads
+
+    The graph takes a (B, 1, H, W) float image in [0, 1] and returns the dense
+    scores before NMS, shape (B, H, W), and the dense descriptors, shape
+    (B, D, H / 8, W / 8), with dynamic batch size and image size.
+
+    Parameters
+    ----------
+    superpoint : SuperPoint
+        SuperPoint model in eval mode, on CPU
+    path : Union[str, Path]
+        path of the ONNX file
+    opset_version : int, optional
+        ONNX opset, by default 17
+    """
+    with torch.no_grad():
+        _onnx_export(
+            SuperPointHeads(superpoint).eval(),
+            (torch.rand(1, 1, 240, 320),),
+            str(path),
+            input_names=["image"],
+            output_names=["scores", "descriptors"],
+            dynamic_axes={
+                "image": {0: "batch", 2: "height", 3: "width"},
+                "scores": {0: "batch", 1: "height", 2: "width"},
+                "descriptors": {0: "batch", 2: "cells_height", 3: "cells_width"},
+            },
+            opset_version=opset_version,
+        )
+
+
+def export_superglue_onnx(
+    superglue: SuperGlue, path: Union[str, Path], opset_version: int = 17
+) -> None:
+    """Export SuperGlue up to the optimal transport to ONNX, see SuperGlueScores
+
+    The graph takes the keypoints (1, N, 2), scores (1, N), descriptors (1, D, N)
+    and (height, width) image size (1, 2) of both images, and returns the log
+    assignment matrix, shape (1, N0 + 1, N1 + 1), with dynamic keypoint counts.
+    The number of Sinkhorn iterations of the config is part of the graph, without
+    early stopping.
+
+    Parameters
+    ----------
+    superglue : SuperGlue
+        SuperGlue model in eval mode, on CPU
+    path : Union[str, Path]
+        path of the ONNX file
+    opset_version : int, optional
+        ONNX opset, by default 17
+    """
+    dim = superglue.config["descriptor_dim"]
+    example = []
+    for n in [64, 48]:
+        example += [
+            torch.rand(1, n, 2) * 320,
+            torch.rand(1, n),
+            torch.nn.functional.normalize(torch.randn(1, dim, n), dim=1),
+            torch.tensor([[240, 320]]),
+        ]
+    names = [
+        f"{name}{idx}"
+        for idx in range(2)
+        for name in ["keypoints", "scores", "descriptors", "image_size"]
+    ]
+    dynamic_axes = {f"keypoints{idx}": {1: f"num_keypoints{idx}"} for idx in range(2)}
+    dynamic_axes.update({f"scores{idx}": {1: f"num_keypoints{idx}"} for idx in range(2)})
+    dynamic_axes.update(
+        {f"descriptors{idx}": {2: f"num_keypoints{idx}"} for idx in range(2)}
+    )
+    dynamic_axes["assignment"] = {1: "rows", 2: "columns"}
+    with torch.no_grad():
+        _onnx_export(
+            SuperGlueScores(superglue).eval(),
+            tuple(example),
+            str(path),
+            input_names=names,
+            output_names=["assignment"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset_version,
+        )
+
+
+def export_or_fallback(
+    name: str,
+    export,
+    logger: Optional[logging.Logger] = None,
+) -> Optional[torch.jit.ScriptModule]:
+    """Run an export function, returning None if the traced model is not usable
+
+    Parameters
+    ----------
+    name : str
+        name of the exported model, for logging
+    export : Callable[[], torch.jit.ScriptModule]
+        function exporting the model, e.g. loading it from a ModelCache
+    logger : Optional[logging.Logger], optional
+        logger to use for logging, by default None
+
+    Returns
+    -------
+    Optional[torch.jit.ScriptModule]
+        the exported model, or None to run the eager model
+    """
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    try:
+        return export()
+    except Exception as e:
+        logger.warning(f"Unable to export {name}, running the eager model: {e}")
+        return None
@@ -0,0 +1,473 @@
+from itertools import combinations
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from svl.keypoint_pipeline.base import KeyPointMatcher
+from svl.keypoint_pipeline.typing import HammingLSHConfig, ImageKeyPoints
+
+# Number of set bits of every byte, for numpy versions without bitwise_count
+_POPCOUNT_TABLE = np.array([bin(value).count("1") for value in range(256)], np.uint8)
+
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    """Number of set bits of each element of an unsigned integer array"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    as_bytes = values.view(np.uint8).reshape(values.shape + (-1,))
+    return _POPCOUNT_TABLE[as_bytes].sum(axis=-1, dtype=np.uint8)
+
+
+def _as_words(descriptors: np.ndarray) -> np.ndarray:
+    """View packed descriptors as 64-bit words when their size allows it"""
+    descriptors = np.ascontiguousarray(descriptors, dtype=np.uint8)
+    if descriptors.shape[1] % 8 == 0:
+        return descriptors.view(np.uint64)
+    return descriptors
+
+
+def hamming_distances(
+    descriptors_1: np.ndarray, descriptors_2: np.ndarray
+) -> np.ndarray:
+    """Hamming distances between all the pairs of two sets of binary descriptors
+
+    The distances are accumulated word by word, which keeps the temporaries at the
+    size of the distance matrix.
+
+    Parameters
+    ----------
+    descriptors_1 : np.ndarray
+        packed descriptors, shape (N, B), uint8
+    descriptors_2 : np.ndarray
+        packed descriptors, shape (M, B), uint8
+
+    Returns
+    -------
+    np.ndarray
+        distances in bits, shape (N, M), uint16
+    """
+    words_1, words_2 = _as_words(descriptors_1), _as_words(descriptors_2)
+    distances = np.zeros((len(words_1), len(words_2)), dtype=np.uint16)
+    for word in range(words_1.shape[1]):
+        distances += popcount(np.bitwise_xor.outer(words_1[:, word], words_2[:, word]))
+    return distances
+
+
+def pair_distances(
+    descriptors_1: np.ndarray,
+    descriptors_2: np.ndarray,
+    rows: np.ndarray,
+    columns: np.ndarray,
+) -> np.ndarray:
+    """Hamming distances of selected pairs of binary descriptors
+
+    Parameters
+    ----------
+    descriptors_1 : np.ndarray
+        packed descriptors, shape (N, B), uint8
+    descriptors_2 : np.ndarray
+        packed descriptors, shape (M, B), uint8
+    rows : np.ndarray
+        index of the pairs in the first descriptors, shape (P,)
+    columns : np.ndarray
+        index of the pairs in the second descriptors, shape (P,)
+
+    Returns
+    -------
+    np.ndarray
+        distances in bits, shape (P,), int32
+    """
+    words_1, words_2 = _as_words(descriptors_1), _as_words(descriptors_2)
+    return popcount(words_1[rows] ^ words_2[columns]).sum(axis=-1, dtype=np.int32)
+
+
+def probe_masks(key_bits: int, probe_radius: int) -> np.ndarray:
+    """XOR masks of the buckets probed around a key: the key itself and every key
+    with at most probe_radius bits flipped
+
+    Returns
+    -------
+    np.ndarray
+        masks, shape (P,), int64
+    """
+    masks = [0]
+    for radius in range(1, probe_radius + 1):
+        for bits in combinations(range(key_bits), radius):
+            masks.append(sum(1 << bit for bit in bits))
+    return np.array(masks, dtype=np.int64)
+
+
+def match_pairs(
+    rows: np.ndarray,
+    columns: np.ndarray,
+    distances: np.ndarray,
+    num_rows: int,
+    num_columns: int,
+    ratio_threshold: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Mutual nearest neighbours among candidate pairs, with a ratio test
+
+    Parameters
+    ----------
+    rows : np.ndarray
+        index of the pairs in the first image, shape (P,)
+    columns : np.ndarray
+        index of the pairs in the second image, shape (P,), without duplicate pair
+    distances : np.ndarray
+        Hamming distances of the pairs, shape (P,)
+    num_rows : int
+        number of keypoints of the first image
+    num_columns : int
+        number of keypoints of the second image
+    ratio_threshold : float
+        maximum ratio of the distance to the best match over the one to the second
+        best candidate, 1.0 to disable the ratio test
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        index of the match of each row, -1 if unmatched, and distance of the
+        matches, -1 if unmatched
+    """
+    matches = np.full(num_rows, -1, dtype=np.int64)
+    best_distances = np.full(num_rows, -1, dtype=np.int64)
+    if len(rows) == 0:
+        return matches, best_distances
+
+    # Sort by a single integer key, faster than a lexsort
+    span = int(distances.max()) + 1
+
+    # Best and second best candidate of each row
+    order = np.argsort(rows * span + distances)
+    rows, columns, distances = rows[order], columns[order], distances[order]
+    first = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    best_rows, best_columns = rows[first], columns[first]
+    best = distances[first].astype(np.float64)
+    has_second = np.r_[first[1:], len(rows)] - first > 1
+    second = np.where(
+        has_second, distances[np.minimum(first + 1, len(rows) - 1)], np.inf
+    )
+    valid = best < ratio_threshold * second if ratio_threshold < 1.0 else True
+
+    # Best row of each column
+    order = np.argsort(columns * span + distances)
+    column_first = order[np.r_[True, columns[order][1:] != columns[order][:-1]]]
+    column_best = np.full(num_columns, -1, dtype=np.int64)
+    column_best[columns[column_first]] = rows[column_first]
+
+    valid = valid & (column_best[best_columns] == best_rows)
+    matches[best_rows[valid]] = best_columns[valid]
+    best_distances[best_rows[valid]] = best[valid]
+    return matches, best_distances
+
+
+def hash_keys(descriptors: np.ndarray, bit_positions: np.ndarray) -> np.ndarray:
+    """LSH keys of binary descriptors in every table
+
+    Parameters
+    ----------
+    descriptors : np.ndarray
+        packed descriptors, shape (N, B), uint8
+    bit_positions : np.ndarray
+        bits sampled by each table, shape (L, K)
+
+    Returns
+    -------
+    np.ndarray
+        key of every descriptor in every table, shape (L, N), int64
+    """
+    key_bits = bit_positions.shape[1]
+    bits = np.unpackbits(np.asarray(descriptors, dtype=np.uint8), axis=1)
+    weights = np.int64(1) << np.arange(key_bits, dtype=np.int64)
+    return (bits[:, bit_positions] @ weights).T
+
+
+def _expand_ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Concatenation of the ranges [start, start + count)"""
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return offsets + np.arange(len(offsets))
+
+
+def key_dtype(key_bits: int) -> np.dtype:
+    """Smallest dtype holding the keys of key_bits bits"""
+    return np.dtype(np.uint32 if key_bits <= 32 else np.int64)
+
+
+def probe_keys(
+    query_keys: np.ndarray, masks: np.ndarray, key_bits: int
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Keys of the buckets probed by query descriptors in every table, sorted
+    once per query so that looking them up in the index of each map image is a
+    search of sorted values
+
+    Parameters
+    ----------
+    query_keys : np.ndarray
+        keys of the query descriptors, shape (L, Q), see hash_keys()
+    masks : np.ndarray
+        XOR masks of the probed buckets, see probe_masks()
+    key_bits : int
+        number of bits of the keys
+
+    Returns
+    -------
+    List[Tuple[np.ndarray, np.ndarray]]
+        for every table, the sorted probed keys and the query descriptor of each,
+        shape (Q * P,)
+    """
+    probes = []
+    for keys in query_keys:
+        table_probes = (keys[:, None] ^ masks[None]).ravel()
+        order = np.argsort(table_probes)
+        probes.append(
+            (table_probes[order].astype(key_dtype(key_bits)), order // len(masks))
+        )
+    return probes
+
+
+class HammingLSHIndex:
+    """Multi-probe LSH index of the binary descriptors of an image.
+
+    Each table hashes a descriptor by sampling key_bits of its bits. For every
+    table, the descriptors are sorted by key and the distinct keys are stored
+    with the start of their bucket, so that the index takes memory proportional
+    to the number of descriptors. The probed buckets are found by binary searches
+    of the distinct keys in the sorted probed keys of the query, see
+    probe_keys().
+
+    Parameters
+    ----------
+    descriptors : np.ndarray
+        packed descriptors, shape (N, B), uint8
+    bit_positions : np.ndarray
+        bits sampled by each table, shape (L, K)
+    """
+
+    def __init__(self, descriptors: np.ndarray, bit_positions: np.ndarray) -> None:
+        self.descriptors = np.ascontiguousarray(descriptors, dtype=np.uint8)
+        # Per table: descriptors sorted by key, distinct keys and bucket starts
+        self.order: List[np.ndarray] = []
+        self.bucket_keys: List[np.ndarray] = []
+        self.bucket_starts: List[np.ndarray] = []
+        dtype = key_dtype(bit_positions.shape[1])
+        for keys in hash_keys(self.descriptors, bit_positions):
+            order = np.argsort(keys, kind="stable")
+            bucket_keys, starts = np.unique(keys[order], return_index=True)
+            self.order.append(order.astype(np.int32))
+            self.bucket_keys.append(bucket_keys.astype(dtype))
+            self.bucket_starts.append(np.append(starts, len(keys)).astype(np.int32))
+
+    def __len__(self) -> int:
+        return len(self.descriptors)
+
+    def candidates(
+        self, probes: List[Tuple[np.ndarray, np.ndarray]], max_bucket_size: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Candidate pairs of query descriptors and indexed descriptors sharing a
+        probed bucket in at least one table.
+
+        Parameters
+        ----------
+        probes : List[Tuple[np.ndarray, np.ndarray]]
+            probed keys of the query descriptors in every table, see probe_keys()
+        max_bucket_size : int
+            buckets larger than this are skipped, they come from uninformative
+            bits and would only add distant candidates
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            index of the pairs in the query and in the index, without duplicates
+        """
+        rows, columns = [], []
+        for table, (keys, query_rows) in enumerate(probes):
+            bucket_keys = self.bucket_keys[table]
+            starts = self.bucket_starts[table]
+            if len(bucket_keys) == 0:
+                continue
+            # Probes of each bucket, a range of the sorted probed keys
+            first = np.searchsorted(keys, bucket_keys, side="left")
+            num_probes = np.searchsorted(keys, bucket_keys, side="right") - first
+            sizes = np.diff(starts)
+            buckets = np.flatnonzero((num_probes > 0) & (sizes <= max_bucket_size))
+            if len(buckets) == 0:
+                continue
+            # Pair every probe with every descriptor of its bucket
+            probed = _expand_ranges(first[buckets], num_probes[buckets])
+            probe_buckets = np.repeat(buckets, num_probes[buckets])
+            counts = sizes[probe_buckets]
+            rows.append(np.repeat(query_rows[probed], counts))
+            columns.append(
+                self.order[table][_expand_ranges(starts[probe_buckets], counts)]
+            )
+        if not rows:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        # Deduplicate the pairs found by several tables or probes
+        pairs = np.unique(
+            np.concatenate(rows).astype(np.int64) * len(self) + np.concatenate(columns)
+        )
+        return pairs // len(self), pairs % len(self)
+
+
+class HammingLSHMatcher(KeyPointMatcher):
+    """Matcher of binary descriptors, e.g. ORB, on their Hamming distance.
+
+    The descriptors are the packed uint8 bits. With num_tables, the candidates of
+    each query descriptor are found in a multi-probe LSH index of the other
+    image, built by precompute() for the map images; without tables, all the
+    pairs are compared. The distances are computed by popcount on 64-bit words
+    and the pairs are matched by mutual nearest neighbours with a ratio test.
+
+    Parameters
+    ----------
+    config : HammingLSHConfig
+        configuration of the matcher
+    """
+
+    def __init__(self, config: HammingLSHConfig) -> None:
+        super().__init__()
+        self.config = config
+        rng = np.random.default_rng(config.seed)
+        self.bit_positions = np.array(
+            [
+                rng.choice(config.descriptor_bits, config.key_bits, replace=False)
+                for _ in range(config.num_tables)
+            ],
+            dtype=np.int64,
+        ).reshape(config.num_tables, config.key_bits)
+        self.masks = probe_masks(config.key_bits, config.probe_radius)
+
+    @property
+    def cache_key(self) -> str:
+        """Key of the index in the cache of the keypoints"""
+        config = self.config
+        return (
+            f"{self.__class__.__name__}.{config.num_tables}x{config.key_bits}."
+            f"{config.seed}"
+        )
+
+    def _descriptors(self, key_points: ImageKeyPoints) -> np.ndarray:
+        descriptors = np.asarray(key_points.numpy().descriptors)
+        if descriptors.dtype != np.uint8 or (
+            len(descriptors) and descriptors.shape[1] * 8 != self.config.descriptor_bits
+        ):
+            raise ValueError(
+                f"Expected packed uint8 descriptors of {self.config.descriptor_bits} "
+                f"bits, got {descriptors.dtype} of shape {descriptors.shape}"
+            )
+        return descriptors
+
+    def _index(self, key_points: ImageKeyPoints) -> Optional[HammingLSHIndex]:
+        """Get the LSH index of keypoints, from their cache if precomputed, None
+        without tables"""
+        if self.config.num_tables == 0:
+            return None
+        index = key_points.cache.get(self.cache_key)
+        if index is None:
+            index = HammingLSHIndex(self._descriptors(key_points), self.bit_positions)
+        return index
+
+    def precompute(self, key_points: ImageKeyPoints) -> None:
+        """
+        Cache the LSH index of the descriptors in the keypoints.
+
+        Parameters
+        ----------
+        key_points : ImageKeyPoints
+            keypoints of the image
+        """
+        if self.config.num_tables > 0:
+            key_points.cache[self.cache_key] = self._index(key_points)
+
+    def _match(
+        self,
+        query_descriptors: np.ndarray,
+        probes: Optional[List[Tuple[np.ndarray, np.ndarray]]],
+        candidate: ImageKeyPoints,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        config = self.config
+        num_rows, num_columns = len(query_descriptors), len(candidate)
+        if probes is None:
+            candidate_descriptors = self._descriptors(candidate)
+            distances = hamming_distances(query_descriptors, candidate_descriptors)
+            rows, columns = np.nonzero(distances <= config.max_distance)
+            distances = distances[rows, columns]
+        else:
+            index = self._index(candidate)
+            rows, columns = index.candidates(probes, config.max_bucket_size)
+            distances = pair_distances(
+                query_descriptors, index.descriptors, rows, columns
+            )
+            close = distances <= config.max_distance
+            rows, columns, distances = rows[close], columns[close], distances[close]
+
+        matches, match_distances = match_pairs(
+            rows, columns, distances, num_rows, num_columns, config.ratio_threshold
+        )
+        confidence = np.where(
+            matches > -1, 1.0 - match_distances / config.descriptor_bits, 0.0
+        )
+        return matches.astype(np.int32), confidence.astype(np.float32)
+
+    def match_keypoints(
+        self, keypoints_1: ImageKeyPoints, keypoints_2: ImageKeyPoints
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Match keypoints between two sets of binary descriptors.
+
+        Parameters
+        ----------
+        keypoints_1 : ImageKeyPoints
+            keypoints from the first image
+        keypoints_2 : ImageKeyPoints
+            keypoints from the second image
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            matches and confidence, 1 minus the normalized Hamming distance
+        """
+        return self.match_many(keypoints_1, [keypoints_2])[0]
+
+    def match_many(
+        self, query: ImageKeyPoints, candidates: List[ImageKeyPoints]
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Match the keypoints of a query image against several images, the probed
+        keys of the query descriptors being computed and sorted once.
+
+        Parameters
+        ----------
+        query : ImageKeyPoints
+            keypoints from the query image
+        candidates : List[ImageKeyPoints]
+            keypoints from the images to match the query against
+
+        Returns
+        -------
+        List[Tuple[np.ndarray, np.ndarray]]
+            matches and confidence of each candidate, see match_keypoints()
+        """
+        unmatched = (
+            np.full(len(query), -1, dtype=np.int32),
+            np.zeros(len(query), dtype=np.float32),
+        )
+        if len(query) == 0:
+            return [unmatched for _ in candidates]
+
+        descriptors = self._descriptors(query)
+        probes = (
+            probe_keys(
+                hash_keys(descriptors, self.bit_positions),
+                self.masks,
+                self.config.key_bits,
+            )
+            if self.config.num_tables > 0
+            else None
+        )
+        return [
+            self._match(descriptors, probes, candidate) if len(candidate) else unmatched
+            for candidate in candidates
+        ]
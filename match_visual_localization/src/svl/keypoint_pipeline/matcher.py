@@ -1,29 +1,201 @@
 import dataclasses
-from typing import Tuple
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
 import torch
 
+import superglue_lib.models.superglue as superglue_module
 from superglue_lib.models.superglue import SuperGlue
 from svl.keypoint_pipeline.base import KeyPointMatcher
+from svl.keypoint_pipeline.export import (
+    TracedGNN,
+    export_or_fallback,
+    trace_superglue_gnn,
+)
+from svl.keypoint_pipeline.model_cache import ModelCache
+from svl.keypoint_pipeline.precision import autocast, check_precision
+from svl.keypoint_pipeline.quantization import quantize_superglue
 from svl.keypoint_pipeline.typing import ImageKeyPoints, SuperGlueConfig
 
 class SuperGlueMatcher(KeyPointMatcher):
     """SuperGlue keypoint matcher.
 
+    The keypoint normalization, the keypoint encoder and the leading self layers
+    of SuperGlue depend on a single image. Their output is cached in the keypoints
+    by precompute(), and computed on the fly for the keypoints without it.
+
     Parameters
     ----------
     config : SuperGlueConfig
-        configuration for SuperGlue
+        configuration for SuperGlue. With a reduced precision, the keypoint
+        encoder and the GNN run under autocast and the optimal transport runs in
+        fp32. With quantize, the GNN runs with int8 dynamic quantization on CPU,
+        and the quantized model is cached in cache_dir if given. With jit, the
+        pair layers of the GNN run as a traced TorchScript module when no padding
+        mask is needed, cached in cache_dir if given, and the eager model is used
+        if tracing fails. With a positive sinkhorn_tolerance, the optimal
+        transport stops early once converged, sinkhorn_iterations being the
+        maximum number of iterations.
+
+    Attributes
+    ----------
+    last_sinkhorn_iterations : List[int]
+        number of Sinkhorn iterations run by each forward pass of the last call to
+        match_keypoints() or match_many()
     """
 
     def __init__(self, config: SuperGlueConfig) -> None:
         super().__init__()
+        check_precision(config.precision)
         self.config = config
         self.device = config.device
-        self.matcher = SuperGlue(dataclasses.asdict(config))
+        self.last_sinkhorn_iterations: List[int] = []
+        if config.quantize:
+            self.matcher = self._load_quantized()
+        else:
+            self.matcher = SuperGlue(dataclasses.asdict(config))
         self.matcher = self.matcher.eval()
         self.matcher = self.matcher.to(config.device)
+        if config.jit:
+            traced = export_or_fallback("SuperGlue", self._load_traced)
+            if traced is not None:
+                self.matcher.gnn = TracedGNN(
+                    self.matcher.gnn, traced, self.matcher.num_image_layers
+                )
+
+    def _cache_config(self) -> Dict[str, Any]:
+        """Configuration of the model cache entries, see ModelCache"""
+        weights_path = Path(superglue_module.__file__).parent / (
+            f"weights/superglue_{self.config.weights}.pth"
+        )
+        config = dataclasses.asdict(self.config)
+        for name in ["batch_size", "cache_dir", "jit"]:
+            config.pop(name)
+        config["weights_file"] = ModelCache.file_signature(weights_path)
+        return config
+
+    def _load_traced(self) -> torch.jit.ScriptModule:
+        """Trace the pair layers of the GNN, or load them from the model cache"""
+        if self.config.quantize:
+            raise ValueError("Traced SuperGlue does not support quantization")
+        if self.config.precision != "fp32":
+            raise ValueError("Traced SuperGlue does not support autocast")
+
+        def build() -> torch.jit.ScriptModule:
+            return trace_superglue_gnn(self.matcher, self.device)
+
+        if self.config.cache_dir is None:
+            return build()
+        return ModelCache(self.config.cache_dir).load_or_build(
+            "superglue_gnn_traced",
+            self._cache_config(),
+            build,
+            save=lambda model, path: torch.jit.save(model, str(path)),
+            load=lambda path: torch.jit.load(str(path), map_location=self.device),
+        )
+
+    def _load_quantized(self) -> SuperGlue:
+        """Build the int8 SuperGlue model, or load it from the model cache"""
+        if torch.device(self.device).type != "cpu":
+            raise ValueError("Quantized SuperGlue only runs on CPU")
+        if self.config.precision != "fp32":
+            raise ValueError("Quantized SuperGlue does not support autocast")
+
+        def build() -> SuperGlue:
+            return quantize_superglue(SuperGlue(dataclasses.asdict(self.config)))
+
+        def load(path: Path) -> SuperGlue:
+            # Only the tensors are stored, the module is rebuilt from the code
+            model = build()
+            model.load_state_dict(
+                torch.load(path, map_location="cpu", weights_only=True)
+            )
+            return model
+
+        if self.config.cache_dir is None:
+            return build()
+        config = self._cache_config()
+        config.pop("device")
+        return ModelCache(self.config.cache_dir).load_or_build(
+            "superglue_int8",
+            config,
+            build,
+            save=lambda model, path: torch.save(model.state_dict(), path),
+            load=load,
+        )
+
+    @property
+    def cache_key(self) -> str:
+        """Key of the precomputed state in the cache of the keypoints"""
+        precision = "int8" if self.config.quantize else self.config.precision
+        return f"{self.__class__.__name__}.{self.config.weights}.{precision}"
+
+    def _autocast(self):
+        return autocast(self.device, self.config.precision)
+
+    def _to_tensors(
+        self, key_points: ImageKeyPoints
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Get the keypoints as batched tensors on the device of the matcher.
+
+        The tensors share the memory of the arrays when they are already on the
+        device, and are kept in the cache of the keypoints, so that matching the
+        same keypoints again does not convert or copy anything.
+
+        Returns
+        -------
+        Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]
+            keypoints (1, N, 2), descriptors (1, D, N), scores (1, N) and image
+            size (1, 2)
+        """
+        cache_key = f"{self.__class__.__name__}.tensors.{self.device}"
+        tensors = key_points.cache.get(cache_key)
+        if tensors is not None:
+            return tensors
+        converted = key_points.torch()
+        scores = (
+            converted.scores
+            if converted.scores is not None
+            else torch.ones(len(converted))
+        )
+        tensors = (
+            converted.keypoints.float()[None].to(self.device),
+            converted.descriptors.float().T[None].to(self.device).contiguous(),
+            scores.float()[None].to(self.device),
+            torch.tensor([key_points.image_size], device=self.device),
+        )
+        key_points.cache[cache_key] = tensors
+        return tensors
+
+    def _encode(self, key_points: ImageKeyPoints) -> torch.Tensor:
+        """Get the image-only stages of SuperGlue for keypoints, from their cache
+        if precomputed
+
+        Returns
+        -------
+        torch.Tensor
+            encoded descriptors, shape (1, D, N)
+        """
+        encoded = key_points.cache.get(self.cache_key)
+        if encoded is not None:
+            return encoded
+        keypoints, descriptors, scores, image_size = self._to_tensors(key_points)
+        with torch.no_grad(), self._autocast():
+            return self.matcher.encode(keypoints, scores, descriptors, image_size)
+
+    def precompute(self, key_points: ImageKeyPoints) -> None:
+        """
+        Cache the output of the keypoint encoder and of the leading self layers of
+        SuperGlue in the keypoints.
+
+        Parameters
+        ----------
+        key_points : ImageKeyPoints
+            keypoints of the image
+        """
+        if len(key_points) > 0:
+            key_points.cache[self.cache_key] = self._encode(key_points)
 
     def match_keypoints(
         self, keypoints_1: ImageKeyPoints, keypoints_2: ImageKeyPoints
@@ -43,34 +215,107 @@ class SuperGlueMatcher(KeyPointMatcher):
         Tuple[np.ndarray, np.ndarray]
             matches and confidence
         """
-        inputs = {}
-        # SuperGlue matching needs images only to get the image size
-        # Workaround: create dummy images with the image_size specified in the keypoints
-        inputs["image0"] = torch.randn(1, 1, *keypoints_1.image_size)
-        inputs["image1"] = torch.randn(1, 1, *keypoints_2.image_size)
-
-        # Convert keypoints to tensor
-        keypoints_1 = (
-            keypoints_1.torch()
-            .to(self.device)
-            .add_batch_dimension()
-            .to_dict(suffix_idx=0)
-        )
-        keypoints_1["descriptors0"] = keypoints_1["descriptors0"].transpose(-2, -1)
+        if len(keypoints_1) == 0 or len(keypoints_2) == 0:
+            self.last_sinkhorn_iterations = []
+            return (
+                np.full(len(keypoints_1), -1, dtype=np.int32),
+                np.zeros(len(keypoints_1), dtype=np.float32),
+            )
+        # The keypoints are only read for their shape once encoded
+        inputs = {
+            "keypoints0": self._to_tensors(keypoints_1)[0],
+            "keypoints1": self._to_tensors(keypoints_2)[0],
+            "encoded0": self._encode(keypoints_1),
+            "encoded1": self._encode(keypoints_2),
+        }
+
+        with torch.no_grad(), self._autocast():
+            preds = self.matcher(inputs)
+        self.last_sinkhorn_iterations = [preds["sinkhorn_iterations"]]
+        matches = preds["matches0"].cpu().numpy().squeeze(0)
+        confidence = preds["matching_scores0"].cpu().numpy().squeeze(0)
+        return matches, confidence
 
-        keypoints_2 = (
-            keypoints_2.torch()
-            .to(self.device)
-            .add_batch_dimension()
-            .to_dict(suffix_idx=1)
+    def match_many(
+        self,
+        query: ImageKeyPoints,
+        candidates: List[ImageKeyPoints],
+        batch_size: Optional[int] = None,
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Match the keypoints of a query image against several images using SuperGlue.
+
+        The candidates are sorted by number of keypoints and matched batch_size at
+        a time: their encoded descriptors are padded to a common length and the
+        padding is masked in the attention layers and in the optimal transport, so
+        that each pair gets the same matches as with match_keypoints(). The query
+        is encoded once for all the candidates.
+
+        Parameters
+        ----------
+        query : ImageKeyPoints
+            keypoints from the query image
+        candidates : List[ImageKeyPoints]
+            keypoints from the images to match the query against
+        batch_size : Optional[int], optional
+            number of pairs matched in one forward pass, by default None which uses
+            the batch_size of the config
+
+        Returns
+        -------
+        List[Tuple[np.ndarray, np.ndarray]]
+            matches and confidence of each candidate, see match_keypoints()
+        """
+        batch_size = batch_size or self.config.batch_size
+        self.last_sinkhorn_iterations = []
+        results: List[Optional[Tuple[np.ndarray, np.ndarray]]] = [None] * len(
+            candidates
         )
-        keypoints_2["descriptors1"] = keypoints_2["descriptors1"].transpose(-2, -1)
+        for idx, candidate in enumerate(candidates):
+            if len(query) == 0 or len(candidate) == 0:
+                results[idx] = (
+                    np.full(len(query), -1, dtype=np.int32),
+                    np.zeros(len(query), dtype=np.float32),
+                )
+        pending = [idx for idx, result in enumerate(results) if result is None]
+        pending.sort(key=lambda idx: len(candidates[idx]))
+        if not pending:
+            return results
 
-        inputs.update(**keypoints_1)
-        inputs.update(**keypoints_2)
+        query_keypoints = self._to_tensors(query)[0]
+        query_encoded = self._encode(query)
 
-        with torch.no_grad():
-            preds = self.matcher(inputs)
-        matches = preds["matches0"].cpu().numpy().squeeze()
-        confidence = preds["matching_scores0"].cpu().numpy().squeeze()
-        return matches, confidence
+        for start in range(0, len(pending), batch_size):
+            indices = pending[start : start + batch_size]
+            batch = [candidates[idx] for idx in indices]
+            lengths = [len(key_points) for key_points in batch]
+            num_keypoints = max(lengths)
+
+            keypoints = torch.zeros((len(batch), num_keypoints, 2), device=self.device)
+            encoded = query_encoded.new_zeros(
+                (len(batch), query_encoded.shape[1], num_keypoints)
+            )
+            mask = torch.zeros(
+                (len(batch), num_keypoints), dtype=torch.bool, device=self.device
+            )
+            for position, (key_points, n) in enumerate(zip(batch, lengths)):
+                keypoints[position, :n] = self._to_tensors(key_points)[0][0]
+                encoded[position, :, :n] = self._encode(key_points)[0]
+                mask[position, :n] = True
+
+            inputs = {
+                "keypoints0": query_keypoints.expand(len(batch), -1, -1),
+                "encoded0": query_encoded.expand(len(batch), -1, -1),
+                "keypoints1": keypoints,
+                "encoded1": encoded,
+            }
+            if min(lengths) < num_keypoints:
+                inputs["mask1"] = mask
+            with torch.no_grad(), self._autocast():
+                preds = self.matcher(inputs)
+            self.last_sinkhorn_iterations.append(preds["sinkhorn_iterations"])
+            matches = preds["matches0"].cpu().numpy()
+            confidence = preds["matching_scores0"].cpu().numpy()
+            for position, idx in enumerate(indices):
+                results[idx] = (matches[position], confidence[position])
+        return results
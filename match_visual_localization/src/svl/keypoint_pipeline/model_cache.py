@@ -0,0 +1,113 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, TypeVar, Union
+
+import torch
+
+T = TypeVar("T")
+
+
+class ModelCache:
+    """On-disk cache of converted models, e.g. quantized or scripted networks.
+
+    The entries are keyed by the name of the conversion, the configuration of the
+    model and the version of torch, since the serialized artifacts are not
+    guaranteed to load across torch versions. The weight files the model is built
+    from should be part of the configuration, see file_signature().
+
+    Parameters
+    ----------
+    cache_dir : Union[str, Path]
+        directory of the cache, created if it does not exist
+    logger : logging.Logger, optional
+        logger to use for logging, by default None
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], logger: logging.Logger = None) -> None:
+        self.cache_dir = cache_dir if isinstance(cache_dir, Path) else Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+
+    @staticmethod
+    def file_signature(file_path: Union[str, Path]) -> Dict[str, int]:
+        """Modification time and size of a weight file, to invalidate its entries"""
+        stat = os.stat(file_path)
+        return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+    def path(self, name: str, config: Dict[str, Any], suffix: str = ".pt") -> Path:
+        """Path of the cache entry of a model
+
+        Parameters
+        ----------
+        name : str
+            name of the conversion, e.g. "superglue_int8"
+        config : Dict[str, Any]
+            JSON serializable configuration of the model
+        suffix : str, optional
+            suffix of the file, by default ".pt"
+
+        Returns
+        -------
+        Path
+            path of the entry, which may not exist
+        """
+        key = json.dumps(
+            {"name": name, "config": config, "torch": torch.__version__},
+            sort_keys=True,
+            default=str,
+        )
+        fingerprint = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        return self.cache_dir / f"{name}_{fingerprint}{suffix}"
+
+    def load_or_build(
+        self,
+        name: str,
+        config: Dict[str, Any],
+        build: Callable[[], T],
+        save: Callable[[T, Path], None],
+        load: Callable[[Path], T],
+        suffix: str = ".pt",
+    ) -> T:
+        """Load a model from the cache, or build it and add it to the cache
+
+        An entry that fails to load is rebuilt and overwritten.
+
+        Parameters
+        ----------
+        name : str
+            name of the conversion
+        config : Dict[str, Any]
+            JSON serializable configuration of the model
+        build : Callable[[], T]
+            function building the model
+        save : Callable[[T, Path], None]
+            function saving the model to a file
+        load : Callable[[Path], T]
+            function loading the model from a file
+        suffix : str, optional
+            suffix of the file, by default ".pt"
+
+        Returns
+        -------
+        T
+            the model
+        """
+        path = self.path(name, config, suffix)
+        if path.exists():
+            try:
+                model = load(path)
+                self.logger.info(f"Loaded {name} from the model cache {path}")
+                return model
+            except Exception as e:
+                self.logger.warning(f"Unable to load {path}, rebuilding it: {e}")
+
+        model = build()
+        # Write to a temporary file first so that readers never see a partial file
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        save(model, tmp_path)
+        os.replace(tmp_path, path)
+        self.logger.info(f"Saved {name} to the model cache {path}")
+        return model
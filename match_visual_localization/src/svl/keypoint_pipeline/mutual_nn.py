@@ -0,0 +1,261 @@
+import hashlib
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+from svl.keypoint_pipeline.base import KeyPointMatcher
+from svl.keypoint_pipeline.typing import ImageKeyPoints, MutualNNConfig
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2 normalize the rows of a matrix, leaving the zero rows untouched"""
+    norm = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norm, 1e-12)
+
+
+def mutual_nn_matches(
+    similarity: np.ndarray, ratio_threshold: float, min_similarity: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Mutual nearest neighbours of a cosine similarity matrix, with a ratio test
+
+    Parameters
+    ----------
+    similarity : np.ndarray
+        cosine similarity of the normalized descriptors of two images, shape (N, M)
+    ratio_threshold : float
+        maximum ratio of the descriptor distance to the best match over the one to
+        the second best, 1.0 to disable the ratio test
+    min_similarity : float
+        minimum similarity of the matches
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        index of the match of each row, -1 if unmatched, and confidence of the
+        matches, the similarity clipped to [0, 1]
+    """
+    num_rows, num_columns = similarity.shape
+    rows = np.arange(num_rows)
+    best = similarity.argmax(axis=1)
+    best_similarity = similarity[rows, best]
+    valid = (similarity.argmax(axis=0)[best] == rows) & (
+        best_similarity >= min_similarity
+    )
+    if ratio_threshold < 1.0 and num_columns > 1:
+        second_similarity = np.partition(similarity, num_columns - 2, axis=1)[
+            :, num_columns - 2
+        ]
+        # Distances of unit vectors from their cosine similarity
+        best_distance = np.sqrt(np.maximum(2.0 - 2.0 * best_similarity, 0.0))
+        second_distance = np.sqrt(np.maximum(2.0 - 2.0 * second_similarity, 0.0))
+        valid &= best_distance < ratio_threshold * second_distance
+    confidence = np.where(valid, np.clip(best_similarity, 0.0, 1.0), 0.0)
+    return np.where(valid, best, -1).astype(np.int32), confidence.astype(np.float32)
+
+
+class MutualNNMatcher(KeyPointMatcher):
+    """Mutual nearest neighbour matcher on the descriptors of the keypoints.
+
+    A cheap alternative to SuperGlue, e.g. for pre-filtering or low-power nodes,
+    with the same output. The descriptors are compared by cosine similarity, a
+    pair is matched when both keypoints are the nearest neighbour of each other
+    and pass the ratio test. With pca_dim, the descriptors are projected on
+    their first principal components, which must be fitted with fit_pca().
+
+    Parameters
+    ----------
+    config : MutualNNConfig
+        configuration of the matcher
+    """
+
+    def __init__(self, config: MutualNNConfig) -> None:
+        super().__init__()
+        self.config = config
+        self.pca_mean: Optional[np.ndarray] = None
+        self.pca_components: Optional[np.ndarray] = None
+        # Fingerprint of the PCA, with the arrays it was computed on
+        self._pca_fingerprint: Tuple[Any, Any, str] = (None, None, "none")
+
+    @property
+    def pca_fingerprint(self) -> str:
+        """Hash of the PCA projection, so the matchers with different projections
+        do not share the cache entries of the keypoints"""
+        mean, components, fingerprint = self._pca_fingerprint
+        if mean is self.pca_mean and components is self.pca_components:
+            return fingerprint
+        digest = hashlib.sha1()
+        for array in (self.pca_mean, self.pca_components):
+            if array is not None:
+                array = np.ascontiguousarray(array, dtype=np.float32)
+                digest.update(str(array.shape).encode("utf-8"))
+                digest.update(memoryview(array))
+        fingerprint = digest.hexdigest()[:16]
+        self._pca_fingerprint = (self.pca_mean, self.pca_components, fingerprint)
+        return fingerprint
+
+    @property
+    def cache_key(self) -> str:
+        """Key of the prepared descriptors in the cache of the keypoints"""
+        if self.config.pca_dim is None:
+            return self.__class__.__name__
+        return (
+            f"{self.__class__.__name__}.pca{self.config.pca_dim}."
+            f"{self.pca_fingerprint}"
+        )
+
+    def fit_pca(
+        self, key_points: List[ImageKeyPoints], max_samples: int = 100_000, seed: int = 0
+    ) -> None:
+        """
+        Fit the PCA projection of the descriptors, e.g. on the map images.
+
+        Parameters
+        ----------
+        key_points : List[ImageKeyPoints]
+            keypoints of the images to fit the projection on
+        max_samples : int, optional
+            maximum number of descriptors used, a random subset is used for larger
+            inputs, by default 100_000
+        seed : int, optional
+            seed of the random generator, by default 0
+        """
+        if self.config.pca_dim is None:
+            raise ValueError("pca_dim is not set in the config of the matcher")
+        descriptors = np.concatenate(
+            [np.asarray(kp.numpy().descriptors, dtype=np.float32) for kp in key_points]
+        )
+        if len(descriptors) > max_samples:
+            rng = np.random.default_rng(seed)
+            descriptors = descriptors[
+                rng.choice(len(descriptors), max_samples, replace=False)
+            ]
+        if len(descriptors) < self.config.pca_dim:
+            raise ValueError(
+                f"Not enough descriptors ({len(descriptors)}) to fit "
+                f"{self.config.pca_dim} components"
+            )
+        self.pca_mean = descriptors.mean(axis=0)
+        _, _, components = np.linalg.svd(descriptors - self.pca_mean, full_matrices=False)
+        self.pca_components = np.ascontiguousarray(components[: self.config.pca_dim].T)
+
+    def _descriptors(self, key_points: ImageKeyPoints) -> np.ndarray:
+        """Get the normalized, optionally reduced, descriptors of keypoints, from
+        their cache if precomputed
+
+        Returns
+        -------
+        np.ndarray
+            descriptors, shape (N, D) or (N, pca_dim)
+        """
+        descriptors = key_points.cache.get(self.cache_key)
+        if descriptors is not None:
+            return descriptors
+        descriptors = np.asarray(key_points.numpy().descriptors, dtype=np.float32)
+        if self.config.pca_dim is not None:
+            if self.pca_components is None:
+                raise ValueError("The PCA projection must be fitted with fit_pca()")
+            descriptors = (descriptors - self.pca_mean) @ self.pca_components
+        return normalize_rows(descriptors)
+
+    def precompute(self, key_points: ImageKeyPoints) -> None:
+        """
+        Cache the normalized, optionally reduced, descriptors in the keypoints.
+
+        Parameters
+        ----------
+        key_points : ImageKeyPoints
+            keypoints of the image
+        """
+        key_points.cache[self.cache_key] = self._descriptors(key_points)
+
+    def match_keypoints(
+        self, keypoints_1: ImageKeyPoints, keypoints_2: ImageKeyPoints
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Match keypoints between two sets of descriptors by mutual nearest neighbours.
+
+        Parameters
+        ----------
+        keypoints_1 : ImageKeyPoints
+            keypoints from the first image
+        keypoints_2 : ImageKeyPoints
+            keypoints from the second image
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            matches and confidence
+        """
+        return self.match_many(keypoints_1, [keypoints_2])[0]
+
+    def match_many(
+        self, query: ImageKeyPoints, candidates: List[ImageKeyPoints]
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Match the keypoints of a query image against several images.
+
+        The similarity of the query descriptors to the descriptors of the
+        candidates is computed with one matrix product per chunk of candidates,
+        the chunks being sized so that their similarity matrix fits in
+        max_similarity_bytes of the config. A candidate larger than the budget
+        forms a chunk on its own.
+
+        Parameters
+        ----------
+        query : ImageKeyPoints
+            keypoints from the query image
+        candidates : List[ImageKeyPoints]
+            keypoints from the images to match the query against
+
+        Returns
+        -------
+        List[Tuple[np.ndarray, np.ndarray]]
+            matches and confidence of each candidate, see match_keypoints()
+        """
+        unmatched = (
+            np.full(len(query), -1, dtype=np.int32),
+            np.zeros(len(query), dtype=np.float32),
+        )
+        if len(query) == 0 or not candidates:
+            return [unmatched for _ in candidates]
+
+        query_descriptors = self._descriptors(query)
+        max_columns = max(self.config.max_similarity_bytes // (4 * len(query)), 1)
+        results = []
+        chunk: List[np.ndarray] = []
+        chunk_columns = 0
+        for idx, candidate in enumerate(candidates):
+            descriptors = self._descriptors(candidate)
+            chunk.append(descriptors)
+            chunk_columns += len(descriptors)
+            is_last = idx == len(candidates) - 1
+            if not is_last and chunk_columns + len(candidates[idx + 1]) <= max_columns:
+                continue
+            results.extend(self._match_chunk(query_descriptors, chunk, unmatched))
+            chunk, chunk_columns = [], 0
+        return results
+
+    def _match_chunk(
+        self,
+        query_descriptors: np.ndarray,
+        descriptors: List[np.ndarray],
+        unmatched: Tuple[np.ndarray, np.ndarray],
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Match the query descriptors against a chunk of candidates in a single
+        matrix product"""
+        similarity = query_descriptors @ np.concatenate(descriptors).T
+        lengths = np.array([len(candidate) for candidate in descriptors])
+        ends = np.cumsum(lengths)
+        results = []
+        for start, end in zip(ends - lengths, ends):
+            if start == end:
+                results.append(unmatched)
+                continue
+            results.append(
+                mutual_nn_matches(
+                    similarity[:, start:end],
+                    self.config.ratio_threshold,
+                    self.config.min_similarity,
+                )
+            )
+        return results
@@ -0,0 +1,236 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+import onnxruntime as ort
+
+from svl.keypoint_pipeline.base import CombinedKeyPointAlgorithm, KeyPointMatcher
+from svl.keypoint_pipeline.dense import extract_keypoints, simple_nms
+from svl.keypoint_pipeline.typing import (
+    ImageKeyPoints,
+    OnnxSuperGlueConfig,
+    OnnxSuperPointConfig,
+)
+
+
+def create_session(
+    model_path: str, intra_op_num_threads: int = 0, inter_op_num_threads: int = 0
+) -> ort.InferenceSession:
+    """Create an ONNX Runtime session on the CPU execution provider
+
+    Parameters
+    ----------
+    model_path : str
+        path of the ONNX file
+    intra_op_num_threads : int, optional
+        threads used inside an operator, by default 0 which lets ONNX Runtime
+        use one per physical core
+    inter_op_num_threads : int, optional
+        threads used to run independent operators, by default 0
+
+    Returns
+    -------
+    ort.InferenceSession
+        the session
+    """
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_num_threads
+    options.inter_op_num_threads = inter_op_num_threads
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(
+        str(model_path), sess_options=options, providers=["CPUExecutionProvider"]
+    )
+
+
+def matches_from_assignment(
+    assignment: np.ndarray, match_threshold: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Mutual best matches of a log assignment matrix, same as SuperGlue
+
+    Parameters
+    ----------
+    assignment : np.ndarray
+        log assignment matrix with the dustbins, shape (N0 + 1, N1 + 1)
+    match_threshold : float
+        minimum confidence of the matches
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        matches and confidence of the keypoints of the first image
+    """
+    scores = assignment[:-1, :-1]
+    indices0, indices1 = scores.argmax(axis=1), scores.argmax(axis=0)
+    max0 = scores[np.arange(len(indices0)), indices0]
+    mutual0 = indices1[indices0] == np.arange(len(indices0))
+    confidence = np.where(mutual0, np.exp(max0), 0).astype(np.float32)
+    valid0 = mutual0 & (confidence > match_threshold)
+    return np.where(valid0, indices0, -1), confidence
+
+
+@CombinedKeyPointAlgorithm.register
+class OnnxSuperPointAlgorithm(CombinedKeyPointAlgorithm):
+    """SuperPoint running on ONNX Runtime, with the NMS and the keypoint extraction
+    in NumPy.
+
+    The ONNX file is exported by export_superpoint_onnx() and holds the encoder and
+    the heads, the detection parameters are applied at extraction and can differ
+    from the ones of the exported model.
+
+    Parameters
+    ----------
+    config : OnnxSuperPointConfig
+        configuration with the path of the ONNX file and the threads of the session
+    """
+
+    def __init__(self, config: OnnxSuperPointConfig) -> None:
+        super().__init__()
+        self.config = config
+        self.session = create_session(
+            config.model_path,
+            config.intra_op_num_threads,
+            config.inter_op_num_threads,
+        )
+
+    def detect_and_describe_keypoints(self, image: np.ndarray) -> ImageKeyPoints:
+        """
+        Detect keypoints in an image using SuperPoint.
+
+        Parameters
+        ----------
+        image : np.ndarray
+            image to detect keypoints in
+
+        Returns
+        -------
+        ImageKeyPoints
+            keypoints with their descriptors
+        """
+        return self.detect_and_describe_keypoints_batch([image])[0]
+
+    def detect_and_describe_keypoints_batch(
+        self, images: List[np.ndarray]
+    ) -> List[ImageKeyPoints]:
+        """
+        Detect keypoints in several grayscale images using SuperPoint.
+
+        The images are grouped by shape and each group runs through a single call
+        of the session.
+
+        Parameters
+        ----------
+        images : List[np.ndarray]
+            grayscale images to detect keypoints in
+
+        Returns
+        -------
+        List[ImageKeyPoints]
+            keypoints with their descriptors, in the order of the images
+        """
+        buckets: Dict[Tuple[int, int], List[int]] = {}
+        for idx, image in enumerate(images):
+            buckets.setdefault(image.shape[:2], []).append(idx)
+
+        key_points = [None] * len(images)
+        for (height, width), indices in buckets.items():
+            batch = np.stack([images[idx] for idx in indices])
+            batch = (batch.astype(np.float32) / 255.0)[:, None]
+            scores, descriptors = self.session.run(None, {"image": batch})
+            for position, idx in enumerate(indices):
+                keypoints, kpt_scores, kpt_descriptors = extract_keypoints(
+                    simple_nms(scores[position], self.config.nms_radius),
+                    descriptors[position],
+                    self.config.keypoint_threshold,
+                    self.config.max_keypoints,
+                    self.config.remove_borders,
+                )
+                key_points[idx] = ImageKeyPoints(
+                    keypoints=keypoints,
+                    descriptors=kpt_descriptors,
+                    scores=kpt_scores,
+                    image_size=[height, width],
+                )
+        return key_points
+
+    def detect_keypoints(self, image: np.ndarray) -> np.ndarray:
+        """
+        Detect keypoints in an image using SuperPoint.
+
+        Parameters
+        ----------
+        image : np.ndarray
+            image to detect keypoints in
+
+        Returns
+        -------
+        np.ndarray
+            keypoints
+        """
+        return self.detect_and_describe_keypoints(image).keypoints
+
+    def describe_keypoints(self, image: np.ndarray, keypoints: np.ndarray) -> np.ndarray:
+        raise NotImplementedError("SuperPoint does not support describing keypoints.")
+
+
+class OnnxSuperGlueMatcher(KeyPointMatcher):
+    """SuperGlue running on ONNX Runtime, with the mutual check and the thresholding
+    of the matches in NumPy.
+
+    The ONNX file is exported by export_superglue_onnx() and holds SuperGlue up to
+    the optimal transport, with its number of Sinkhorn iterations.
+
+    Parameters
+    ----------
+    config : OnnxSuperGlueConfig
+        configuration with the path of the ONNX file and the threads of the session
+    """
+
+    def __init__(self, config: OnnxSuperGlueConfig) -> None:
+        super().__init__()
+        self.config = config
+        self.session = create_session(
+            config.model_path,
+            config.intra_op_num_threads,
+            config.inter_op_num_threads,
+        )
+
+    @staticmethod
+    def _inputs(key_points: ImageKeyPoints, idx: int) -> Dict[str, np.ndarray]:
+        key_points = key_points.numpy()
+        scores = (
+            key_points.scores
+            if key_points.scores is not None
+            else np.ones(len(key_points))
+        )
+        return {
+            f"keypoints{idx}": key_points.keypoints.astype(np.float32)[None],
+            f"scores{idx}": scores.astype(np.float32)[None],
+            f"descriptors{idx}": key_points.descriptors.astype(np.float32).T[None],
+            f"image_size{idx}": np.asarray([key_points.image_size], dtype=np.int64),
+        }
+
+    def match_keypoints(
+        self, keypoints_1: ImageKeyPoints, keypoints_2: ImageKeyPoints
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Match keypoints between two sets of descriptors using SuperGlue.
+
+        Parameters
+        ----------
+        keypoints_1 : ImageKeyPoints
+            keypoints from the first image
+        keypoints_2 : ImageKeyPoints
+            keypoints from the second image
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            matches and confidence
+        """
+        if len(keypoints_1) == 0 or len(keypoints_2) == 0:
+            return (
+                np.full(len(keypoints_1), -1, dtype=np.int32),
+                np.zeros(len(keypoints_1), dtype=np.float32),
+            )
+        inputs = {**self._inputs(keypoints_1, 0), **self._inputs(keypoints_2, 1)}
+        (assignment,) = self.session.run(None, inputs)
+        return matches_from_assignment(assignment[0], self.config.match_threshold)
@@ -0,0 +1,51 @@
+import contextlib
+from typing import ContextManager
+
+import torch
+
+PRECISIONS = {
+    "fp32": None,
+    "bf16": torch.bfloat16,
+    "fp16": torch.float16,
+}
+
+
+def check_precision(precision: str) -> None:
+    """Check that a precision is supported
+
+    Parameters
+    ----------
+    precision : str
+        precision of the inference, one of PRECISIONS
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(
+            f"Invalid precision {precision}, expected one of {list(PRECISIONS)}"
+        )
+
+
+def autocast(device: str, precision: str) -> ContextManager:
+    """Context running the networks in reduced precision with autocast.
+
+    Autocast runs the convolutions and the matrix products in the reduced
+    precision and keeps the reductions in fp32. The networks cast back to fp32
+    before the parts sensitive to precision, i.e. the score heads of SuperPoint and
+    the optimal transport of SuperGlue.
+
+    Parameters
+    ----------
+    device : str
+        device the networks run on, e.g. "cpu" or "cuda"
+    precision : str
+        precision of the inference, one of PRECISIONS
+
+    Returns
+    -------
+    ContextManager
+        the autocast context, or a null context in fp32
+    """
+    check_precision(precision)
+    dtype = PRECISIONS[precision]
+    if dtype is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=torch.device(device).type, dtype=dtype)
@@ -0,0 +1,108 @@
+import torch
+from torch import nn
+
+
+class Conv1dAsLinear(nn.Module):
+    """1x1 Conv1d computed as a Linear layer on the channels.
+
+    Dynamic quantization only supports Linear layers. The module keeps the
+    (B, C, N) layout of the convolution at its input and output.
+
+    Parameters
+    ----------
+    conv : nn.Conv1d
+        convolution with a kernel of size 1 to convert
+    """
+
+    def __init__(self, conv: nn.Conv1d) -> None:
+        super().__init__()
+        if conv.kernel_size != (1,) or conv.groups != 1:
+            raise ValueError("Only 1x1 convolutions without groups can be converted")
+        self.linear = nn.Linear(
+            conv.in_channels, conv.out_channels, bias=conv.bias is not None
+        )
+        with torch.no_grad():
+            self.linear.weight.copy_(conv.weight[:, :, 0])
+            if conv.bias is not None:
+                self.linear.bias.copy_(conv.bias)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.linear(x.transpose(1, 2)).transpose(1, 2)
+
+
+def fold_batch_norm(sequential: nn.Sequential) -> None:
+    """Fold the BatchNorm1d layers following 1x1 convolutions into them, in place.
+
+    The model must be in eval mode, the running statistics are frozen in the
+    weights and the BatchNorm layers are replaced by identities.
+
+    Parameters
+    ----------
+    sequential : nn.Sequential
+        sequence of layers, e.g. an MLP of SuperGlue
+    """
+    for idx in range(len(sequential) - 1):
+        conv, norm = sequential[idx], sequential[idx + 1]
+        if not (isinstance(conv, nn.Conv1d) and isinstance(norm, nn.BatchNorm1d)):
+            continue
+        scale = norm.weight / torch.sqrt(norm.running_var + norm.eps)
+        with torch.no_grad():
+            conv.weight.mul_(scale[:, None, None])
+            bias = conv.bias if conv.bias is not None else torch.zeros_like(scale)
+            folded = (bias - norm.running_mean) * scale + norm.bias
+            conv.bias = nn.Parameter(folded)
+        sequential[idx + 1] = nn.Identity()
+
+
+def convert_conv1d(module: nn.Module) -> nn.Module:
+    """Replace the 1x1 Conv1d layers of a module by Conv1dAsLinear, in place.
+
+    Parameters
+    ----------
+    module : nn.Module
+        module to convert
+
+    Returns
+    -------
+    nn.Module
+        the converted module
+    """
+    for name, child in module.named_children():
+        if isinstance(child, nn.Sequential):
+            fold_batch_norm(child)
+        if isinstance(child, nn.Conv1d) and child.kernel_size == (1,):
+            setattr(module, name, Conv1dAsLinear(child))
+        else:
+            convert_conv1d(child)
+    return module
+
+
+def quantize_superglue(superglue: nn.Module) -> nn.Module:
+    """Quantize the GNN and the final projection of SuperGlue to int8, in place.
+
+    The 1x1 convolutions of the attention projections and of the MLPs are
+    converted to Linear layers with dynamic int8 quantization: the weights are
+    quantized once and the activations are quantized on the fly. The keypoint
+    encoder and the optimal transport stay in fp32. Dynamic quantization runs on
+    CPU only.
+
+    Parameters
+    ----------
+    superglue : nn.Module
+        SuperGlue model in eval mode, on CPU
+
+    Returns
+    -------
+    nn.Module
+        the quantized model
+    """
+    superglue.eval()
+    superglue.gnn = convert_conv1d(superglue.gnn)
+    superglue.final_proj = Conv1dAsLinear(superglue.final_proj)
+    superglue.gnn = torch.ao.quantization.quantize_dynamic(
+        superglue.gnn, {nn.Linear}, dtype=torch.qint8
+    )
+    superglue.final_proj = torch.ao.quantization.quantize_dynamic(
+        superglue.final_proj, {nn.Linear}, dtype=torch.qint8
+    )
+    return superglue
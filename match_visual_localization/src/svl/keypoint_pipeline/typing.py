@@ -1,10 +1,35 @@
 from __future__ import annotations
+import warnings
 from abc import ABC
 from dataclasses import dataclass, field
-from typing import Dict, List
+from typing import Any, Dict, List, Optional
 
 import numpy as np
-import torch
+
+try:
+    import torch
+except ImportError:  # The classical detectors and matchers run without torch
+    torch = None
+
+
+def is_tensor(value: Any) -> bool:
+    """Whether a value is a torch tensor, False when torch is not installed"""
+    return torch is not None and isinstance(value, torch.Tensor)
+
+
+def as_tensor(array: np.ndarray | torch.Tensor) -> torch.Tensor:
+    """Convert an array to a tensor sharing its memory, without copying it.
+
+    Read-only arrays, e.g. memory-mapped ones, are shared as well: the tensor must
+    then not be modified in place.
+    """
+    if is_tensor(array):
+        return array
+    if array.flags.writeable:
+        return torch.from_numpy(array)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        return torch.from_numpy(array)
 
 
 @dataclass
@@ -19,6 +44,21 @@ class SuperPointConfig(DetectorConfig):
     nms_radius: int = 4
     keypoint_threshold: float = 0.005
     max_keypoints: int = -1
+    precision: str = "fp32"
+    jit: bool = False
+    cache_dir: Optional[str] = None
+
+
+@dataclass
+class OnnxSuperPointConfig(DetectorConfig):
+    name: str = "OnnxSuperPoint"
+    model_path: str = "superpoint.onnx"
+    nms_radius: int = 4
+    keypoint_threshold: float = 0.005
+    max_keypoints: int = -1
+    remove_borders: int = 4
+    intra_op_num_threads: int = 0
+    inter_op_num_threads: int = 0
 
 
 @dataclass
@@ -35,7 +75,66 @@ class SuperGlueConfig(MatcherConfig):
     keypoint_encoder: List[int] = field(default_factory=lambda: [32, 64, 128, 256])
     GNN_layers: List[str] = field(default_factory=lambda: ["self", "cross"] * 9)
     sinkhorn_iterations: int = 100
+    sinkhorn_tolerance: float = 0.0
+    sinkhorn_check_interval: int = 10
+    match_threshold: float = 0.2
+    batch_size: int = 8
+    precision: str = "fp32"
+    quantize: bool = False
+    jit: bool = False
+    cache_dir: Optional[str] = None
+
+
+@dataclass
+class OnnxSuperGlueConfig(MatcherConfig):
+    name: str = "OnnxSuperGlue"
+    model_path: str = "superglue_outdoor.onnx"
     match_threshold: float = 0.2
+    intra_op_num_threads: int = 0
+    inter_op_num_threads: int = 0
+
+
+@dataclass
+class MutualNNConfig(MatcherConfig):
+    name: str = "MutualNN"
+    ratio_threshold: float = 0.8
+    min_similarity: float = 0.0
+    pca_dim: Optional[int] = None
+    max_similarity_bytes: int = 256 * 2**20
+
+
+@dataclass
+class SIFTConfig(DetectorConfig):
+    name: str = "SIFT"
+    max_keypoints: int = 0
+    contrast_threshold: float = 0.04
+    edge_threshold: float = 10.0
+    root_sift: bool = True
+    num_workers: int = 0
+
+
+@dataclass
+class ORBConfig(DetectorConfig):
+    name: str = "ORB"
+    max_keypoints: int = 2000
+    scale_factor: float = 1.2
+    num_levels: int = 8
+    fast_threshold: int = 20
+    num_workers: int = 0
+
+
+@dataclass
+class HammingLSHConfig(MatcherConfig):
+    name: str = "HammingLSH"
+    descriptor_bits: int = 256
+    num_tables: int = 8
+    key_bits: int = 16
+    probe_radius: int = 1
+    max_bucket_size: int = 64
+    max_distance: int = 64
+    ratio_threshold: float = 0.8
+    seed: int = 0
+
 
 @dataclass
 class ImageKeyPoints:
@@ -51,18 +150,22 @@ class ImageKeyPoints:
         scores tensor of shape (N,), by default None
     image_size : tuple[int, int], optional
         image size, by default None
+    cache : Dict[str, Any], optional
+        per-image state precomputed by the matchers, see KeyPointMatcher.precompute,
+        by default empty. It is not carried over by the conversion methods.
     """
 
     keypoints: np.ndarray | torch.Tensor
     descriptors: np.ndarray | torch.Tensor
     scores: np.ndarray | torch.Tensor | None = None
     image_size: tuple[int, int] | None = None
+    cache: Dict[str, Any] = field(default_factory=dict, repr=False, compare=False)
 
     def __post_init__(self) -> None:
         if self.scores is not None:
             assert len(self.keypoints) == len(self.scores)
 
-        self._is_torch = isinstance(self.keypoints, torch.Tensor)
+        self._is_torch = is_tensor(self.keypoints)
 
     def __len__(self) -> int:
         return len(self.keypoints)
@@ -83,7 +186,7 @@ class ImageKeyPoints:
 
     @property
     def is_torch(self) -> bool:
-        return isinstance(self.keypoints, torch.Tensor)
+        return is_tensor(self.keypoints)
 
     def to(self, device: str) -> ImageKeyPoints:
         return (
@@ -146,9 +249,9 @@ class ImageKeyPoints:
         self._is_torch = True
         return (
             ImageKeyPoints(
-                keypoints=torch.tensor(self.keypoints),
-                descriptors=torch.tensor(self.descriptors),
-                scores=torch.tensor(self.scores) if self.scores is not None else None,
+                keypoints=as_tensor(self.keypoints),
+                descriptors=as_tensor(self.descriptors),
+                scores=as_tensor(self.scores) if self.scores is not None else None,
                 image_size=self.image_size,
             )
             if not self.is_torch
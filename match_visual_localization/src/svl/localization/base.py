@@ -1,8 +1,12 @@
 import logging
+import os
+import threading
+import time
 from abc import ABC
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 from tqdm import tqdm
 
 import cv2
@@ -10,7 +14,16 @@ import numpy as np
 
 from superglue_lib.models.utils import process_resize
 from svl.keypoint_pipeline.typing import ImageKeyPoints
-from svl.keypoint_pipeline.base import CombinedKeyPointAlgorithm
+from svl.keypoint_pipeline.base import CombinedKeyPointAlgorithm, KeyPointMatcher
+from svl.localization.catalog import TileCatalog
+from svl.localization.descriptor_store import DescriptorStore
+from svl.localization.feature_cache import FeatureCache
+from svl.localization.image_cache import ImageLRUCache
+
+if TYPE_CHECKING:
+    from svl.localization.map_index import MapIndex
+    from svl.localization.retrieval import RetrievalIndex
+    from svl.localization.voting import DescriptorIndex
 
 @dataclass
 class BaseMapReaderItem:
@@ -32,6 +45,23 @@ class BaseMapReader(ABC):
         Size to resize the images to, by default None
     cv2_read_mode : int, optional
         OpenCV read mode, by default cv2.IMREAD_COLOR
+    lazy : bool, optional
+        If True, load_images() does not decode the images. Each image is decoded
+        (and resized once resize_db_images() was called) on first access through
+        __getitem__ and kept in an LRU cache. Evicted images are reset to None and
+        decoded again on their next access. Use key_points() or get_item() with
+        decode=False to read the features or metadata without decoding, by
+        default False
+    cache_bytes : int, optional
+        Byte budget of the LRU cache used in lazy mode, by default 1 GiB
+    num_workers : Optional[int], optional
+        Number of threads used to decode and resize the images. cv2.imread and
+        cv2.resize release the GIL, so the images are processed concurrently, by
+        default None which uses one thread per CPU
+    pyramid_levels : Optional[Sequence[Tuple[int, ...]]], optional
+        Resize sizes of the levels of the image pyramid described by
+        describe_pyramid(), with the same semantics as resize_size, e.g.
+        [(200,), (400,), (800,)], by default None
 
     """
 
@@ -43,6 +73,10 @@ class BaseMapReader(ABC):
         logger: logging.Logger,
         resize_size: Optional[Tuple[int, int]] = None,
         cv2_read_mode: int = cv2.IMREAD_COLOR,
+        lazy: bool = False,
+        cache_bytes: int = 1 << 30,
+        num_workers: Optional[int] = None,
+        pyramid_levels: Optional[Sequence[Tuple[int, ...]]] = None,
     ) -> None:
         db_path = db_path if isinstance(db_path, Path) else Path(db_path)
         if not db_path.exists():
@@ -53,19 +87,116 @@ class BaseMapReader(ABC):
         self.cv2_read_mode = cv2_read_mode
         self.resize_size = resize_size
         self.logger = logger
+        self.lazy = lazy
+        self.num_workers = num_workers if num_workers else os.cpu_count() or 1
+        self.pyramid_levels = (
+            [tuple(level) for level in pyramid_levels] if pyramid_levels else []
+        )
+        self._image_cache = ImageLRUCache(cache_bytes, on_evict=self._on_image_evicted)
+        self._lock = threading.RLock()
+        self._update_listeners: List[Callable[[Any], None]] = []
+        self._update_preparers: List[Callable[..., Callable[[], None]]] = []
         self._initialize_db()
 
     def _initialize_db(self) -> None:
         """Initialize the image database"""
         self._image_db: List[BaseMapReaderItem] = []
+        self._catalog = TileCatalog()
         self._num_images: int = 0
         self._is_loaded: bool = False
         self._is_described: bool = False
+        self._is_resized: bool = False
+        self._descriptor_store: Optional[DescriptorStore] = None
+        # Indices over the features, by cache name, with the path they are saved to
+        self._map_indices: Dict[str, Tuple["MapIndex", Path]] = {}
+        self._pyramid: Dict[Tuple[int, ...], List[ImageKeyPoints]] = {}
+        self._pyramid_algorithms: Dict[Tuple[int, ...], CombinedKeyPointAlgorithm] = {}
 
     @property
     def image_names(self) -> List[str]:
         """List of image names in the database"""
-        return [image.name for image in self._image_db]
+        return self._catalog.names
+
+    @property
+    def lock(self) -> threading.RLock:
+        """Lock held while the database is updated. Hold it while running queries
+        to keep the image indices stable"""
+        return self._lock
+
+    def add_update_listener(self, listener: Callable[[Any], None]) -> None:
+        """Register a function called after each update of the database
+
+        Parameters
+        ----------
+        listener : Callable[[Any], None]
+            Function called with the description of the update, while the lock of
+            the database is held
+        """
+        self._update_listeners.append(listener)
+
+    def add_update_preparer(
+        self,
+        preparer: Callable[
+            [Any, List[str], List[Optional[ImageKeyPoints]]], Callable[[], None]
+        ],
+    ) -> None:
+        """Register a function preparing the state derived from the database for
+        each update, e.g. an index over the features
+
+        The preparer is called before the new database is swapped in, without
+        holding the lock, with the description of the update and the names and
+        the features of the images of the new database. It returns a function
+        called while the lock is held, right after the swap, which should only
+        swap in the prepared state.
+
+        Parameters
+        ----------
+        preparer : Callable[..., Callable[[], None]]
+            Function preparing an update and returning the function applying it
+        """
+        self._update_preparers.append(preparer)
+
+    @property
+    def catalog(self) -> TileCatalog:
+        """Catalog of the images in the database"""
+        return self._catalog
+
+    def _add_image(self, img_item: BaseMapReaderItem) -> int:
+        """Add an image item to the database
+
+        Parameters
+        ----------
+        img_item : BaseMapReaderItem
+            Image item to add, its name must be unique
+
+        Returns
+        -------
+        int
+            Index of the image in the database
+        """
+        idx = self._catalog.append(img_item.name, img_item.image_path)
+        self._image_db.append(img_item)
+        self._num_images = len(self._image_db)
+        return idx
+
+    @property
+    def descriptor_store(self) -> Optional[DescriptorStore]:
+        """Descriptor store backing the keypoints of the database, if any"""
+        return self._descriptor_store
+
+    @property
+    def descriptor_index(self) -> Optional["DescriptorIndex"]:
+        """DescriptorIndex built at describe time, None if not requested, see
+        load_descriptor_index()"""
+        index, _ = self._map_indices.get("descriptor_index", (None, None))
+        return index
+
+    @property
+    def retrieval_index(self) -> Optional["RetrievalIndex"]:
+        """RetrievalIndex built at describe time, None if not requested, see
+        load_retrieval_index()"""
+        index, _ = self._map_indices.get("retrieval_index", (None, None))
+        return index
 
     def __len__(self) -> int:
         """Number of images in the database"""
@@ -83,20 +214,105 @@ class BaseMapReader(ABC):
         Returns
         -------
         BaseMapReaderItem
-            Image item from the database
+            Image item from the database. In lazy mode, the image of the item is
+            decoded if it is not in the cache.
         """
+        return self.get_item(key)
+
+    def _index_of(self, key: Union[int, str]) -> int:
+        """Index of an image given its index or name"""
         if isinstance(key, int):
             if key < 0 or key >= len(self._image_db):
                 raise IndexError("Index out of range")
-            return self._image_db[key]
-        elif isinstance(key, str):
-            if key not in self.image_names:
-                raise KeyError(f"Image with name {key} not found in the database")
-            for img_item in self._image_db:
-                if img_item.name == key:
-                    return img_item
-        else:
-            raise KeyError("Key must be either an integer or a string")
+            return key
+        if isinstance(key, str):
+            return self._catalog.index_of(key)
+        raise KeyError("Key must be either an integer or a string")
+
+    def get_item(self, key: Union[int, str], decode: bool = True) -> BaseMapReaderItem:
+        """Get image item from the database
+
+        Parameters
+        ----------
+        key : Union[int, str]
+            Index or name of the image
+        decode : bool, optional
+            In lazy mode, decode the image if it is not in the cache. Without it,
+            the image of the item may be None, which avoids decoding the images
+            when only their keypoints or metadata are read, by default True
+
+        Returns
+        -------
+        BaseMapReaderItem
+            Image item from the database
+        """
+        idx = self._index_of(key)
+        img_item = self._image_db[idx]
+        if decode and self.lazy and self._is_loaded:
+            if self._image_cache.get(idx) is None:
+                self._load_lazy_image(idx, img_item)
+        return img_item
+
+    def get_image(self, key: Union[int, str]) -> np.ndarray:
+        """Get the image of an item. In lazy mode, an image missing from the cache
+        is decoded without adding it to the cache, so that a walk over the whole
+        database does not evict the images in use
+
+        Parameters
+        ----------
+        key : Union[int, str]
+            Index or name of the image
+
+        Returns
+        -------
+        np.ndarray
+            Image array
+        """
+        idx = self._index_of(key)
+        img_item = self._image_db[idx]
+        if not self.lazy:
+            return img_item.image
+        image = self._image_cache.get(idx)
+        if image is None:
+            image = self._ingest_image(img_item, resize=self._is_resized)
+        return image
+
+    def key_points(self, key: Union[int, str]) -> Optional[ImageKeyPoints]:
+        """Get the keypoints of an image without decoding it
+
+        Parameters
+        ----------
+        key : Union[int, str]
+            Index or name of the image
+
+        Returns
+        -------
+        Optional[ImageKeyPoints]
+            Keypoints of the image, None if it is not described
+        """
+        return self._image_db[self._index_of(key)].key_points
+
+    def _load_lazy_image(self, idx: int, img_item: BaseMapReaderItem) -> None:
+        """Decode an image in lazy mode and add it to the LRU cache
+
+        Parameters
+        ----------
+        idx : int
+            Index of the image in the database
+        img_item : BaseMapReaderItem
+            Image item to load
+        """
+        image = self.read(img_item.image_path)
+        if self._is_resized:
+            image = self.resize(image)
+        img_item.image = image
+        img_item.size = image.shape[:2]
+        self._image_cache.put(idx, image)
+
+    def _on_image_evicted(self, idx: int, image: np.ndarray) -> None:
+        """Release the image of an item evicted from the LRU cache"""
+        if idx < len(self._image_db) and self._image_db[idx].image is image:
+            self._image_db[idx].image = None
 
     def read(self, image_path: Union[str, Path]) -> np.ndarray:
         """Read image from file
@@ -119,19 +335,91 @@ class BaseMapReader(ABC):
 
         return img
 
-    def load_images(self) -> None:
-        """Load images from the database"""
+    def _map_images(
+        self, fct: Callable[[BaseMapReaderItem], Any], desc: str
+    ) -> List[Any]:
+        """Apply a function to all image items on a thread pool
+
+        Parameters
+        ----------
+        fct : Callable[[BaseMapReaderItem], Any]
+            Function to apply to each image item
+        desc : str
+            Description of the processing, used for the progress bar and logs
+
+        Returns
+        -------
+        List[Any]
+            Results in the order of the database
+        """
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            results = list(
+                tqdm(executor.map(fct, self._image_db), desc=desc, total=len(self))
+            )
+        elapsed_time = time.perf_counter() - start_time
+        self.logger.info(
+            f"{desc}: {len(results)} images in {elapsed_time:.2f} seconds "
+            f"({len(results) / max(elapsed_time, 1e-9):.1f} tiles/s, "
+            f"{self.num_workers} workers)"
+        )
+        return results
+
+    def _ingest_image(self, img_item: BaseMapReaderItem, resize: bool) -> np.ndarray:
+        """Decode an image item and optionally resize it
+
+        Parameters
+        ----------
+        img_item : BaseMapReaderItem
+            Image item to decode
+        resize : bool
+            Whether to resize the decoded image
+
+        Returns
+        -------
+        np.ndarray
+            Image array
+        """
+        image = self.read(img_item.image_path)
+        if image is None:
+            raise ValueError(f"Unable to decode image at {img_item.image_path}")
+        return self.resize(image) if resize else image
+
+    def load_images(self, resize: bool = False) -> None:
+        """Load images from the database. In lazy mode, the images are decoded on
+        first access instead.
+
+        Parameters
+        ----------
+        resize : bool, optional
+            Resize the images while decoding them, which replaces a separate call
+            to resize_db_images(), by default False
+        """
 
         if self._is_loaded:
             self.logger.info("Images already loaded")
             return
-        for idx in tqdm(range(len(self)), desc="Loading images", total=len(self)):
-            self[idx].image = self.read(self[idx].image_path)
-            self[idx].size = self[idx].image.shape[:2]
+        if self.lazy:
+            self._is_loaded = True
+            self._is_resized = self._is_resized or resize
+            self.logger.info(
+                "Lazy mode: images will be loaded on first access with a cache of "
+                f"{self._image_cache.max_bytes / 2**20:.0f} MiB"
+            )
+            return
+        images = self._map_images(
+            lambda img_item: self._ingest_image(img_item, resize), "Loading images"
+        )
+        for img_item, image in zip(self._image_db, images):
+            img_item.image = image
+            img_item.size = image.shape[:2]
         self._is_loaded = True
+        self._is_resized = self._is_resized or resize
         self.logger.info("Images loaded successfully")
 
-    def resize(self, image: np.ndarray) -> np.ndarray:
+    def resize(
+        self, image: np.ndarray, resize_size: Optional[Tuple[int, ...]] = None
+    ) -> np.ndarray:
         """Resize image given np.ndarray. It first computes the new size based on the
         resize_size attribute and then resizes the image.
 
@@ -139,16 +427,20 @@ class BaseMapReader(ABC):
         ----------
         image : np.ndarray
             Image array, shape (height, width, channels)
+        resize_size : Optional[Tuple[int, ...]], optional
+            Size to resize the image to instead of the resize_size attribute, by
+            default None
 
         Returns
         -------
         np.ndarray
             Resized image array
         """
-        if self.resize_size is None:
+        resize_size = resize_size if resize_size is not None else self.resize_size
+        if resize_size is None:
             return image
         height, width = image.shape[:2]
-        new_width, new_height = process_resize(width, height, self.resize_size)
+        new_width, new_height = process_resize(width, height, resize_size)
         resized_image = cv2.resize(
             image, (new_width, new_height), interpolation=cv2.INTER_AREA
         )
@@ -171,10 +463,23 @@ class BaseMapReader(ABC):
         img_item.size = img_item.image.shape[:2]
 
     def resize_db_images(self) -> None:
-        """Resize all images in the database"""
+        """Resize all images in the database. In lazy mode, the cached images are
+        dropped and the images are resized when they are decoded."""
         self.logger.info("Resizing images in the database")
-        for imge_name in tqdm(self.image_names):
-            self.resize_image(imge_name)
+        if self.lazy:
+            self._image_cache.clear()
+            self._is_resized = True
+            return
+        images = self._map_images(
+            lambda img_item: self.resize(img_item.image)
+            if img_item.image is not None
+            else self._ingest_image(img_item, resize=True),
+            "Resizing images",
+        )
+        for img_item, image in zip(self._image_db, images):
+            img_item.image = image
+            img_item.size = image.shape[:2]
+        self._is_resized = True
 
     def extract_features(
         self, image: np.ndarray, algorithm: CombinedKeyPointAlgorithm
@@ -190,6 +495,20 @@ class BaseMapReader(ABC):
         """
         return algorithm.detect_and_describe_keypoints(image)
 
+    def extract_features_batch(
+        self, images: List[np.ndarray], algorithm: CombinedKeyPointAlgorithm
+    ) -> List[ImageKeyPoints]:
+        """Extract features from several images using the given algorithm
+
+        Parameters
+        ----------
+        images : List[np.ndarray]
+            Image arrays to extract features from
+        algorithm : CombinedKeyPointAlgorithm
+            Key point detection and description algorithm
+        """
+        return algorithm.detect_and_describe_keypoints_batch(images)
+
     def extract_features_from_image(
         self, image_name: str, algorithm: CombinedKeyPointAlgorithm
     ) -> None:
@@ -205,21 +524,400 @@ class BaseMapReader(ABC):
         kp: ImageKeyPoints = self.extract_features(self[image_name].image, algorithm)
         self[image_name].key_points = kp
 
-    def describe_db_images(self, algorithm: CombinedKeyPointAlgorithm) -> None:
+    def describe_db_images(
+        self,
+        algorithm: CombinedKeyPointAlgorithm,
+        feature_cache: Optional[FeatureCache] = None,
+        batch_size: int = 4,
+        descriptor_index: Optional[Dict[str, Any]] = None,
+        retrieval_index: Optional[Dict[str, Any]] = None,
+    ) -> None:
         """Describe all images in the database using the given algorithm
 
         Parameters
         ----------
         algorithm : CombinedKeyPointAlgorithm
             Key point detection and description algorithm
+        feature_cache : Optional[FeatureCache], optional
+            On-disk cache of the extracted features. If given, only the images
+            missing from the cache or whose cache entry is stale are described,
+            by default None
+        batch_size : int, optional
+            Number of images described in one call to the algorithm, which bounds
+            the memory used by batched algorithms, by default 4
+        descriptor_index : Optional[Dict[str, Any]], optional
+            Build settings of a DescriptorIndex over the described images, see
+            DescriptorIndex.build(). If given, the index is loaded from the
+            feature cache or built and saved there, and kept in sync with
+            update_db(), see load_descriptor_index(), by default None
+        retrieval_index : Optional[Dict[str, Any]], optional
+            Build settings of a RetrievalIndex over the described images, see
+            RetrievalIndex.build(), persisted like descriptor_index, see
+            load_retrieval_index(), by default None
         """
 
         if not self._is_loaded:
             raise ValueError("Images are not loaded, call load_images() first")
+        indices = descriptor_index is not None or retrieval_index is not None
+        if indices and feature_cache is None:
+            raise ValueError("A feature cache is required to persist the index")
         self.logger.info(
             f"Describing images in the database using {algorithm.__class__.__name__}"
         )
-        for img_info in tqdm(self._image_db):
-            self.extract_features_from_image(img_info.name, algorithm)
+        namespace = (
+            feature_cache.namespace(algorithm, self.resize_size)
+            if feature_cache is not None
+            else None
+        )
+        key_points, num_hits = self._describe_in_batches(
+            self._image_db,
+            lambda img_item: self.get_image(img_item.name),
+            algorithm,
+            feature_cache,
+            namespace,
+            batch_size=batch_size,
+        )
+        for img_item, kp in zip(self._image_db, key_points):
+            img_item.key_points = kp
+        if feature_cache is not None:
+            self.logger.info(
+                f"Feature cache: {num_hits} hits, {len(self) - num_hits} images "
+                "described"
+            )
+
+        self._is_described = True
+        if descriptor_index is not None:
+            self.load_descriptor_index(feature_cache, algorithm, **descriptor_index)
+        if retrieval_index is not None:
+            self.load_retrieval_index(feature_cache, algorithm, **retrieval_index)
+
+    def load_map_index(
+        self,
+        index_class: type,
+        feature_cache: FeatureCache,
+        algorithm: CombinedKeyPointAlgorithm,
+        **kwargs,
+    ) -> "MapIndex":
+        """Load an index over the features of the described images or build it,
+        next to their entries in the feature cache, and keep it in sync with
+        update_db()
+
+        The index is saved in the namespace of the feature settings under a name
+        depending on the build settings. A saved index is synced with the images
+        whose descriptors changed, see MapIndex.load_or_build(). For each update
+        of the database, the synced index is prepared and saved before the lock
+        is taken, and swapped in place with the database. It replaces the loaded
+        index of the same class, if any.
+
+        Parameters
+        ----------
+        index_class : type
+            Subclass of MapIndex to load
+        feature_cache : FeatureCache
+            On-disk cache of the extracted features
+        algorithm : CombinedKeyPointAlgorithm
+            Key point detection and description algorithm the images were
+            described with
+        **kwargs
+            Build settings of the index, see the build() method of the class
+
+        Returns
+        -------
+        MapIndex
+            The index
+        """
+        if not self._is_described:
+            raise ValueError("Images are not described, call describe_db_images() first")
+        namespace = feature_cache.namespace(algorithm, self.resize_size)
+        path = index_class.cache_path(namespace, **kwargs)
+        index = index_class.load_or_build(path, self, logger=self.logger, **kwargs)
+        self._map_indices[index_class.CACHE_NAME] = (index, path)
+        if self._prepare_map_indices not in self._update_preparers:
+            self.add_update_preparer(self._prepare_map_indices)
+        return index
+
+    def load_descriptor_index(
+        self,
+        feature_cache: FeatureCache,
+        algorithm: CombinedKeyPointAlgorithm,
+        **kwargs,
+    ) -> "DescriptorIndex":
+        """Load the DescriptorIndex of the described images or build it, see
+        load_map_index() and DescriptorIndex.build() for the keyword arguments.
+        The index is also available as descriptor_index"""
+        # Imported here, the voting module depends on this one
+        from svl.localization.voting import DescriptorIndex
+
+        return self.load_map_index(DescriptorIndex, feature_cache, algorithm, **kwargs)
+
+    def load_retrieval_index(
+        self,
+        feature_cache: FeatureCache,
+        algorithm: CombinedKeyPointAlgorithm,
+        **kwargs,
+    ) -> "RetrievalIndex":
+        """Load the RetrievalIndex of the described images or build it, see
+        load_map_index() and RetrievalIndex.build() for the keyword arguments.
+        The index is also available as retrieval_index"""
+        # Imported here, the retrieval module depends on this one
+        from svl.localization.retrieval import RetrievalIndex
+
+        return self.load_map_index(RetrievalIndex, feature_cache, algorithm, **kwargs)
+
+    def _prepare_map_indices(
+        self,
+        update: Any,
+        names: List[str],
+        key_points: List[Optional[ImageKeyPoints]],
+    ) -> Callable[[], None]:
+        """Update preparer syncing and saving the loaded indices, which are swapped
+        in place once the new database is"""
+        synced = []
+        for index, path in self._map_indices.values():
+            new_index = index.synced(names, key_points, update.changed)
+            new_index.save(path)
+            synced.append((index, new_index))
+
+        def apply() -> None:
+            for index, new_index in synced:
+                index.assign(new_index)
+
+        return apply
+
+    def precompute_matcher(self, matcher: KeyPointMatcher) -> None:
+        """Precompute the per-image state of a matcher for all images in the database
+
+        The state is stored in the keypoints of the images, see
+        KeyPointMatcher.precompute(). Images described afterwards, e.g. by
+        update_db(), are matched without it until this method is called again.
+
+        Parameters
+        ----------
+        matcher : KeyPointMatcher
+            Key point matcher used against the images of the database
+        """
+        if not self._is_described:
+            raise ValueError("Images are not described, call describe_db_images() first")
+        for img_item in tqdm(self._image_db, desc="Precomputing matcher state"):
+            matcher.precompute(img_item.key_points)
+        self.logger.info(
+            f"{matcher.__class__.__name__} state precomputed for {len(self)} images"
+        )
+
+    def _level_size(
+        self, size: Optional[Tuple[int, int]], level: Optional[Tuple[int, ...]]
+    ) -> Optional[Tuple[int, int]]:
+        """Size of a loaded image of the given size once resized to a pyramid
+        level, see resize(), None if the size is unknown"""
+        if size is None or level is None:
+            return tuple(size) if size is not None else None
+        height, width = size
+        new_width, new_height = process_resize(width, height, level)
+        return new_height, new_width
+
+    def _describe_in_batches(
+        self,
+        img_items: Sequence[BaseMapReaderItem],
+        read_image: Callable[[BaseMapReaderItem], np.ndarray],
+        algorithm: CombinedKeyPointAlgorithm,
+        feature_cache: Optional[FeatureCache],
+        namespace: Optional[Path],
+        level: Optional[Tuple[int, ...]] = None,
+        batch_size: int = 4,
+        desc: str = "Describing images",
+    ) -> Tuple[List[ImageKeyPoints], int]:
+        """Describe image items, batch_size images at a time
+
+        The cache entries are looked up before reading any image: they are
+        checked against the size of the loaded image, or of the pyramid level,
+        when it is known, so a warm cache does not decode the images in lazy mode.
+        The images missing from the cache are read and the ones of a batch are
+        described in a single call to the batch API of the algorithm. Without a
+        level, the size of the items is set from their features.
 
-        self._is_described = True
\ No newline at end of file
+        Parameters
+        ----------
+        img_items : Sequence[BaseMapReaderItem]
+            Image items to describe
+        read_image : Callable[[BaseMapReaderItem], np.ndarray]
+            Function returning the loaded image of an item
+        algorithm : CombinedKeyPointAlgorithm
+            Key point detection and description algorithm
+        feature_cache : Optional[FeatureCache]
+            On-disk cache of the extracted features
+        namespace : Optional[Path]
+            Directory of the cache entries, see FeatureCache.namespace()
+        level : Optional[Tuple[int, ...]], optional
+            Resize size of the pyramid level to describe, the loaded images if
+            None, by default None
+        batch_size : int, optional
+            Number of images read and described at a time, by default 4
+        desc : str, optional
+            Description of the progress bar, by default "Describing images"
+
+        Returns
+        -------
+        Tuple[List[ImageKeyPoints], int]
+            Features of the items, in their order, and the number of items found
+            in the cache
+        """
+        key_points: List[Optional[ImageKeyPoints]] = [None] * len(img_items)
+        num_hits = 0
+        with tqdm(total=len(img_items), desc=desc) as progress:
+            for start in range(0, len(img_items), batch_size):
+                pending = []
+                for idx in range(start, min(start + batch_size, len(img_items))):
+                    img_item = img_items[idx]
+                    content_hash = None
+                    if feature_cache is not None:
+                        content_hash = feature_cache.hash_file(img_item.image_path)
+                        kp = feature_cache.load(
+                            namespace,
+                            img_item.name,
+                            content_hash,
+                            self._level_size(getattr(img_item, "size", None), level),
+                        )
+                        if kp is not None:
+                            key_points[idx] = kp
+                            num_hits += 1
+                            continue
+                    pending.append((idx, content_hash))
+
+                images = []
+                for idx, _ in pending:
+                    image = read_image(img_items[idx])
+                    if level is None:
+                        img_items[idx].size = image.shape[:2]
+                    images.append(self.resize(image, level) if level else image)
+                extracted = (
+                    self.extract_features_batch(images, algorithm) if pending else []
+                )
+                for (idx, content_hash), kp in zip(pending, extracted):
+                    key_points[idx] = kp
+                    if feature_cache is not None:
+                        feature_cache.save(
+                            namespace, img_items[idx].name, content_hash, kp
+                        )
+                progress.update(min(batch_size, len(img_items) - start))
+
+        if level is None:
+            for img_item, kp in zip(img_items, key_points):
+                if getattr(img_item, "size", None) is None:
+                    img_item.size = tuple(kp.image_size)
+        return key_points, num_hits
+
+    def describe_pyramid(
+        self,
+        algorithm: CombinedKeyPointAlgorithm,
+        levels: Optional[Sequence[Tuple[int, ...]]] = None,
+        feature_cache: Optional[FeatureCache] = None,
+        batch_size: int = 4,
+    ) -> None:
+        """Describe all images in the database at several resolutions.
+
+        Each level resizes the loaded images with the semantics of resize_size (see
+        process_resize), so the levels should not be larger than the loaded images.
+        The features of a level are persisted in the feature cache under the
+        level size, like describe_db_images() does with resize_size. A detector
+        configured with fewer keypoints may be used for the coarse levels.
+
+        Parameters
+        ----------
+        algorithm : CombinedKeyPointAlgorithm
+            Key point detection and description algorithm
+        levels : Optional[Sequence[Tuple[int, ...]]], optional
+            Resize sizes of the levels to describe, by default None which uses the
+            pyramid_levels attribute
+        feature_cache : Optional[FeatureCache], optional
+            On-disk cache of the extracted features, by default None
+        batch_size : int, optional
+            Number of images described in one call to the algorithm, by default 4
+        """
+        levels = [tuple(level) for level in levels] if levels else self.pyramid_levels
+        if not levels:
+            raise ValueError("No pyramid level to describe")
+        if not self._is_loaded:
+            raise ValueError("Images are not loaded, call load_images() first")
+
+        for level in levels:
+            namespace = (
+                feature_cache.namespace(algorithm, level) if feature_cache else None
+            )
+            key_points, num_hits = self._describe_in_batches(
+                self._image_db,
+                lambda img_item: self.get_image(img_item.name),
+                algorithm,
+                feature_cache,
+                namespace,
+                level,
+                batch_size,
+                f"Describing pyramid level {level}",
+            )
+            self._pyramid[level] = key_points
+            self._pyramid_algorithms[level] = algorithm
+            self.logger.info(
+                f"Pyramid level {level} described: {num_hits} cache hits, "
+                f"{len(self) - num_hits} images described"
+            )
+
+    def pyramid_key_points(self, level: Tuple[int, ...]) -> List[ImageKeyPoints]:
+        """Get the features of all images at a level of the pyramid
+
+        Parameters
+        ----------
+        level : Tuple[int, ...]
+            Resize size of the level
+
+        Returns
+        -------
+        List[ImageKeyPoints]
+            Features of the images, in the order of the database
+        """
+        level = tuple(level)
+        if level not in self._pyramid:
+            raise KeyError(f"Pyramid level {level} is not described")
+        return self._pyramid[level]
+
+    def build_descriptor_store(self, store_dir: Union[str, Path]) -> DescriptorStore:
+        """Pack the keypoints of all images into a descriptor store and attach it
+
+        Parameters
+        ----------
+        store_dir : Union[str, Path]
+            Directory of the descriptor store
+
+        Returns
+        -------
+        DescriptorStore
+            The descriptor store
+        """
+        if not self._is_described:
+            raise ValueError("Images are not described, call describe_db_images() first")
+        store = DescriptorStore.build(
+            store_dir,
+            names=self.image_names,
+            key_points=[img_item.key_points for img_item in self._image_db],
+            logger=self.logger,
+        )
+        self.attach_descriptor_store(store)
+        return store
+
+    def attach_descriptor_store(self, store: DescriptorStore) -> None:
+        """Use the keypoints of a descriptor store for all images in the database.
+
+        The keypoints of each image become views on the memory-mapped arrays of the
+        store, which replaces describe_db_images() when the store is up to date.
+
+        Parameters
+        ----------
+        store : DescriptorStore
+            Descriptor store holding the keypoints of every image in the database
+        """
+        missing = [name for name in self.image_names if name not in store]
+        if missing:
+            raise KeyError(f"Images not found in the descriptor store: {missing}")
+        for img_item in self._image_db:
+            img_item.key_points = store[img_item.name]
+        self._descriptor_store = store
+        self._is_described = True
+        self.logger.info(f"Descriptor store attached from {store.store_dir}")
@@ -0,0 +1,154 @@
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class TileCatalog:
+    """Columnar catalog of the images of a map.
+
+    The catalog keeps the names and paths of the images in insertion order, a hash
+    map from name to index, and the geographic bounds of all the images in a single
+    float64 array of shape (N, 4) with columns (lat_min, lon_min, lat_max, lon_max).
+    The bounds of images without metadata are NaN.
+    """
+
+    BOUNDS_COLUMNS = ["lat_min", "lon_min", "lat_max", "lon_max"]
+
+    def __init__(self) -> None:
+        self.names: List[str] = []
+        self.paths: List[Path] = []
+        self._name_to_index: Dict[str, int] = {}
+        self._bounds = np.empty((0, 4), dtype=np.float64)
+
+    @classmethod
+    def from_columns(
+        cls, names: List[str], paths: Sequence[Path], bounds: np.ndarray
+    ) -> "TileCatalog":
+        """Create a catalog from its columns without copying them
+
+        Parameters
+        ----------
+        names : List[str]
+            unique names of the images
+        paths : Sequence[Path]
+            paths to the image files
+        bounds : np.ndarray
+            bounds of the images, shape (N, 4), may be a read-only view
+
+        Returns
+        -------
+        TileCatalog
+            the catalog
+        """
+        if not (len(names) == len(paths) == len(bounds)):
+            raise ValueError("Names, paths and bounds differ in length")
+        catalog = cls()
+        catalog.names, catalog.paths = names, paths
+        catalog._name_to_index = dict(zip(names, range(len(names))))
+        if len(catalog._name_to_index) != len(names):
+            raise ValueError("Image names are not unique")
+        catalog._bounds = bounds
+        return catalog
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._name_to_index
+
+    @property
+    def bounds(self) -> np.ndarray:
+        """Bounds of the images, shape (N, 4)"""
+        if len(self._bounds) != len(self.names):
+            missing = np.full((len(self.names) - len(self._bounds), 4), np.nan)
+            self._bounds = np.concatenate([self._bounds, missing])
+        return self._bounds
+
+    def append(self, name: str, path: Path) -> int:
+        """Add an image to the catalog
+
+        Parameters
+        ----------
+        name : str
+            name of the image, must be unique
+        path : Path
+            path to the image file
+
+        Returns
+        -------
+        int
+            index of the image
+        """
+        if name in self._name_to_index:
+            raise ValueError(f"Image with name {name} already in the catalog")
+        self._name_to_index[name] = len(self.names)
+        self.names.append(name)
+        self.paths.append(path)
+        return len(self.names) - 1
+
+    def index_of(self, name: str) -> int:
+        """Get the index of an image
+
+        Parameters
+        ----------
+        name : str
+            name of the image
+
+        Returns
+        -------
+        int
+            index of the image
+        """
+        if name not in self._name_to_index:
+            raise KeyError(f"Image with name {name} not found in the database")
+        return self._name_to_index[name]
+
+    def join_bounds(
+        self,
+        metadata: pd.DataFrame,
+        name_column: str,
+        corner_columns: Tuple[str, str, str, str],
+    ) -> Tuple[List[str], List[str]]:
+        """Set the bounds of the images from a metadata table in a single join.
+
+        Names appearing more than once in the table are ambiguous and are not
+        joined, like names missing from the table.
+
+        Parameters
+        ----------
+        metadata : pd.DataFrame
+            metadata table with one row per image
+        name_column : str
+            column holding the image names
+        corner_columns : Tuple[str, str, str, str]
+            columns holding the latitude and longitude of two opposite corners, in
+            the order (lat_1, lon_1, lat_2, lon_2)
+
+        Returns
+        -------
+        Tuple[List[str], List[str]]
+            names of the images without metadata and names of the images with
+            multiple metadata entries
+        """
+        duplicated = metadata[name_column].duplicated(keep=False)
+        unique = metadata[~duplicated]
+        rows = pd.Index(unique[name_column]).get_indexer(self.names)
+        found = rows >= 0
+
+        corners = unique[list(corner_columns)].to_numpy(dtype=np.float64)[rows[found]]
+        lats, longs = corners[:, [0, 2]], corners[:, [1, 3]]
+        bounds = self.bounds
+        bounds[found] = np.stack(
+            [lats.min(1), longs.min(1), lats.max(1), longs.max(1)], axis=1
+        )
+
+        duplicated_names = set(metadata.loc[duplicated, name_column])
+        missing = [
+            name
+            for name, is_found in zip(self.names, found)
+            if not is_found and name not in duplicated_names
+        ]
+        multiple = [name for name in self.names if name in duplicated_names]
+        return missing, multiple
@@ -0,0 +1,244 @@
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+from svl.keypoint_pipeline.typing import ImageKeyPoints
+
+
+def descriptor_dtype(key_points: List[ImageKeyPoints]) -> np.dtype:
+    """Get the common dtype of the descriptors of a list of images
+
+    The descriptors are stored with their own dtype, so binary descriptors packed
+    in uint8 keep their layout and float descriptors are not converted.
+
+    Parameters
+    ----------
+    key_points : List[ImageKeyPoints]
+        keypoints of the images, as numpy arrays
+
+    Returns
+    -------
+    np.dtype
+        dtype of the descriptors, float32 if there are no images
+
+    Raises
+    ------
+    ValueError
+        if the images do not all have the same descriptor dtype
+    """
+    if not key_points:
+        return np.dtype(np.float32)
+    dtype = key_points[0].descriptors.dtype
+    for kp in key_points[1:]:
+        if kp.descriptors.dtype != dtype:
+            raise ValueError(
+                f"Descriptors of dtype {kp.descriptors.dtype} and {dtype} "
+                "can not be stored together"
+            )
+    return np.dtype(dtype)
+
+
+class DescriptorStore:
+    """Contiguous, memory-mapped storage of the keypoints of all the map images.
+
+    The keypoints, scores and descriptors of every image are packed one after the
+    other in three `.npy` files, and an offset table gives the range of rows of
+    each image. The files are opened with `np.load(..., mmap_mode="r")` so opening
+    a store does not read the data, the pages are shared between the processes
+    using the same store, and `__getitem__` returns views on the mapped arrays.
+
+    Store layout::
+
+        store_dir/
+            keypoints.npy     (N, 2) float32
+            scores.npy        (N,) float32
+            descriptors.npy   (N, D) descriptor dtype, e.g. float32 or packed uint8
+            offsets.npy       (T + 1,) int64, rows of image i are offsets[i]:offsets[i + 1]
+            image_sizes.npy   (T, 2) int64
+            names.json        list of the T image names
+
+    Parameters
+    ----------
+    store_dir : Union[str, Path]
+        directory of the store
+    mmap_mode : Optional[str], optional
+        memory-map mode passed to `np.load`, by default "r"
+    """
+
+    ARRAY_NAMES = ["keypoints", "scores", "descriptors", "offsets", "image_sizes"]
+    NAMES_FILE = "names.json"
+
+    def __init__(
+        self, store_dir: Union[str, Path], mmap_mode: Optional[str] = "r"
+    ) -> None:
+        self.store_dir = store_dir if isinstance(store_dir, Path) else Path(store_dir)
+        if not self.store_dir.is_dir():
+            raise FileNotFoundError(f"Descriptor store not found at {self.store_dir}")
+        for name in self.ARRAY_NAMES:
+            setattr(
+                self,
+                name,
+                np.load(self.store_dir / f"{name}.npy", mmap_mode=mmap_mode),
+            )
+        with open(self.store_dir / self.NAMES_FILE, "r") as file:
+            self._names: List[str] = json.load(file)
+        self._name_to_index: Dict[str, int] = {
+            name: idx for idx, name in enumerate(self._names)
+        }
+        if len(self.offsets) != len(self._names) + 1:
+            raise ValueError(f"Inconsistent offset table in {self.store_dir}")
+
+    @property
+    def names(self) -> List[str]:
+        """Names of the images in the store"""
+        return self._names
+
+    @property
+    def num_keypoints(self) -> int:
+        """Total number of keypoints in the store"""
+        return int(self.offsets[-1])
+
+    @property
+    def descriptor_dim(self) -> int:
+        """Dimension of the descriptors"""
+        return self.descriptors.shape[1]
+
+    def __len__(self) -> int:
+        """Number of images in the store"""
+        return len(self._names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._name_to_index
+
+    def index_of(self, name: str) -> int:
+        """Get the index of an image in the store
+
+        Parameters
+        ----------
+        name : str
+            name of the image
+
+        Returns
+        -------
+        int
+            index of the image
+        """
+        if name not in self._name_to_index:
+            raise KeyError(f"Image with name {name} not found in the store")
+        return self._name_to_index[name]
+
+    def __getitem__(self, key: Union[int, str]) -> ImageKeyPoints:
+        """Get the keypoints of an image as views on the mapped arrays
+
+        Parameters
+        ----------
+        key : Union[int, str]
+            index or name of the image
+
+        Returns
+        -------
+        ImageKeyPoints
+            keypoints of the image, no data is copied
+        """
+        idx = self.index_of(key) if isinstance(key, str) else key
+        if idx < 0 or idx >= len(self):
+            raise IndexError("Index out of range")
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return ImageKeyPoints(
+            keypoints=self.keypoints[start:end],
+            descriptors=self.descriptors[start:end],
+            scores=self.scores[start:end],
+            image_size=tuple(int(v) for v in self.image_sizes[idx]),
+        )
+
+    def image_ids(self) -> np.ndarray:
+        """Index of the image of every keypoint in the store
+
+        Returns
+        -------
+        np.ndarray
+            image indices, shape (N,)
+        """
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+    @classmethod
+    def build(
+        cls,
+        store_dir: Union[str, Path],
+        names: List[str],
+        key_points: Iterable[ImageKeyPoints],
+        logger: logging.Logger = None,
+    ) -> "DescriptorStore":
+        """Pack the keypoints of a list of images into a new store
+
+        Parameters
+        ----------
+        store_dir : Union[str, Path]
+            directory of the store, created if missing and overwritten otherwise
+        names : List[str]
+            names of the images
+        key_points : Iterable[ImageKeyPoints]
+            keypoints of the images, in the same order as `names`
+        logger : logging.Logger, optional
+            logger to use for logging, by default None
+
+        Returns
+        -------
+        DescriptorStore
+            the store opened in read-only mode
+        """
+        if logger is None:
+            logger = logging.getLogger(__name__)
+        store_dir = store_dir if isinstance(store_dir, Path) else Path(store_dir)
+        store_dir.mkdir(parents=True, exist_ok=True)
+
+        key_points = list(key_points)
+        if len(key_points) != len(names):
+            raise ValueError("The number of names and keypoints must be the same")
+        if any(kp is None for kp in key_points):
+            raise ValueError("All the images must be described")
+        key_points = [kp.numpy() for kp in key_points]
+
+        counts = np.array([len(kp) for kp in key_points], dtype=np.int64)
+        offsets = np.zeros(len(key_points) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        num_keypoints = int(offsets[-1])
+        descriptor_dim = key_points[0].descriptors.shape[1] if key_points else 0
+        dtype = descriptor_dtype(key_points)
+
+        open_memmap = np.lib.format.open_memmap
+        keypoints = open_memmap(
+            store_dir / "keypoints.npy", "w+", np.float32, (num_keypoints, 2)
+        )
+        scores = open_memmap(store_dir / "scores.npy", "w+", np.float32, (num_keypoints,))
+        descriptors = open_memmap(
+            store_dir / "descriptors.npy",
+            "w+",
+            dtype,
+            (num_keypoints, descriptor_dim),
+        )
+        for idx, kp in enumerate(key_points):
+            start, end = offsets[idx], offsets[idx + 1]
+            keypoints[start:end] = kp.keypoints
+            descriptors[start:end] = kp.descriptors
+            scores[start:end] = kp.scores if kp.scores is not None else 1.0
+        for array in (keypoints, scores, descriptors):
+            array.flush()
+        del keypoints, scores, descriptors
+
+        image_sizes = np.array(
+            [kp.image_size for kp in key_points], dtype=np.int64
+        ).reshape(-1, 2)
+        np.save(store_dir / "offsets.npy", offsets)
+        np.save(store_dir / "image_sizes.npy", image_sizes)
+        with open(store_dir / cls.NAMES_FILE, "w") as file:
+            json.dump(list(names), file)
+
+        logger.info(
+            f"Descriptor store built at {store_dir} with {len(names)} images and "
+            f"{num_keypoints} keypoints"
+        )
+        return cls(store_dir)
@@ -0,0 +1,237 @@
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+import numpy as np
+
+from svl.keypoint_pipeline.base import CombinedKeyPointAlgorithm
+from svl.keypoint_pipeline.typing import ImageKeyPoints
+
+
+class FeatureCache:
+    """On-disk cache of the keypoints extracted from the map images.
+
+    Entries are grouped in a sub-directory per fingerprint, the fingerprint being a
+    hash of the algorithm name, its configuration and the resize size of the map
+    reader. Each entry is a `.npz` file named after the image and stores the
+    keypoints, scores, descriptors and image size together with the hash of the
+    image file content. An entry is stale when the content hash or the image size
+    no longer match the image to describe.
+
+    Parameters
+    ----------
+    cache_dir : Union[str, Path]
+        directory where the cache entries are stored, created if missing
+    logger : logging.Logger, optional
+        logger to use for logging, by default None
+    """
+
+    # Configuration fields that do not change the extracted features
+    IGNORED_CONFIG_FIELDS = [
+        "device",
+        "jit",
+        "cache_dir",
+        "intra_op_num_threads",
+        "inter_op_num_threads",
+        "num_workers",
+    ]
+    HASH_CHUNK_SIZE = 1 << 20
+
+    def __init__(
+        self, cache_dir: Union[str, Path], logger: logging.Logger = None
+    ) -> None:
+        self.cache_dir = cache_dir if isinstance(cache_dir, Path) else Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        if logger is None:
+            logger = logging.getLogger(__name__)
+        self.logger = logger
+
+    @classmethod
+    def hash_file(cls, file_path: Union[str, Path]) -> str:
+        """Compute the SHA-1 hash of a file content.
+
+        Parameters
+        ----------
+        file_path : Union[str, Path]
+            path to the file
+
+        Returns
+        -------
+        str
+            hexadecimal digest of the file content
+        """
+        sha1 = hashlib.sha1()
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(cls.HASH_CHUNK_SIZE), b""):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def describe_config(
+        self,
+        algorithm: CombinedKeyPointAlgorithm,
+        resize_size: Optional[Tuple[int, ...]] = None,
+    ) -> Dict[str, Any]:
+        """Build the description of the feature extraction settings.
+
+        Parameters
+        ----------
+        algorithm : CombinedKeyPointAlgorithm
+            key point detection and description algorithm
+        resize_size : Optional[Tuple[int, ...]], optional
+            size the images are resized to before extraction, by default None
+
+        Returns
+        -------
+        Dict[str, Any]
+            JSON serializable description of the settings
+        """
+        config = getattr(algorithm, "config", None)
+        config = dataclasses.asdict(config) if dataclasses.is_dataclass(config) else {}
+        for name in self.IGNORED_CONFIG_FIELDS:
+            config.pop(name, None)
+        return {
+            "algorithm": algorithm.__class__.__name__,
+            "config": config,
+            "resize_size": list(resize_size) if resize_size is not None else None,
+        }
+
+    def fingerprint(
+        self,
+        algorithm: CombinedKeyPointAlgorithm,
+        resize_size: Optional[Tuple[int, ...]] = None,
+    ) -> str:
+        """Compute the fingerprint of the feature extraction settings.
+
+        Parameters
+        ----------
+        algorithm : CombinedKeyPointAlgorithm
+            key point detection and description algorithm
+        resize_size : Optional[Tuple[int, ...]], optional
+            size the images are resized to before extraction, by default None
+
+        Returns
+        -------
+        str
+            fingerprint of the settings
+        """
+        description = self.describe_config(algorithm, resize_size)
+        encoded = json.dumps(description, sort_keys=True).encode("utf-8")
+        return hashlib.sha1(encoded).hexdigest()[:16]
+
+    def namespace(
+        self,
+        algorithm: CombinedKeyPointAlgorithm,
+        resize_size: Optional[Tuple[int, ...]] = None,
+    ) -> Path:
+        """Get the directory holding the entries of the given settings.
+
+        The directory is created along with a `config.json` file describing the
+        settings if it does not exist yet.
+
+        Parameters
+        ----------
+        algorithm : CombinedKeyPointAlgorithm
+            key point detection and description algorithm
+        resize_size : Optional[Tuple[int, ...]], optional
+            size the images are resized to before extraction, by default None
+
+        Returns
+        -------
+        Path
+            directory of the cache entries
+        """
+        namespace = self.cache_dir / self.fingerprint(algorithm, resize_size)
+        if not namespace.exists():
+            namespace.mkdir(parents=True, exist_ok=True)
+            with open(namespace / "config.json", "w") as file:
+                json.dump(self.describe_config(algorithm, resize_size), file, indent=2)
+        return namespace
+
+    def load(
+        self,
+        namespace: Path,
+        image_name: str,
+        content_hash: str,
+        image_size: Optional[Tuple[int, int]] = None,
+    ) -> Optional[ImageKeyPoints]:
+        """Load the keypoints of an image from the cache.
+
+        Parameters
+        ----------
+        namespace : Path
+            directory of the cache entries, see `namespace`
+        image_name : str
+            name of the image
+        content_hash : str
+            hash of the image file content, see `hash_file`
+        image_size : Optional[Tuple[int, int]], optional
+            size of the image to describe, checked against the cached entry if
+            given, by default None
+
+        Returns
+        -------
+        Optional[ImageKeyPoints]
+            cached keypoints, None if the entry is missing or stale
+        """
+        entry_path = namespace / f"{image_name}.npz"
+        if not entry_path.exists():
+            return None
+        try:
+            with np.load(entry_path) as entry:
+                if str(entry["content_hash"]) != content_hash:
+                    return None
+                cached_size = tuple(int(v) for v in entry["image_size"])
+                if image_size is not None and cached_size != tuple(image_size):
+                    return None
+                return ImageKeyPoints(
+                    keypoints=entry["keypoints"],
+                    descriptors=entry["descriptors"],
+                    scores=entry["scores"] if "scores" in entry.files else None,
+                    image_size=cached_size,
+                )
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.warning(f"Corrupted cache entry {entry_path}: {e}")
+            return None
+
+    def save(
+        self,
+        namespace: Path,
+        image_name: str,
+        content_hash: str,
+        key_points: ImageKeyPoints,
+    ) -> None:
+        """Save the keypoints of an image in the cache.
+
+        The entry is written to a temporary file first and then moved in place so
+        that an interrupted run never leaves a truncated entry behind.
+
+        Parameters
+        ----------
+        namespace : Path
+            directory of the cache entries, see `namespace`
+        image_name : str
+            name of the image
+        content_hash : str
+            hash of the image file content, see `hash_file`
+        key_points : ImageKeyPoints
+            keypoints to cache
+        """
+        key_points = key_points.numpy()
+        arrays = {
+            "content_hash": np.array(content_hash),
+            "keypoints": key_points.keypoints,
+            "descriptors": key_points.descriptors,
+            "image_size": np.asarray(key_points.image_size, dtype=np.int64),
+        }
+        if key_points.scores is not None:
+            arrays["scores"] = key_points.scores
+
+        entry_path = namespace / f"{image_name}.npz"
+        tmp_path = namespace / f".{image_name}.npz.tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(tmp_path, entry_path)
@@ -0,0 +1,122 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+import numpy as np
+
+
+class ImageLRUCache:
+    """Least recently used cache of decoded images bounded by a byte budget.
+
+    When adding an image makes the cache exceed its budget, the least recently used
+    images are evicted until it fits again. The most recent image is always kept,
+    even if it is larger than the budget on its own.
+
+    Parameters
+    ----------
+    max_bytes : int
+        maximum number of bytes of image data held by the cache
+    on_evict : Callable[[Hashable, np.ndarray], None], optional
+        function called with the key and the image of every evicted entry, by
+        default None
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        on_evict: Optional[Callable[[Hashable, np.ndarray], None]] = None,
+    ) -> None:
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._images: "OrderedDict[Hashable, np.ndarray]" = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def nbytes(self) -> int:
+        """Number of bytes of image data held by the cache"""
+        return self._nbytes
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._images
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        """Get an image and mark it as the most recently used
+
+        Parameters
+        ----------
+        key : Hashable
+            key of the image
+
+        Returns
+        -------
+        Optional[np.ndarray]
+            the image, None if it is not in the cache
+        """
+        with self._lock:
+            image = self._images.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._images.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key: Hashable, image: np.ndarray) -> None:
+        """Add an image to the cache and evict the least recently used images if
+        the budget is exceeded
+
+        Parameters
+        ----------
+        key : Hashable
+            key of the image
+        image : np.ndarray
+            the image
+        """
+        with self._lock:
+            if key in self._images:
+                self._nbytes -= self._images.pop(key).nbytes
+            self._images[key] = image
+            self._nbytes += image.nbytes
+            while self._nbytes > self.max_bytes and len(self._images) > 1:
+                evicted_key, evicted_image = self._images.popitem(last=False)
+                self._nbytes -= evicted_image.nbytes
+                self.evictions += 1
+                if self.on_evict is not None:
+                    self.on_evict(evicted_key, evicted_image)
+
+    def pop(self, key: Hashable) -> Optional[np.ndarray]:
+        """Remove an image from the cache without calling `on_evict`
+
+        Parameters
+        ----------
+        key : Hashable
+            key of the image
+
+        Returns
+        -------
+        Optional[np.ndarray]
+            the removed image, None if it is not in the cache
+        """
+        with self._lock:
+            image = self._images.pop(key, None)
+            if image is not None:
+                self._nbytes -= image.nbytes
+            return image
+
+    def clear(self) -> None:
+        """Evict all the images from the cache"""
+        with self._lock:
+            while self._images:
+                key, image = self._images.popitem(last=False)
+                if self.on_evict is not None:
+                    self.on_evict(key, image)
+            self._nbytes = 0
@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import zlib
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from svl.keypoint_pipeline.typing import ImageKeyPoints
+from svl.localization.base import BaseMapReader
+
+
+class MapIndex(ABC):
+    """Abstract index over the local features of the map images, persisted next to
+    the features in the feature cache.
+
+    An index keeps the names of the indexed images and the checksums of their
+    descriptors, so a saved index can be checked against the map and synced with
+    the images that changed instead of being built again. Subclasses implement
+    the build, the sync and the arrays saved to the `.npz` file.
+
+    Parameters
+    ----------
+    names : Sequence[str]
+        names of the map images
+    checksums : Optional[np.ndarray], optional
+        checksums of the descriptors of the map images, see feature_checksums(),
+        used to find the stale images of a saved index, by default None
+    """
+
+    CACHE_NAME = "map_index"
+
+    def __init__(
+        self, names: Sequence[str], checksums: Optional[np.ndarray] = None
+    ) -> None:
+        self.names = list(names)
+        self.checksums = (
+            np.asarray(checksums, dtype=np.uint32) if checksums is not None else None
+        )
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @staticmethod
+    def feature_checksums(key_points: Sequence[ImageKeyPoints]) -> np.ndarray:
+        """CRC-32 of the descriptors of each image
+
+        Parameters
+        ----------
+        key_points : Sequence[ImageKeyPoints]
+            local features of the images
+
+        Returns
+        -------
+        np.ndarray
+            checksums, shape (len(key_points),)
+        """
+        return np.array(
+            [
+                zlib.crc32(memoryview(np.ascontiguousarray(kp.numpy().descriptors)))
+                for kp in key_points
+            ],
+            dtype=np.uint32,
+        )
+
+    @classmethod
+    @abstractmethod
+    def build(
+        cls,
+        key_points: List[ImageKeyPoints],
+        names: Sequence[str],
+        logger: Optional[logging.Logger] = None,
+        **kwargs,
+    ) -> MapIndex:
+        """Train the index on the map images and index them
+
+        Parameters
+        ----------
+        key_points : List[ImageKeyPoints]
+            local features of the map images
+        names : Sequence[str]
+            names of the map images
+        logger : Optional[logging.Logger], optional
+            logger to use for logging, by default None
+
+        Returns
+        -------
+        MapIndex
+            the index
+        """
+        pass
+
+    @classmethod
+    def from_map_reader(cls, map_reader: BaseMapReader, **kwargs) -> MapIndex:
+        """Build the index over the described images of a map reader, see `build`
+        for the keyword arguments"""
+        key_points = [map_reader.key_points(idx) for idx in range(len(map_reader))]
+        if any(kp is None for kp in key_points):
+            raise ValueError("Images are not described, call describe_db_images() first")
+        return cls.build(key_points, map_reader.image_names, **kwargs)
+
+    @abstractmethod
+    def synced(
+        self,
+        names: Sequence[str],
+        key_points: Sequence[ImageKeyPoints],
+        changed: Sequence[str] = (),
+    ) -> MapIndex:
+        """Index of a new state of the map, keeping the trained parts of this one.
+
+        The entries of the images still in the map are reused, the added images
+        and the images listed in `changed` are indexed, and the removed images
+        are dropped. This index is left unchanged.
+
+        Parameters
+        ----------
+        names : Sequence[str]
+            names of the map images after the change
+        key_points : Sequence[ImageKeyPoints]
+            local features of the map images after the change
+        changed : Sequence[str], optional
+            names of the images whose features changed, by default ()
+
+        Returns
+        -------
+        MapIndex
+            the synced index
+        """
+        pass
+
+    def _synced_checksums(
+        self,
+        names: Sequence[str],
+        key_points: Sequence[ImageKeyPoints],
+        changed: Sequence[str],
+    ) -> np.ndarray:
+        """Checksums of a new state of the map, reusing the ones of the kept
+        images, for synced()"""
+        old_indices = {name: idx for idx, name in enumerate(self.names)}
+        if self.checksums is None:
+            old_indices = {}
+        changed = set(changed)
+        checksums = np.zeros(len(names), dtype=np.uint32)
+        for idx, name in enumerate(names):
+            if name in old_indices and name not in changed:
+                checksums[idx] = self.checksums[old_indices[name]]
+            else:
+                checksums[idx] = self.feature_checksums([key_points[idx]])[0]
+        return checksums
+
+    def assign(self, other: MapIndex) -> None:
+        """Take the state of another index of the same class in place, e.g. one
+        prepared by synced(), so the shortlisters holding this index see it"""
+        if type(other) is not type(self):
+            raise TypeError(
+                f"Can not assign a {type(other).__name__} to a {type(self).__name__}"
+            )
+        vars(self).update(vars(other))
+
+    def sync(self, map_reader: BaseMapReader, changed: Sequence[str] = ()) -> None:
+        """Update the index in place after the map changed, see synced()
+
+        Parameters
+        ----------
+        map_reader : BaseMapReader
+            described map reader
+        changed : Sequence[str], optional
+            names of the images whose features changed, by default ()
+        """
+        key_points = [map_reader.key_points(idx) for idx in range(len(map_reader))]
+        self.assign(self.synced(map_reader.image_names, key_points, changed))
+
+    @abstractmethod
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        """Arrays of the index saved by `save`, besides the names and checksums"""
+        pass
+
+    @classmethod
+    @abstractmethod
+    def _from_arrays(
+        cls, data: Any, names: List[str], checksums: Optional[np.ndarray]
+    ) -> MapIndex:
+        """Create an index from the arrays of a file loaded by `load`"""
+        pass
+
+    def save(self, path: Union[str, Path]) -> None:
+        """Save the index to a `.npz` file
+
+        The file is written to a temporary file first and then moved in place, so
+        an interrupted save never leaves a truncated index behind.
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            path to the file
+        """
+        path = path if isinstance(path, Path) else Path(path)
+        arrays = self._arrays()
+        arrays["names"] = np.array(self.names)
+        if self.checksums is not None:
+            arrays["checksums"] = self.checksums
+        tmp_path = path.parent / f".{path.name}.tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> MapIndex:
+        """Load an index saved with `save`
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            path to the file
+
+        Returns
+        -------
+        MapIndex
+            the index
+        """
+        with np.load(path) as data:
+            return cls._from_arrays(
+                data,
+                names=data["names"].tolist(),
+                checksums=data["checksums"] if "checksums" in data.files else None,
+            )
+
+    @classmethod
+    def cache_path(cls, directory: Union[str, Path], **kwargs) -> Path:
+        """Path of the index built with the given settings in a directory, e.g. a
+        namespace of the feature cache, see `build` for the keyword arguments"""
+        settings = json.dumps(kwargs, sort_keys=True).encode("utf-8")
+        fingerprint = hashlib.sha1(settings).hexdigest()[:16]
+        return Path(directory) / f"{cls.CACHE_NAME}.{fingerprint}.npz"
+
+    @classmethod
+    def load_or_build(
+        cls,
+        path: Union[str, Path],
+        map_reader: BaseMapReader,
+        logger: Optional[logging.Logger] = None,
+        **kwargs,
+    ) -> MapIndex:
+        """Load the index of a map reader saved at a path and sync it with the
+        map, or build and save it if the file is missing or unreadable.
+
+        The images whose descriptors differ from the ones indexed, by their
+        checksums, are indexed again and the added and removed images are synced,
+        keeping the trained parts of the index. The path should depend on the
+        feature settings and on the build settings, see `cache_path`.
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            path to the file
+        map_reader : BaseMapReader
+            described map reader
+        logger : Optional[logging.Logger], optional
+            logger to use for logging, by default None
+
+        Returns
+        -------
+        MapIndex
+            the index, in the order of the map reader
+        """
+        logger = logger if logger is not None else logging.getLogger(__name__)
+        path = path if isinstance(path, Path) else Path(path)
+        index = None
+        if path.exists():
+            try:
+                index = cls.load(path)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Corrupted {cls.__name__} {path}: {e}")
+        if index is None or index.checksums is None:
+            index = cls.from_map_reader(map_reader, logger=logger, **kwargs)
+            index.save(path)
+            return index
+
+        key_points = [map_reader.key_points(idx) for idx in range(len(map_reader))]
+        if any(kp is None for kp in key_points):
+            raise ValueError("Images are not described, call describe_db_images() first")
+        indexed = dict(zip(index.names, index.checksums.tolist()))
+        checksums = cls.feature_checksums(key_points).tolist()
+        changed = [
+            name
+            for name, checksum in zip(map_reader.image_names, checksums)
+            if name in indexed and indexed[name] != checksum
+        ]
+        if changed or index.names != list(map_reader.image_names):
+            index = index.synced(map_reader.image_names, key_points, changed)
+            index.save(path)
+            logger.info(
+                f"{cls.__name__} loaded from {path} and synced, "
+                f"{len(changed)} images changed"
+            )
+        else:
+            logger.info(f"{cls.__name__} loaded from {path}")
+        return index
@@ -1,13 +1,18 @@
 import logging
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, TypeVar, Union
 
 import cv2
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
+from svl.keypoint_pipeline.base import CombinedKeyPointAlgorithm
 from svl.localization.base import BaseMapReader
+from svl.localization.catalog import TileCatalog
+from svl.localization.feature_cache import FeatureCache
+from svl.localization.packed_map import PackedMap
 from svl.tms.data_structures import (
     FlightZone,
     GeoSatelliteImage,
@@ -16,6 +21,120 @@ from svl.tms.data_structures import (
     TileImage,
 )
 from svl.tms.schemas import GpsCoordinate
+from svl.tms.spatial_index import TileSpatialIndex
+
+
+@dataclass
+class MapUpdate:
+    """Description of an incremental update of the map database.
+
+    Parameters
+    ----------
+    added : List[str]
+        names of the images added to the database
+    changed : List[str]
+        names of the images whose file changed
+    removed : List[str]
+        names of the images removed from the database
+    metadata_changed : List[str]
+        names of the kept images whose bounds changed in the metadata
+    """
+
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    metadata_changed: List[str] = field(default_factory=list)
+
+    def is_empty(self) -> bool:
+        return not (self.added or self.changed or self.removed or self.metadata_changed)
+
+
+class CatalogSatelliteImage(GeoSatelliteImage):
+    """Satellite image of a map reader whose corners are derived on access from
+    the bounds of its row in the catalog, which stay the only copy of the bounds.
+
+    Parameters
+    ----------
+    image_path : Path
+        path to the image file
+    catalog : TileCatalog
+        catalog holding the bounds of the image
+    index : int
+        index of the image in the catalog
+    """
+
+    def __init__(
+        self, image_path: Path, catalog: TileCatalog, index: int, **kwargs
+    ) -> None:
+        self.catalog = catalog
+        super().__init__(image_path=image_path, index=index, **kwargs)
+
+    def _bounds(self) -> Optional[List[float]]:
+        if self.catalog is None or self.index is None:
+            return None
+        bounds = self.catalog.bounds[self.index]
+        return None if np.isnan(bounds).any() else bounds.tolist()
+
+    @property
+    def top_left(self) -> Optional[GpsCoordinate]:
+        bounds = self._bounds()
+        if bounds is None:
+            return None
+        lat_min, lon_min, lat_max, lon_max = bounds
+        return GpsCoordinate(lat=lat_max, long=lon_min)
+
+    @top_left.setter
+    def top_left(self, value: Optional[GpsCoordinate]) -> None:
+        if value is not None:
+            raise AttributeError("The corners are set through the catalog bounds")
+
+    @property
+    def bottom_right(self) -> Optional[GpsCoordinate]:
+        bounds = self._bounds()
+        if bounds is None:
+            return None
+        lat_min, lon_min, lat_max, lon_max = bounds
+        return GpsCoordinate(lat=lat_min, long=lon_max)
+
+    @bottom_right.setter
+    def bottom_right(self, value: Optional[GpsCoordinate]) -> None:
+        if value is not None:
+            raise AttributeError("The corners are set through the catalog bounds")
+
+
+T = TypeVar("T")
+
+
+class LazySequence(Sequence[T]):
+    """Read-only sequence creating its elements on first access and keeping them.
+
+    Parameters
+    ----------
+    length : int
+        number of elements
+    factory : Callable[[int], T]
+        function creating the element at an index
+    """
+
+    def __init__(self, length: int, factory: Callable[[int], T]) -> None:
+        self._length = length
+        self._factory = factory
+        self._elements: Dict[int, T] = {}
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, idx: int) -> T:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self._length))]
+        if idx < 0:
+            idx += self._length
+        if idx < 0 or idx >= self._length:
+            raise IndexError(f"Index {idx} out of range")
+        if idx not in self._elements:
+            self._elements[idx] = self._factory(idx)
+        return self._elements[idx]
+
 
 class SatelliteMapReader(BaseMapReader):
     """Class for reading and processing satellite map images
@@ -37,6 +156,17 @@ class SatelliteMapReader(BaseMapReader):
         OpenCV read mode, by default cv2.IMREAD_GRAYSCALE
     metadata_method : str, optional
         Method to load metadata, by default "CSV"
+    lazy : bool, optional
+        Decode the images on first access and keep them in an LRU cache instead of
+        loading them all in setup_db(), by default False
+    cache_bytes : int, optional
+        Byte budget of the LRU cache used in lazy mode, by default 1 GiB
+    num_workers : Optional[int], optional
+        Number of threads used to decode and resize the images, by default None
+        which uses one thread per CPU
+    pyramid_levels : Optional[Sequence[Tuple[int, ...]]], optional
+        Resize sizes of the levels of the image pyramid, e.g. [(200,), (400,)], by
+        default None
     """
 
     COLUMN_NAMES = [
@@ -57,8 +187,21 @@ class SatelliteMapReader(BaseMapReader):
         resize_size: Tuple[int, int],
         cv2_read_mode: int = cv2.IMREAD_GRAYSCALE,
         metadata_method: str = "CSV",
+        lazy: bool = False,
+        cache_bytes: int = 1 << 30,
+        num_workers: Optional[int] = None,
+        pyramid_levels: Optional[Sequence[Tuple[int, ...]]] = None,
     ) -> None:
-        super().__init__(db_path, logger, resize_size, cv2_read_mode)
+        super().__init__(
+            db_path,
+            logger,
+            resize_size,
+            cv2_read_mode,
+            lazy,
+            cache_bytes,
+            num_workers,
+            pyramid_levels,
+        )
         if metadata_method not in self.METADATA_METHOD:
             raise ValueError(f"Invalid metadata method {metadata_method}")
 
@@ -68,27 +211,44 @@ class SatelliteMapReader(BaseMapReader):
         self.load_images()
         self._load_csv_metadata()
         self.set_metadata_for_all_images()
+        self.build_spatial_index()
 
     def initialize_db(self) -> None:
         """Initialize the image database."""
         super()._initialize_db()
         self._geo_metadata: pd.DataFrame = None
+        self._spatial_index: Optional[TileSpatialIndex] = None
+        self._file_signatures: Dict[str, Tuple[int, int]] = {}
+        self._csv_signature: Optional[Tuple[int, int]] = None
+        self._packed_map: Optional[PackedMap] = None
+
+    def _scan_image_files(self) -> Dict[str, Path]:
+        """List the image files of the directory by image name, in sorted order."""
+        return {
+            image_path.stem: image_path
+            for image_path in sorted(self.db_path.glob("*"))
+            if image_path.suffix in self.IMAGE_EXTENSIONS
+        }
+
+    @staticmethod
+    def _file_signature(image_path: Path) -> Tuple[int, int]:
+        """Modification time and size of a file, used to detect changed images."""
+        stat = image_path.stat()
+        return stat.st_mtime_ns, stat.st_size
 
     def _build_image_db(self) -> None:
         """Build the image database from the images in the directory."""
         self.logger.info(f"Building image database from {self.db_path}: ")
-        img_idx = 0
-        for image_path in tqdm(sorted(self.db_path.glob("*"))):
-            if image_path.suffix in self.IMAGE_EXTENSIONS:
-                self._image_db.append(
-                    GeoSatelliteImage(
-                        image_path=image_path,
-                        index=img_idx,
-                    )
+        for image_name, image_path in tqdm(self._scan_image_files().items()):
+            self._add_image(
+                CatalogSatelliteImage(
+                    image_path=image_path,
+                    catalog=self._catalog,
+                    index=len(self._image_db),
                 )
-                img_idx += 1
+            )
+            self._file_signatures[image_name] = self._file_signature(image_path)
 
-        self._num_images = img_idx
         self.logger.info(
             f"Image database built successfully with {self._num_images} images"
         )
@@ -102,42 +262,311 @@ class SatelliteMapReader(BaseMapReader):
             raise ValueError(f"Multiple CSV files found in {self.db_path}")
         csv_file = csv_files[0]
         self.logger.info(f"Loading metadata from {csv_file}")
+        self._csv_signature = self._file_signature(csv_file)
         df = pd.read_csv(csv_file)
         if not all(col in df.columns for col in self.COLUMN_NAMES):
             raise ValueError(f"Invalid metadata columns in {csv_file}")
-        df["Filename"] = df["Filename"].apply(lambda x: x.split(".")[0])
+        df["Filename"] = df["Filename"].str.split(".", n=1).str[0]
         self._geo_metadata = df
         self.logger.info("Metadata loaded successfully")
 
     def set_image_metadata(self, image_name: str, metadata: Dict[str, float]) -> None:
         """Set metadata for a specific image."""
-        satellite_image: GeoSatelliteImage = self[image_name]
-        satellite_image.top_left = GpsCoordinate(
-            lat=metadata["Top_left_lat"], long=metadata["Top_left_lon"]
-        )
-        satellite_image.bottom_right = GpsCoordinate(
-            lat=metadata["Bottom_right_lat"], long=metadata["Bottom_right_long"]
-        )
+        idx = self._catalog.index_of(image_name)
+        lats = (metadata["Top_left_lat"], metadata["Bottom_right_lat"])
+        longs = (metadata["Top_left_lon"], metadata["Bottom_right_long"])
+        self._catalog.bounds[idx] = [min(lats), min(longs), max(lats), max(longs)]
 
     def set_metadata_for_all_images(self) -> None:
-        """Set metadata for all images in the database."""
+        """Set metadata for all images in the database.
+
+        The metadata is joined to the catalog in a single vectorized operation. The
+        bounds are only stored in the catalog, the corners of the images are
+        derived from them on access, see CatalogSatelliteImage.
+        """
         self.logger.info("Setting metadata for all images")
 
-        for img_info in tqdm(self._image_db):
-            img_metadata = self._geo_metadata[
-                self._geo_metadata["Filename"] == img_info.name
-            ]
-            if len(img_metadata) == 1:
-                img_metadata = img_metadata.to_dict(orient="records")[0]
-                del img_metadata["Filename"]
-                self.set_image_metadata(img_info.name, img_metadata)
-            elif len(img_metadata) > 1:
-                self.logger.warning(
-                    f"Multiple metadata entries found for image {img_info.name}"
-                )
-            else:
-                self.logger.warning(f"Metadata not found for image {img_info.name}")
+        missing, multiple = self._catalog.join_bounds(
+            self._geo_metadata, "Filename", self.COLUMN_NAMES[1:]
+        )
+        for image_name in multiple:
+            self.logger.warning(f"Multiple metadata entries found for image {image_name}")
+        for image_name in missing:
+            self.logger.warning(f"Metadata not found for image {image_name}")
+
+    @property
+    def bounds(self) -> np.ndarray:
+        """Bounds of the images (lat_min, lon_min, lat_max, lon_max), shape (N, 4)"""
+        return self._catalog.bounds
 
     @property
     def goe_metadata(self) -> pd.DataFrame:
         return self._geo_metadata
+
+    def build_spatial_index(self) -> TileSpatialIndex:
+        """Build the spatial index over the footprints of the images.
+
+        Returns
+        -------
+        TileSpatialIndex
+            spatial index, its queries return indices of images in the database
+        """
+        self._spatial_index = TileSpatialIndex(self._catalog.bounds)
+        self.logger.info(
+            f"Spatial index built over {len(self._spatial_index)} image footprints"
+        )
+        return self._spatial_index
+
+    @property
+    def spatial_index(self) -> Optional[TileSpatialIndex]:
+        return self._spatial_index
+
+    def load_packed_map(self, packed_map: Union[str, Path, PackedMap]) -> PackedMap:
+        """Setup the database from a packed map instead of the image directory.
+
+        This replaces setup_db(), resize_db_images() and describe_db_images(). The
+        catalog is backed by the header and the memory-mapped bounds, and the items
+        are only created when they are accessed, with their images and keypoints
+        as views on the file. Opening the map does not read or decode the images,
+        and the pages are only read from disk when an image is accessed. The database is read-only,
+        update_db() is not supported on a packed map.
+
+        Parameters
+        ----------
+        packed_map : Union[str, Path, PackedMap]
+            packed map or path to the packed map file, see compile_map.py
+
+        Returns
+        -------
+        PackedMap
+            the opened packed map
+        """
+        if not isinstance(packed_map, PackedMap):
+            packed_map = PackedMap(packed_map)
+        self.initialize_db()
+        # The mapped file plays the role of the image cache
+        self.lazy = False
+        if packed_map.resize_size is not None:
+            self.resize_size = tuple(packed_map.resize_size)
+
+        # The catalog and the items are backed by the header and the mapped
+        # sections, the items are only created when they are accessed
+        files = packed_map.header["files"]
+        self._catalog = TileCatalog.from_columns(
+            packed_map.names,
+            LazySequence(len(files), lambda idx: self.db_path / files[idx]),
+            packed_map.bounds,
+        )
+
+        def create_item(idx: int) -> CatalogSatelliteImage:
+            img_item = CatalogSatelliteImage(
+                image_path=self._catalog.paths[idx],
+                catalog=self._catalog,
+                index=idx,
+                image=packed_map.image(idx),
+                key_points=packed_map.key_points(idx),
+            )
+            img_item.size = tuple(int(v) for v in packed_map.image_shapes[idx])
+            return img_item
+
+        self._image_db = LazySequence(len(packed_map), create_item)
+        self._num_images = len(packed_map)
+
+        self._packed_map = packed_map
+        self._is_loaded = True
+        self._is_resized = packed_map.resize_size is not None
+        self._is_described = True
+        self.logger.info(
+            f"Packed map {packed_map.path} opened with {len(packed_map)} images"
+        )
+        self.build_spatial_index()
+        return packed_map
+
+    @property
+    def packed_map(self) -> Optional[PackedMap]:
+        return self._packed_map
+
+    def update_db(
+        self,
+        algorithm: Optional[CombinedKeyPointAlgorithm] = None,
+        feature_cache: Optional[FeatureCache] = None,
+        batch_size: int = 4,
+    ) -> MapUpdate:
+        """Update the database with the changes of the directory and of the CSV file.
+
+        The image files are compared to the database by name and by modification
+        time and size, and the CSV file is joined again. Only the added and changed
+        images are loaded and described. The new database and its spatial index are
+        prepared aside and swapped in while holding the lock, so queries holding
+        the lock see either the old or the new database. The new images are
+        described in batches through the feature cache, the pyramid levels with
+        the algorithms they were described with. The update preparers run before
+        the lock is taken, and their prepared state is swapped in with the
+        database. The descriptor store is detached, and the update listeners are
+        called.
+
+        Parameters
+        ----------
+        algorithm : Optional[CombinedKeyPointAlgorithm], optional
+            Algorithm describing the added and changed images, required if the
+            database is described, by default None
+        feature_cache : Optional[FeatureCache], optional
+            On-disk cache of the extracted features, by default None
+        batch_size : int, optional
+            Number of images described in one call to the algorithm, by default 4
+
+        Returns
+        -------
+        MapUpdate
+            Description of the update
+        """
+        if not self._is_loaded:
+            raise ValueError("Images are not loaded, call setup_db() first")
+        if self._packed_map is not None:
+            raise ValueError("A packed map is read-only, compile it again instead")
+        image_files = self._scan_image_files()
+        signatures = {
+            image_name: self._file_signature(image_path)
+            for image_name, image_path in image_files.items()
+        }
+        update = MapUpdate(
+            added=[name for name in image_files if name not in self._catalog],
+            changed=[
+                name
+                for name in image_files
+                if name in self._catalog
+                and signatures[name] != self._file_signatures.get(name)
+            ],
+            removed=[name for name in self.image_names if name not in image_files],
+        )
+        csv_files = list(self.db_path.glob("*.csv"))
+        csv_signature = self._file_signature(csv_files[0]) if csv_files else None
+        if update.is_empty() and csv_signature == self._csv_signature:
+            return update
+        if self._is_described and (update.added or update.changed) and not algorithm:
+            raise ValueError("An algorithm is required to describe the new images")
+
+        # Build the new database aside, reusing the unchanged image items
+        fresh_names = set(update.added) | set(update.changed)
+        catalog = TileCatalog()
+        image_db: List[CatalogSatelliteImage] = []
+        reindexed: List[Tuple[CatalogSatelliteImage, int]] = []
+        for image_name, image_path in image_files.items():
+            idx = catalog.append(image_name, image_path)
+            if image_name in fresh_names:
+                img_item = CatalogSatelliteImage(image_path, catalog, idx)
+            else:
+                # Moved to the new catalog when it is swapped in
+                img_item = self._image_db[self._catalog.index_of(image_name)]
+                reindexed.append((img_item, idx))
+            image_db.append(img_item)
+
+        self._load_csv_metadata()
+        missing, multiple = catalog.join_bounds(
+            self._geo_metadata, "Filename", self.COLUMN_NAMES[1:]
+        )
+        for image_name in catalog.names:
+            if image_name in fresh_names or image_name not in self._catalog:
+                continue
+            old_bounds = self._catalog.bounds[self._catalog.index_of(image_name)]
+            new_bounds = catalog.bounds[catalog.index_of(image_name)]
+            if not np.array_equal(old_bounds, new_bounds, equal_nan=True):
+                update.metadata_changed.append(image_name)
+
+        if update.is_empty():
+            return update
+        for image_name in multiple:
+            self.logger.warning(f"Multiple metadata entries found for image {image_name}")
+        for image_name in missing:
+            self.logger.warning(f"Metadata not found for image {image_name}")
+        self.logger.info(
+            f"Updating the database: {len(update.added)} added, "
+            f"{len(update.changed)} changed, {len(update.removed)} removed, "
+            f"{len(update.metadata_changed)} with new metadata"
+        )
+
+        # Load and describe the fresh images outside of the lock, through the
+        # feature cache like describe_db_images() and describe_pyramid()
+        fresh_items = [image_db[catalog.index_of(name)] for name in sorted(fresh_names)]
+        if not self.lazy:
+            for img_item in tqdm(fresh_items, desc="Loading new images"):
+                img_item.image = self._ingest_image(img_item, resize=self._is_resized)
+                img_item.size = img_item.image.shape[:2]
+
+        def read_image(img_item: CatalogSatelliteImage) -> np.ndarray:
+            if img_item.image is not None:
+                return img_item.image
+            return self._ingest_image(img_item, resize=self._is_resized)
+
+        if algorithm is not None:
+            namespace = (
+                feature_cache.namespace(algorithm, self.resize_size)
+                if feature_cache is not None
+                else None
+            )
+            key_points, _ = self._describe_in_batches(
+                fresh_items,
+                read_image,
+                algorithm,
+                feature_cache,
+                namespace,
+                batch_size=batch_size,
+                desc="Describing new images",
+            )
+            for img_item, kp in zip(fresh_items, key_points):
+                img_item.key_points = kp
+        pyramid = {
+            level: dict(zip(self.image_names, key_points))
+            for level, key_points in self._pyramid.items()
+        }
+        for level, level_algorithm in self._pyramid_algorithms.items():
+            namespace = (
+                feature_cache.namespace(level_algorithm, level)
+                if feature_cache is not None
+                else None
+            )
+            key_points, _ = self._describe_in_batches(
+                fresh_items,
+                read_image,
+                level_algorithm,
+                feature_cache,
+                namespace,
+                level,
+                batch_size,
+                f"Describing pyramid level {level}",
+            )
+            pyramid[level].update(
+                (img_item.name, kp) for img_item, kp in zip(fresh_items, key_points)
+            )
+
+        # The state derived from the features is prepared outside of the lock too
+        key_points = [img_item.key_points for img_item in image_db]
+        apply_updates = [
+            preparer(update, catalog.names, key_points)
+            for preparer in self._update_preparers
+        ]
+
+        spatial_index = TileSpatialIndex(catalog.bounds)
+        with self._lock:
+            self._image_cache.clear()
+            self._image_db, self._catalog = image_db, catalog
+            self._num_images = len(image_db)
+            self._file_signatures = signatures
+            for img_item, idx in reindexed:
+                img_item.catalog, img_item.index = catalog, idx
+            self._pyramid = {
+                level: [key_points[name] for name in catalog.names]
+                for level, key_points in pyramid.items()
+            }
+            self._spatial_index = spatial_index
+            if self._descriptor_store is not None:
+                self.logger.info("Descriptor store detached, it needs to be rebuilt")
+                self._descriptor_store = None
+            self._is_described = self._is_described and (
+                algorithm is not None or not fresh_names
+            )
+            for apply_update in apply_updates:
+                apply_update()
+            for listener in self._update_listeners:
+                listener(update)
+        return update
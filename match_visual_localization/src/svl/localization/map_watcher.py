@@ -0,0 +1,95 @@
+import logging
+import threading
+from typing import Callable, Optional
+
+from svl.keypoint_pipeline.base import CombinedKeyPointAlgorithm
+from svl.localization.feature_cache import FeatureCache
+from svl.localization.map_reader import MapUpdate, SatelliteMapReader
+
+
+class MapWatcher:
+    """Watch the directory of a map and apply its changes incrementally.
+
+    A background thread polls the directory and the CSV file every `interval`
+    seconds and calls `SatelliteMapReader.update_db`. Polling keeps the watcher
+    free of platform specific file system notification APIs, and the scan only
+    stats the files, so it is cheap compared to the update itself.
+
+    Parameters
+    ----------
+    map_reader : SatelliteMapReader
+        map reader to keep up to date, setup_db() must have been called
+    algorithm : Optional[CombinedKeyPointAlgorithm], optional
+        algorithm describing the new images, by default None
+    feature_cache : Optional[FeatureCache], optional
+        on-disk cache of the extracted features, by default None
+    interval : float, optional
+        polling interval in seconds, by default 5.0
+    on_update : Optional[Callable[[MapUpdate], None]], optional
+        function called after each non-empty update, by default None
+    logger : logging.Logger, optional
+        logger to use for logging, by default None
+    """
+
+    def __init__(
+        self,
+        map_reader: SatelliteMapReader,
+        algorithm: Optional[CombinedKeyPointAlgorithm] = None,
+        feature_cache: Optional[FeatureCache] = None,
+        interval: float = 5.0,
+        on_update: Optional[Callable[[MapUpdate], None]] = None,
+        logger: logging.Logger = None,
+    ) -> None:
+        self.map_reader = map_reader
+        self.algorithm = algorithm
+        self.feature_cache = feature_cache
+        self.interval = interval
+        self.on_update = on_update
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def poll(self) -> MapUpdate:
+        """Apply the pending changes of the map once
+
+        Returns
+        -------
+        MapUpdate
+            description of the update
+        """
+        update = self.map_reader.update_db(self.algorithm, self.feature_cache)
+        if not update.is_empty() and self.on_update is not None:
+            self.on_update(update)
+        return update
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                # A file may be caught while it is being written, retry later
+                self.logger.error(f"Map update failed: {e}")
+
+    def start(self) -> None:
+        """Start watching the map in a background thread"""
+        if self.is_running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="MapWatcher", daemon=True
+        )
+        self._thread.start()
+        self.logger.info(
+            f"Watching {self.map_reader.db_path} every {self.interval} seconds"
+        )
+
+    def stop(self) -> None:
+        """Stop watching the map and wait for the background thread"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,323 @@
+from __future__ import annotations
+
+import json
+import logging
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+import numpy as np
+
+from svl.keypoint_pipeline.typing import ImageKeyPoints
+from svl.localization.base import BaseMapReader
+from svl.localization.descriptor_store import descriptor_dtype
+
+
+class PackedMap:
+    """Compiled map stored in a single binary file opened with mmap.
+
+    The file holds the pre-resized grayscale images, the geographic bounds, the
+    keypoints and descriptors of all the map images, and the offset tables to find
+    the data of each image. Opening a packed map only parses its header, every
+    array is a view on the memory-mapped file.
+
+    File layout::
+
+        magic        8 bytes, b"SVLMAP01"
+        header_size  uint64, little endian
+        header       JSON: names, file names, resize size, feature settings and, for each
+                     section, its offset, dtype, shape and CRC-32
+        sections     arrays aligned on 64 bytes:
+                     images         (sum of H * W,) uint8, images one after the other
+                     image_offsets  (T + 1,) int64, byte offsets in images
+                     image_shapes   (T, 2) int64, (H, W) of the images
+                     bounds         (T, 4) float64, (lat_min, lon_min, lat_max, lon_max)
+                     keypoints      (N, 2) float32
+                     scores         (N,) float32
+                     descriptors    (N, D) descriptor dtype, e.g. float32 or packed uint8
+                     offsets        (T + 1,) int64, rows of the keypoints of each image
+                     image_sizes    (T, 2) int64, image size of the keypoints
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+        path to the packed map file
+    """
+
+    MAGIC = b"SVLMAP01"
+    ALIGNMENT = 64
+    SECTIONS = [
+        "images",
+        "image_offsets",
+        "image_shapes",
+        "bounds",
+        "keypoints",
+        "scores",
+        "descriptors",
+        "offsets",
+        "image_sizes",
+    ]
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = path if isinstance(path, Path) else Path(path)
+        if not self.path.exists():
+            raise FileNotFoundError(f"Packed map not found at {self.path}")
+        with open(self.path, "rb") as file:
+            if file.read(len(self.MAGIC)) != self.MAGIC:
+                raise ValueError(f"{self.path} is not a packed map")
+            header_size = int.from_bytes(file.read(8), "little")
+            self.header: Dict[str, Any] = json.loads(file.read(header_size))
+
+        self._buffer = np.memmap(self.path, dtype=np.uint8, mode="r")
+        for name in self.SECTIONS:
+            section = self.header["sections"][name]
+            setattr(
+                self,
+                name,
+                np.ndarray(
+                    tuple(section["shape"]),
+                    dtype=np.dtype(section["dtype"]),
+                    buffer=self._buffer,
+                    offset=section["offset"],
+                ),
+            )
+        self.names: List[str] = self.header["names"]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def resize_size(self) -> Optional[List[int]]:
+        return self.header["resize_size"]
+
+    def image(self, idx: int) -> np.ndarray:
+        """Get an image as a view on the file
+
+        Parameters
+        ----------
+        idx : int
+            index of the image
+
+        Returns
+        -------
+        np.ndarray
+            grayscale image, shape (H, W)
+        """
+        start, end = self.image_offsets[idx], self.image_offsets[idx + 1]
+        return self.images[start:end].reshape(tuple(self.image_shapes[idx]))
+
+    def key_points(self, idx: int) -> ImageKeyPoints:
+        """Get the keypoints of an image as views on the file
+
+        Parameters
+        ----------
+        idx : int
+            index of the image
+
+        Returns
+        -------
+        ImageKeyPoints
+            keypoints of the image
+        """
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return ImageKeyPoints(
+            keypoints=self.keypoints[start:end],
+            descriptors=self.descriptors[start:end],
+            scores=self.scores[start:end],
+            image_size=tuple(int(v) for v in self.image_sizes[idx]),
+        )
+
+    def verify(self) -> List[str]:
+        """Check the integrity and the consistency of the packed map
+
+        Returns
+        -------
+        List[str]
+            description of the problems found, empty if the map is valid
+        """
+        errors = []
+        for name in self.SECTIONS:
+            crc = zlib.crc32(memoryview(np.ascontiguousarray(getattr(self, name))))
+            if crc != self.header["sections"][name]["crc32"]:
+                errors.append(f"Checksum mismatch in section {name}")
+
+        num_images = len(self)
+        for name in ["image_offsets", "offsets"]:
+            offsets = getattr(self, name)
+            if len(offsets) != num_images + 1 or offsets[0] != 0:
+                errors.append(f"Invalid offset table {name}")
+            elif np.any(np.diff(offsets) < 0):
+                errors.append(f"Offset table {name} is not sorted")
+        if self.image_offsets[-1] != len(self.images):
+            errors.append("Image offsets do not cover the image section")
+        if np.any(np.prod(self.image_shapes, axis=1) != np.diff(self.image_offsets)):
+            errors.append("Image shapes do not match the image offsets")
+        if self.offsets[-1] != len(self.keypoints):
+            errors.append("Keypoint offsets do not cover the keypoint section")
+        if not np.array_equal(self.image_sizes, self.image_shapes):
+            errors.append("Keypoints were not extracted on the packed images")
+        if not (len(self.keypoints) == len(self.scores) == len(self.descriptors)):
+            errors.append("Keypoints, scores and descriptors differ in length")
+        if np.isnan(self.bounds).any():
+            missing = np.flatnonzero(np.isnan(self.bounds).any(axis=1))
+            errors.append(
+                f"Bounds missing for images {[self.names[idx] for idx in missing]}"
+            )
+        return errors
+
+    @classmethod
+    def compile(
+        cls,
+        path: Union[str, Path],
+        map_reader: BaseMapReader,
+        features: Optional[Dict[str, Any]] = None,
+        logger: logging.Logger = None,
+    ) -> PackedMap:
+        """Compile the images, bounds and features of a map reader into a file
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            path to the packed map file, overwritten if it exists
+        map_reader : BaseMapReader
+            loaded and described map reader with grayscale images
+        features : Optional[Dict[str, Any]], optional
+            description of the feature extraction settings stored in the header,
+            see FeatureCache.describe_config, by default None
+        logger : logging.Logger, optional
+            logger to use for logging, by default None
+
+        Returns
+        -------
+        PackedMap
+            the packed map opened from the file
+        """
+        logger = logger if logger is not None else logging.getLogger(__name__)
+        path = path if isinstance(path, Path) else Path(path)
+        key_points = [map_reader.key_points(idx) for idx in range(len(map_reader))]
+        if any(kp is None for kp in key_points):
+            raise ValueError("Images are not described, call describe_db_images() first")
+        key_points = [kp.numpy() for kp in key_points]
+
+        # The keypoints are extracted on the loaded images, so their image sizes
+        # give the shapes of the images without decoding them
+        image_shapes = np.array(
+            [kp.image_size for kp in key_points], dtype=np.int64
+        ).reshape(-1, 2)
+        image_offsets = np.zeros(len(key_points) + 1, dtype=np.int64)
+        np.cumsum(np.prod(image_shapes, axis=1), out=image_offsets[1:])
+
+        offsets = np.zeros(len(key_points) + 1, dtype=np.int64)
+        np.cumsum([len(kp) for kp in key_points], out=offsets[1:])
+        descriptor_dim = key_points[0].descriptors.shape[1] if key_points else 0
+
+        def images() -> Iterator[np.ndarray]:
+            # Decoded one at a time in lazy mode, without going through the cache
+            for idx, shape in enumerate(image_shapes):
+                image = map_reader.get_image(idx)
+                if image is None or image.ndim != 2:
+                    raise ValueError(
+                        f"Image {map_reader.image_names[idx]} is not a loaded "
+                        "grayscale image"
+                    )
+                if image.shape != tuple(shape):
+                    raise ValueError(
+                        f"Image {map_reader.image_names[idx]} of shape {image.shape} "
+                        f"was described at {tuple(shape)}"
+                    )
+                yield image
+
+        # The images and the features are streamed to the file, the small arrays
+        # are written from memory
+        arrays = {
+            "image_offsets": image_offsets,
+            "image_shapes": image_shapes,
+            "bounds": map_reader.catalog.bounds.astype(np.float64),
+            "offsets": offsets,
+            "image_sizes": image_shapes,
+        }
+        streamed = {
+            "images": (
+                np.uint8,
+                (int(image_offsets[-1]),),
+                images(),
+            ),
+            "keypoints": (
+                np.float32,
+                (int(offsets[-1]), 2),
+                [kp.keypoints for kp in key_points],
+            ),
+            "scores": (
+                np.float32,
+                (int(offsets[-1]),),
+                [
+                    kp.scores if kp.scores is not None else np.ones(len(kp))
+                    for kp in key_points
+                ],
+            ),
+            "descriptors": (
+                descriptor_dtype(key_points),
+                (int(offsets[-1]), descriptor_dim),
+                [kp.descriptors for kp in key_points],
+            ),
+        }
+
+        sections = {}
+        position = 0
+        for name in cls.SECTIONS:
+            if name in arrays:
+                dtype, shape = arrays[name].dtype, arrays[name].shape
+            else:
+                dtype, shape, _ = streamed[name]
+                dtype = np.dtype(dtype)
+            position = -(-position // cls.ALIGNMENT) * cls.ALIGNMENT
+            sections[name] = {
+                "offset": position,
+                "dtype": dtype.str,
+                "shape": list(shape),
+            }
+            position += int(np.prod(shape)) * dtype.itemsize
+
+        # Section offsets are relative to the end of the header until it is sized
+        header = {
+            "version": 1,
+            "names": list(map_reader.image_names),
+            "files": [path.name for path in map_reader.catalog.paths],
+            "resize_size": (
+                list(map_reader.resize_size) if map_reader.resize_size else None
+            ),
+            "features": features,
+            "sections": sections,
+        }
+        header_size = len(json.dumps(header)) + 32 * len(sections) + 256
+        data_start = -(-(len(cls.MAGIC) + 8 + header_size) // cls.ALIGNMENT)
+        data_start *= cls.ALIGNMENT
+
+        with open(path, "wb") as file:
+            for name in cls.SECTIONS:
+                section = sections[name]
+                section["offset"] += data_start
+                file.seek(section["offset"])
+                crc = 0
+                chunks = [arrays[name]] if name in arrays else streamed[name][2]
+                dtype = np.dtype(section["dtype"])
+                for chunk in chunks:
+                    chunk = np.ascontiguousarray(chunk, dtype=dtype)
+                    crc = zlib.crc32(memoryview(chunk), crc)
+                    file.write(memoryview(chunk))
+                section["crc32"] = crc
+            file.truncate(data_start + position)
+
+            encoded = json.dumps(header).encode("utf-8")
+            if len(cls.MAGIC) + 8 + len(encoded) > data_start:
+                raise RuntimeError("Packed map header larger than its reserved space")
+            file.seek(0)
+            file.write(cls.MAGIC)
+            file.write(len(encoded).to_bytes(8, "little"))
+            file.write(encoded)
+
+        logger.info(
+            f"Packed map compiled at {path} with {len(key_points)} images and "
+            f"{int(offsets[-1])} keypoints ({(data_start + position) / 2**20:.1f} MiB)"
+        )
+        return cls(path)
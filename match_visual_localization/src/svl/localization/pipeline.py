@@ -1,19 +1,19 @@
 import time
 import logging
 from pathlib import Path
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, Optional, Union
 
 import matplotlib.cm as cm
 import numpy as np
 from tqdm import tqdm
 
 from superglue_lib.models.utils import make_matching_plot_fast
-from svl.keypoint_pipeline.base import CombinedKeyPointAlgorithm
-from svl.keypoint_pipeline.matcher import KeyPointMatcher
+from svl.keypoint_pipeline.base import CombinedKeyPointAlgorithm, KeyPointMatcher
 from svl.localization.base import BasePipeline, PipelineConfig
 from svl.localization.drone_streamer import DroneImageStreamer
 from svl.localization.map_reader import SatelliteMapReader
 from svl.localization.preprocessing import QueryProcessor
+from svl.localization.shortlist import TileShortlister
 from svl.tms.data_structures import DroneImage, GeoSatelliteImage
 from svl.tms.geo import haversine_distance
 from svl.tms.schemas import GpsCoordinate
@@ -48,6 +48,9 @@ class Pipeline(BasePipeline):
         the query processor to preprocess the query image (resize, warp, etc.)
     logger : logging.Logger
         the logger to use for logging
+    shortlister : Optional[TileShortlister]
+        selects the satellite images to match against each drone image, all the
+        satellite images are matched if None
     """
 
     def __init__(
@@ -59,6 +62,7 @@ class Pipeline(BasePipeline):
         config: PipelineConfig,
         query_processor: QueryProcessor,
         logger: logging.Logger,
+        shortlister: Optional[TileShortlister] = None,
     ) -> None:
         super().__init__(
             map_reader=map_reader,
@@ -69,6 +73,66 @@ class Pipeline(BasePipeline):
             query_processor=query_processor,
             logger=logger,
         )
+        self.shortlister = shortlister
+        # Number of queries with a known ground truth image, and how many of them
+        # had it among the candidates
+        self.shortlist_queries = 0
+        self.shortlist_hits = 0
+
+    def ground_truth_images(self, drone_image: DroneImage) -> Optional[np.ndarray]:
+        """Find the satellite images containing the ground truth position of a
+        drone image.
+
+        Parameters
+        ----------
+        drone_image : DroneImage
+            the drone image
+
+        Returns
+        -------
+        Optional[np.ndarray]
+            the indices of the satellite images, None if the position or the
+            spatial index of the map is not available
+        """
+        spatial_index = self.map_reader.spatial_index
+        geo_point = getattr(drone_image, "geo_point", None)
+        if spatial_index is None or geo_point is None:
+            return None
+        return spatial_index.query_point(geo_point.latitude, geo_point.longitude)
+
+    def select_candidates(self, drone_image: DroneImage) -> np.ndarray:
+        """Select the satellite images to match against a drone image.
+
+        Parameters
+        ----------
+        drone_image : DroneImage
+            the drone image, with its keypoints
+
+        Returns
+        -------
+        np.ndarray
+            the indices of the satellite images to match
+        """
+        if self.shortlister is None:
+            return np.arange(len(self.map_reader))
+        start_time = time.time()
+        candidates = self.shortlister.shortlist(drone_image)
+        elapsed_time = time.time() - start_time
+        self.logger.info(
+            f"Shortlisted {len(candidates)} of {len(self.map_reader)} images "
+            f"in {elapsed_time} seconds"
+        )
+
+        ground_truth = self.ground_truth_images(drone_image)
+        if ground_truth is not None and len(ground_truth) > 0:
+            hit = bool(np.isin(ground_truth, candidates).any())
+            self.shortlist_queries += 1
+            self.shortlist_hits += hit
+            self.logger.info(
+                f"Shortlist {'contains' if hit else 'misses'} the ground truth "
+                f"image, recall {self.shortlist_hits}/{self.shortlist_queries}"
+            )
+        return candidates
 
     def run_on_image(
         self, drone_image: DroneImage, output_path: Union[str, Path] = None
@@ -121,27 +185,36 @@ class Pipeline(BasePipeline):
         drone_image.key_points = self.detector.detect_and_describe_keypoints(
             drone_image.image
         )
+        self.matcher.precompute(drone_image.key_points)
         gt_coordinates = GpsCoordinate(
             lat=drone_image.geo_point.latitude,
             long=drone_image.geo_point.longitude,
         )
 
-        for idx in tqdm(
-            range(len(self.map_reader)),
-            desc="Matching images",
-            total=len(self.map_reader),
+        candidates = self.select_candidates(drone_image)
+
+        # Match the keypoints against all the candidates in batches
+        start_time = time.time()
+        candidate_matches = self.matcher.match_many(
+            drone_image.key_points,
+            [self.map_reader.key_points(int(idx)) for idx in candidates],
+        )
+        self.logger.info(
+            f"Matched {len(candidates)} images in {time.time() - start_time} seconds"
+        )
+
+        verification_start_time = time.time()
+        for idx, (matches, confidence) in tqdm(
+            zip(candidates, candidate_matches),
+            desc="Verifying matches",
+            total=len(candidates),
         ):
-        # desc = "Matching images"
-        # total = len(self.map_reader)
-        # for idx in range(total):
-        #     start_time = time.time()
             start_time = time.time()
-            satellite_image: GeoSatelliteImage = self.map_reader[idx]
-
-            # Match the keypoints
-            matches, confidence = self.matcher.match_keypoints(
-                drone_image.key_points, satellite_image.key_points
+            # The image is only decoded when the candidate is the best so far
+            satellite_image: GeoSatelliteImage = self.map_reader.get_item(
+                int(idx), decode=False
             )
+
             valid = matches > -1
             mkpts0 = drone_image.key_points.keypoints[valid]
             mkpts1 = satellite_image.key_points.keypoints[matches[valid]]
@@ -164,6 +237,7 @@ class Pipeline(BasePipeline):
                     continue
 
                 max_macthes = len(mkpts1)
+                satellite_image = self.map_reader[int(idx)]
                 center = self.normalize_center(
                     denormalized_center, satellite_image.image.shape
                 )
@@ -198,6 +272,11 @@ class Pipeline(BasePipeline):
             elapsed_time = end_time - start_time
             self.logger.info(f"Index: {idx} Processing time {elapsed_time} seconds")
 
+        self.logger.info(
+            f"Verified {len(candidates)} images in "
+            f"{time.time() - verification_start_time} seconds"
+        )
+
         if best_dst is not None:
             predicted_coordinates = self.compute_geo_pose(matched_image, center)
             
@@ -263,7 +342,9 @@ class Pipeline(BasePipeline):
         for drone_image in self.drone_streamer:
             query = self.query_processor(drone_image)
             # query = None
-            pred = self.run_on_image(query, output_path)
+            # Keep the map consistent while matching, updates wait for the lock
+            with self.map_reader.lock:
+                pred = self.run_on_image(query, output_path)
             pred["matched_image"] = (
                 pred["matched_image"].name if pred["matched_image"] else None
             )
@@ -276,5 +357,10 @@ class Pipeline(BasePipeline):
         self.logger.info(
             f"Number of matches: {num_matches} among {len(self.drone_streamer)} images"
         )
+        if self.shortlist_queries > 0:
+            self.logger.info(
+                f"Shortlist recall: {self.shortlist_hits / self.shortlist_queries:.3f} "
+                f"({self.shortlist_hits}/{self.shortlist_queries} queries)"
+            )
         
         return preds
\ No newline at end of file
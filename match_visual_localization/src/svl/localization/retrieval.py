@@ -0,0 +1,390 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from svl.keypoint_pipeline.typing import ImageKeyPoints
+from svl.localization.map_index import MapIndex
+from svl.localization.shortlist import TileShortlister
+from svl.tms.data_structures import DroneImage
+
+
+def kmeans(
+    data: np.ndarray,
+    num_clusters: int,
+    num_iters: int = 20,
+    max_samples: int = 100_000,
+    seed: int = 0,
+) -> np.ndarray:
+    """Cluster vectors with Lloyd's k-means algorithm.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        vectors to cluster, shape (N, D)
+    num_clusters : int
+        number of clusters
+    num_iters : int, optional
+        number of iterations, by default 20
+    max_samples : int, optional
+        maximum number of vectors used for training, a random subset is used for
+        larger inputs, by default 100_000
+    seed : int, optional
+        seed of the random generator, by default 0
+
+    Returns
+    -------
+    np.ndarray
+        centroids, shape (num_clusters, D)
+    """
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    if len(data) > max_samples:
+        data = data[rng.choice(len(data), max_samples, replace=False)]
+    if len(data) < num_clusters:
+        raise ValueError(
+            f"Not enough vectors ({len(data)}) to train {num_clusters} clusters"
+        )
+
+    centroids = data[rng.choice(len(data), num_clusters, replace=False)].copy()
+    for _ in range(num_iters):
+        assignments = assign(data, centroids)
+        counts = np.bincount(assignments, minlength=num_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, data)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Re-seed the empty clusters with random vectors
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), empty.sum(), replace=False)]
+    return centroids
+
+
+def assign(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the nearest centroid of each vector.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        vectors, shape (N, D)
+    centroids : np.ndarray
+        centroids, shape (K, D)
+
+    Returns
+    -------
+    np.ndarray
+        index of the nearest centroid, shape (N,)
+    """
+    # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, |x|^2 does not change the argmin
+    distances = (centroids**2).sum(axis=1)[None] - 2 * data @ centroids.T
+    return distances.argmin(axis=1)
+
+
+class VLADCodebook:
+    """Codebook aggregating local descriptors into a VLAD vector.
+
+    The residuals of the descriptors to their nearest centroid are summed per
+    centroid, each sum is L2 normalized (intra-normalization), then the vector
+    gets a signed square root and a global L2 normalization.
+
+    Parameters
+    ----------
+    centroids : np.ndarray
+        centroids of the codebook, shape (K, D)
+    """
+
+    def __init__(self, centroids: np.ndarray) -> None:
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+
+    @property
+    def dim(self) -> int:
+        """Dimension of the VLAD vectors"""
+        return self.centroids.size
+
+    @classmethod
+    def train(
+        cls, descriptors: np.ndarray, num_clusters: int = 16, **kwargs
+    ) -> VLADCodebook:
+        """Train a codebook with k-means, see `kmeans` for the keyword arguments"""
+        return cls(kmeans(descriptors, num_clusters, **kwargs))
+
+    def aggregate(self, descriptors: np.ndarray) -> np.ndarray:
+        """Aggregate the local descriptors of an image.
+
+        Parameters
+        ----------
+        descriptors : np.ndarray
+            local descriptors, shape (N, D)
+
+        Returns
+        -------
+        np.ndarray
+            VLAD vector, shape (K * D,)
+        """
+        vlad = np.zeros_like(self.centroids)
+        descriptors = np.asarray(descriptors, dtype=np.float32)
+        if len(descriptors):
+            assignments = assign(descriptors, self.centroids)
+            np.add.at(vlad, assignments, descriptors - self.centroids[assignments])
+        vlad /= np.maximum(np.linalg.norm(vlad, axis=1, keepdims=True), 1e-12)
+        vlad = vlad.ravel()
+        vlad = np.sign(vlad) * np.sqrt(np.abs(vlad))
+        return vlad / max(np.linalg.norm(vlad), 1e-12)
+
+
+class RetrievalIndex(MapIndex):
+    """In-memory nearest neighbour index over the global descriptors of map images.
+
+    Each map image is represented by the VLAD aggregation of its local
+    descriptors, optionally reduced with PCA. The query is aggregated the same
+    way and compared to all images with a single matrix product. The index is
+    persisted next to the features and kept in sync with the map by the map
+    reader, see BaseMapReader.load_retrieval_index().
+
+    Parameters
+    ----------
+    codebook : VLADCodebook
+        codebook aggregating the local descriptors
+    vectors : np.ndarray
+        global descriptors of the map images, shape (T, d)
+    names : Sequence[str]
+        names of the map images
+    pca_mean : Optional[np.ndarray], optional
+        mean of the VLAD vectors used by the PCA, by default None
+    pca_components : Optional[np.ndarray], optional
+        PCA projection, shape (d, K * D), by default None
+    checksums : Optional[np.ndarray], optional
+        checksums of the descriptors of the map images, see
+        MapIndex.feature_checksums(), by default None
+    """
+
+    CACHE_NAME = "retrieval_index"
+
+    def __init__(
+        self,
+        codebook: VLADCodebook,
+        vectors: np.ndarray,
+        names: Sequence[str],
+        pca_mean: Optional[np.ndarray] = None,
+        pca_components: Optional[np.ndarray] = None,
+        checksums: Optional[np.ndarray] = None,
+    ) -> None:
+        super().__init__(names, checksums)
+        self.codebook = codebook
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        self.pca_mean = pca_mean
+        self.pca_components = pca_components
+
+    def project(self, vlad: np.ndarray) -> np.ndarray:
+        """Reduce VLAD vectors with the PCA if any and L2 normalize them
+
+        Parameters
+        ----------
+        vlad : np.ndarray
+            VLAD vectors, shape (N, K * D)
+
+        Returns
+        -------
+        np.ndarray
+            global descriptors, shape (N, d)
+        """
+        if self.pca_components is not None:
+            vlad = (vlad - self.pca_mean) @ self.pca_components.T
+        norms = np.linalg.norm(vlad, axis=-1, keepdims=True)
+        return (vlad / np.maximum(norms, 1e-12)).astype(np.float32)
+
+    def describe(self, key_points: ImageKeyPoints) -> np.ndarray:
+        """Compute the global descriptor of an image
+
+        Parameters
+        ----------
+        key_points : ImageKeyPoints
+            local features of the image
+
+        Returns
+        -------
+        np.ndarray
+            global descriptor, shape (d,)
+        """
+        vlad = self.codebook.aggregate(key_points.numpy().descriptors)
+        return self.project(vlad[None])[0]
+
+    def query(
+        self, key_points: ImageKeyPoints, top_k: int = 5
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the map images whose global descriptors are the most similar
+
+        Parameters
+        ----------
+        key_points : ImageKeyPoints
+            local features of the query image
+        top_k : int, optional
+            number of images to return, by default 5
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            indices of the images and their cosine similarities, most similar first
+        """
+        similarities = self.vectors @ self.describe(key_points)
+        top_k = min(top_k, len(similarities))
+        indices = np.argpartition(-similarities, top_k - 1)[:top_k]
+        indices = indices[np.argsort(-similarities[indices], kind="stable")]
+        return indices, similarities[indices]
+
+    @classmethod
+    def build(
+        cls,
+        key_points: List[ImageKeyPoints],
+        names: Sequence[str],
+        num_clusters: int = 16,
+        pca_dim: Optional[int] = None,
+        logger: Optional[logging.Logger] = None,
+        **kmeans_kwargs,
+    ) -> RetrievalIndex:
+        """Train the codebook on the map images and index them
+
+        Parameters
+        ----------
+        key_points : List[ImageKeyPoints]
+            local features of the map images
+        names : Sequence[str]
+            names of the map images
+        num_clusters : int, optional
+            number of clusters of the codebook, by default 16
+        pca_dim : Optional[int], optional
+            dimension of the global descriptors after PCA, no PCA if None, by
+            default None
+        logger : Optional[logging.Logger], optional
+            logger to use for logging, by default None
+
+        Returns
+        -------
+        RetrievalIndex
+            the index
+        """
+        logger = logger if logger is not None else logging.getLogger(__name__)
+        descriptors = [kp.numpy().descriptors for kp in key_points]
+        codebook = VLADCodebook.train(
+            np.concatenate(descriptors), num_clusters, **kmeans_kwargs
+        )
+        vlad = np.stack([codebook.aggregate(desc) for desc in descriptors])
+
+        pca_mean, pca_components = None, None
+        if pca_dim is not None:
+            pca_mean = vlad.mean(axis=0)
+            _, _, vt = np.linalg.svd(vlad - pca_mean, full_matrices=False)
+            pca_components = vt[:pca_dim].astype(np.float32)
+        index = cls(
+            codebook,
+            vlad,
+            names,
+            pca_mean,
+            pca_components,
+            cls.feature_checksums(key_points),
+        )
+        index.vectors = index.project(vlad)
+        logger.info(
+            f"Retrieval index built over {len(index)} images with {num_clusters} "
+            f"clusters and {index.vectors.shape[1]} dimensions"
+        )
+        return index
+
+    def synced(
+        self,
+        names: Sequence[str],
+        key_points: Sequence[ImageKeyPoints],
+        changed: Sequence[str] = (),
+    ) -> RetrievalIndex:
+        """Index of a new state of the map, keeping the codebook and the PCA.
+
+        The global descriptors of the images still in the map are reused, the
+        added images and the images listed in `changed` are described, and the
+        removed images are dropped.
+
+        Parameters
+        ----------
+        names : Sequence[str]
+            names of the map images after the change
+        key_points : Sequence[ImageKeyPoints]
+            local features of the map images after the change
+        changed : Sequence[str], optional
+            names of the images whose features changed, by default ()
+
+        Returns
+        -------
+        RetrievalIndex
+            the synced index
+        """
+        old_indices = {name: idx for idx, name in enumerate(self.names)}
+        changed = set(changed)
+        vectors = np.empty((len(names), self.vectors.shape[1]), dtype=np.float32)
+        for idx, name in enumerate(names):
+            if name in old_indices and name not in changed:
+                vectors[idx] = self.vectors[old_indices[name]]
+            else:
+                vectors[idx] = self.describe(key_points[idx])
+        return RetrievalIndex(
+            self.codebook,
+            vectors,
+            names,
+            self.pca_mean,
+            self.pca_components,
+            self._synced_checksums(names, key_points, changed),
+        )
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {"centroids": self.codebook.centroids, "vectors": self.vectors}
+        if self.pca_components is not None:
+            arrays["pca_mean"] = self.pca_mean
+            arrays["pca_components"] = self.pca_components
+        return arrays
+
+    @classmethod
+    def _from_arrays(
+        cls, data: Any, names: List[str], checksums: Optional[np.ndarray]
+    ) -> RetrievalIndex:
+        has_pca = "pca_components" in data.files
+        return cls(
+            codebook=VLADCodebook(data["centroids"]),
+            vectors=data["vectors"],
+            names=names,
+            pca_mean=data["pca_mean"] if has_pca else None,
+            pca_components=data["pca_components"] if has_pca else None,
+            checksums=checksums,
+        )
+
+
+class RetrievalShortlister(TileShortlister):
+    """Shortlister keeping the map images with the most similar global descriptors.
+
+    Parameters
+    ----------
+    index : RetrievalIndex
+        retrieval index over the map images, built in the order of the map reader,
+        e.g. BaseMapReader.retrieval_index
+    top_k : int, optional
+        number of images to shortlist, by default 5
+    logger : logging.Logger, optional
+        logger to use for logging, by default None
+    """
+
+    def __init__(
+        self,
+        index: RetrievalIndex,
+        top_k: int = 5,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.index = index
+        self.top_k = top_k
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+
+    def shortlist(self, drone_image: DroneImage) -> np.ndarray:
+        indices, similarities = self.index.query(drone_image.key_points, self.top_k)
+        self.logger.debug(
+            f"Retrieval shortlist: {indices.tolist()} with similarities "
+            f"{np.round(similarities, 3).tolist()}"
+        )
+        return indices
@@ -0,0 +1,216 @@
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Optional, Tuple
+
+import numpy as np
+
+from svl.keypoint_pipeline.base import CombinedKeyPointAlgorithm, KeyPointMatcher
+from svl.localization.base import BaseMapReader
+from svl.tms.data_structures import DroneImage
+
+
+class TileShortlister(ABC):
+    """Abstract class selecting the map images worth matching against a query.
+
+    The pipeline only runs the full matcher on the shortlisted images, so a
+    shortlister trades recall for a per-query cost that does not grow with the
+    number of images in the map.
+    """
+
+    @abstractmethod
+    def shortlist(self, drone_image: DroneImage) -> np.ndarray:
+        """
+        Select the map images to match against a query.
+
+        Parameters
+        ----------
+        drone_image : DroneImage
+            query image, its keypoints are already detected and described
+
+        Returns
+        -------
+        np.ndarray
+            indices of the selected map images, most promising first
+        """
+        pass
+
+
+class PyramidShortlister(TileShortlister):
+    """Coarse-to-fine shortlister matching the query against a coarse pyramid level.
+
+    The query is resized to the level like the map images, see
+    BaseMapReader.resize(), described with the detector used for the level and
+    matched against all the images of the level. The images with the most
+    matches are shortlisted.
+
+    Parameters
+    ----------
+    map_reader : BaseMapReader
+        map reader whose pyramid level is described, see describe_pyramid()
+    detector : CombinedKeyPointAlgorithm
+        detector used to describe the level
+    matcher : KeyPointMatcher
+        matcher used on the coarse features
+    level : Tuple[int, ...]
+        resize size of the pyramid level
+    top_k : int, optional
+        maximum number of images to shortlist, by default 5
+    min_matches : int, optional
+        minimum number of coarse matches to shortlist an image, by default 0
+    logger : logging.Logger, optional
+        logger to use for logging, by default None
+    """
+
+    def __init__(
+        self,
+        map_reader: BaseMapReader,
+        detector: CombinedKeyPointAlgorithm,
+        matcher: KeyPointMatcher,
+        level: Tuple[int, ...],
+        top_k: int = 5,
+        min_matches: int = 0,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.map_reader = map_reader
+        self.detector = detector
+        self.matcher = matcher
+        self.level = tuple(level)
+        self.top_k = top_k
+        self.min_matches = min_matches
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+
+    def score(self, drone_image: DroneImage) -> np.ndarray:
+        """Number of coarse matches between the query and every map image
+
+        Parameters
+        ----------
+        drone_image : DroneImage
+            query image
+
+        Returns
+        -------
+        np.ndarray
+            number of matches per map image, shape (len(map_reader),)
+        """
+        query_image = self.map_reader.resize(drone_image.image, self.level)
+        query_key_points = self.detector.detect_and_describe_keypoints(query_image)
+
+        key_points = self.map_reader.pyramid_key_points(self.level)
+        return np.array(
+            [
+                np.count_nonzero(matches > -1)
+                for matches, _ in self.matcher.match_many(query_key_points, key_points)
+            ],
+            dtype=np.int64,
+        )
+
+    def shortlist(self, drone_image: DroneImage) -> np.ndarray:
+        scores = self.score(drone_image)
+        order = np.argsort(-scores, kind="stable")[: self.top_k]
+        order = order[scores[order] >= self.min_matches]
+        self.logger.debug(
+            f"Pyramid level {self.level} shortlist: {order.tolist()} "
+            f"with {scores[order].tolist()} matches"
+        )
+        return order
+
+
+class CascadeShortlister(TileShortlister):
+    """Two-stage shortlister pre-scoring the map images with a cheap matcher.
+
+    Stage one matches the query against every map image, or against the images
+    selected by another shortlister, with a cheap matcher on the features already
+    extracted for the pipeline, e.g. MutualNNMatcher, and counts the matches.
+    Stage two is the full matcher and the geometric verification of the pipeline,
+    run on the images shortlisted here only. The cheap matcher state of the map
+    images should be precomputed with BaseMapReader.precompute_matcher().
+
+    Parameters
+    ----------
+    map_reader : BaseMapReader
+        map reader whose images are described
+    matcher : KeyPointMatcher
+        cheap matcher used to score the images
+    top_k : Optional[int], optional
+        maximum number of images to shortlist, None for no limit, by default 5
+    min_matches : int, optional
+        minimum number of matches to shortlist an image, by default 0 which
+        disables the threshold and keeps the top_k images whatever their score
+    prefilter : Optional[TileShortlister], optional
+        shortlister selecting the images to score, all the images are scored if
+        None, by default None
+    chunk_size : int, optional
+        number of images matched per call to the cheap matcher, bounding the
+        memory of a stage one scoring the whole map, by default 64
+    logger : logging.Logger, optional
+        logger to use for logging, by default None
+    """
+
+    def __init__(
+        self,
+        map_reader: BaseMapReader,
+        matcher: KeyPointMatcher,
+        top_k: Optional[int] = 5,
+        min_matches: int = 0,
+        prefilter: Optional[TileShortlister] = None,
+        chunk_size: int = 64,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive")
+        self.map_reader = map_reader
+        self.matcher = matcher
+        self.top_k = top_k
+        self.min_matches = min_matches
+        self.prefilter = prefilter
+        self.chunk_size = chunk_size
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+
+    def score(self, drone_image: DroneImage, candidates: np.ndarray) -> np.ndarray:
+        """Number of cheap matches between the query and map images
+
+        Parameters
+        ----------
+        drone_image : DroneImage
+            query image, with its keypoints
+        candidates : np.ndarray
+            indices of the map images to score
+
+        Returns
+        -------
+        np.ndarray
+            number of matches per candidate, shape (len(candidates),)
+        """
+        self.matcher.precompute(drone_image.key_points)
+        scores = np.zeros(len(candidates), dtype=np.int64)
+        for start in range(0, len(candidates), self.chunk_size):
+            chunk = candidates[start : start + self.chunk_size]
+            key_points = [self.map_reader.key_points(int(idx)) for idx in chunk]
+            for offset, (matches, _) in enumerate(
+                self.matcher.match_many(drone_image.key_points, key_points)
+            ):
+                scores[start + offset] = np.count_nonzero(matches > -1)
+        return scores
+
+    def shortlist(self, drone_image: DroneImage) -> np.ndarray:
+        if self.prefilter is None:
+            candidates = np.arange(len(self.map_reader))
+        else:
+            start_time = time.perf_counter()
+            candidates = np.asarray(self.prefilter.shortlist(drone_image))
+            self.logger.info(
+                f"Cascade prefilter kept {len(candidates)} images in "
+                f"{time.perf_counter() - start_time:.4f} seconds"
+            )
+
+        start_time = time.perf_counter()
+        scores = self.score(drone_image, candidates)
+        order = np.argsort(-scores, kind="stable")[: self.top_k]
+        order = order[scores[order] >= self.min_matches]
+        self.logger.info(
+            f"Cascade stage one scored {len(candidates)} images in "
+            f"{time.perf_counter() - start_time:.4f} seconds, shortlist: "
+            f"{candidates[order].tolist()} with {scores[order].tolist()} matches"
+        )
+        return candidates[order]
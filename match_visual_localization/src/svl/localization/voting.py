@@ -0,0 +1,546 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from svl.keypoint_pipeline.typing import ImageKeyPoints
+from svl.localization.map_index import MapIndex
+from svl.localization.retrieval import assign, kmeans
+from svl.localization.shortlist import TileShortlister
+from svl.tms.data_structures import DroneImage
+
+
+class ProductQuantizer:
+    """Product quantizer compressing vectors into one byte per subspace.
+
+    The vectors are split into M contiguous subspaces, each quantized with its own
+    codebook of at most 256 centroids, so that a vector is stored as M uint8
+    codes and the distance of a query to it is the sum of M table lookups.
+
+    Parameters
+    ----------
+    codebooks : np.ndarray
+        centroids of each subspace, shape (M, K, D / M) with K <= 256
+    """
+
+    def __init__(self, codebooks: np.ndarray) -> None:
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)
+
+    @property
+    def num_subquantizers(self) -> int:
+        return self.codebooks.shape[0]
+
+    @property
+    def sub_dim(self) -> int:
+        return self.codebooks.shape[2]
+
+    @classmethod
+    def train(
+        cls,
+        data: np.ndarray,
+        num_subquantizers: int = 32,
+        num_codes: int = 256,
+        **kmeans_kwargs,
+    ) -> ProductQuantizer:
+        """Train the codebooks with k-means, see `kmeans` for the keyword arguments
+
+        Parameters
+        ----------
+        data : np.ndarray
+            training vectors, shape (N, D) with D divisible by num_subquantizers
+        num_subquantizers : int, optional
+            number of subspaces, by default 32
+        num_codes : int, optional
+            number of centroids per subspace, at most 256, by default 256
+
+        Returns
+        -------
+        ProductQuantizer
+            the quantizer
+        """
+        data = np.asarray(data, dtype=np.float32)
+        if data.shape[1] % num_subquantizers != 0:
+            raise ValueError(
+                f"Dimension {data.shape[1]} is not divisible by {num_subquantizers}"
+            )
+        if num_codes > 256:
+            raise ValueError("At most 256 codes per subspace fit in a byte")
+        sub_dim = data.shape[1] // num_subquantizers
+        return cls(
+            np.stack(
+                [
+                    kmeans(data[:, j * sub_dim : (j + 1) * sub_dim], num_codes, **kmeans_kwargs)
+                    for j in range(num_subquantizers)
+                ]
+            )
+        )
+
+    def encode(self, data: np.ndarray) -> np.ndarray:
+        """Quantize vectors
+
+        Parameters
+        ----------
+        data : np.ndarray
+            vectors, shape (N, D)
+
+        Returns
+        -------
+        np.ndarray
+            codes, shape (N, M), uint8
+        """
+        data = np.asarray(data, dtype=np.float32)
+        codes = np.empty((len(data), self.num_subquantizers), dtype=np.uint8)
+        for j, codebook in enumerate(self.codebooks):
+            codes[:, j] = assign(
+                data[:, j * self.sub_dim : (j + 1) * self.sub_dim], codebook
+            )
+        return codes
+
+    def inner_products(self, vectors: np.ndarray) -> np.ndarray:
+        """Inner products of the subvectors of vectors with every centroid
+
+        Parameters
+        ----------
+        vectors : np.ndarray
+            vectors, shape (N, D)
+
+        Returns
+        -------
+        np.ndarray
+            inner products, shape (N, M, K)
+        """
+        vectors = vectors.reshape(len(vectors), self.num_subquantizers, self.sub_dim)
+        products = np.matmul(
+            vectors.transpose(1, 0, 2), self.codebooks.transpose(0, 2, 1)
+        )
+        return products.transpose(1, 0, 2)
+
+    def distance_tables(self, queries: np.ndarray) -> np.ndarray:
+        """Squared distances of the subvectors of queries to every centroid
+
+        Parameters
+        ----------
+        queries : np.ndarray
+            query vectors, shape (Q, D)
+
+        Returns
+        -------
+        np.ndarray
+            distance tables, shape (Q, M, K)
+        """
+        squared_norms = (
+            queries.reshape(len(queries), self.num_subquantizers, self.sub_dim) ** 2
+        ).sum(axis=2)
+        return (
+            squared_norms[:, :, None]
+            - 2 * self.inner_products(queries)
+            + (self.codebooks**2).sum(axis=2)[None]
+        )
+
+    @staticmethod
+    def distances(tables: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Approximate squared distances of queries to quantized vectors
+
+        Parameters
+        ----------
+        tables : np.ndarray
+            distance tables of the queries, shape (Q, M, K), see distance_tables()
+        codes : np.ndarray
+            codes of the vectors, shape (N, M)
+
+        Returns
+        -------
+        np.ndarray
+            distances, shape (Q, N)
+        """
+        distances = np.zeros((len(tables), len(codes)), dtype=np.float32)
+        for j in range(codes.shape[1]):
+            distances += tables[:, j, codes[:, j]]
+        return distances
+
+
+class DescriptorIndex(MapIndex):
+    """IVF-PQ approximate nearest neighbour index over the local descriptors of all
+    the map images.
+
+    The descriptors are assigned to the nearest of a set of coarse centroids
+    (inverted lists) and their residual to it is compressed by a product
+    quantizer. A query descriptor is only compared to the descriptors of the
+    nprobe lists with the closest centroids. The entries are stored sorted by
+    list, with the offsets of each list.
+
+    Parameters
+    ----------
+    coarse_centroids : np.ndarray
+        centroids of the inverted lists, shape (L, D)
+    quantizer : ProductQuantizer
+        quantizer of the residuals
+    list_ids : np.ndarray
+        inverted list of each descriptor, shape (N,)
+    codes : np.ndarray
+        codes of the residuals, shape (N, M)
+    image_ids : np.ndarray
+        map image of each descriptor, shape (N,)
+    names : Sequence[str]
+        names of the map images
+    checksums : Optional[np.ndarray], optional
+        checksums of the descriptors of the map images, see
+        MapIndex.feature_checksums(), by default None
+    """
+
+    CACHE_NAME = "descriptor_index"
+
+    def __init__(
+        self,
+        coarse_centroids: np.ndarray,
+        quantizer: ProductQuantizer,
+        list_ids: np.ndarray,
+        codes: np.ndarray,
+        image_ids: np.ndarray,
+        names: Sequence[str],
+        checksums: Optional[np.ndarray] = None,
+    ) -> None:
+        super().__init__(names, checksums)
+        self.coarse_centroids = np.asarray(coarse_centroids, dtype=np.float32)
+        self.quantizer = quantizer
+        # Inner products of the list centroids with the quantizer centroids
+        self.centroid_products = quantizer.inner_products(self.coarse_centroids)
+        self._set_entries(list_ids, codes, image_ids)
+
+    @property
+    def num_descriptors(self) -> int:
+        return len(self.codes)
+
+    def _set_entries(
+        self, list_ids: np.ndarray, codes: np.ndarray, image_ids: np.ndarray
+    ) -> None:
+        """Store the entries sorted by inverted list"""
+        order = np.argsort(list_ids, kind="stable")
+        self.list_ids = np.asarray(list_ids, dtype=np.int32)[order]
+        self.codes = np.asarray(codes, dtype=np.uint8)[order]
+        self.image_ids = np.asarray(image_ids, dtype=np.int32)[order]
+        counts = np.bincount(self.list_ids, minlength=len(self.coarse_centroids))
+        self.list_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def encode(self, descriptors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Inverted list and codes of descriptors
+
+        Parameters
+        ----------
+        descriptors : np.ndarray
+            descriptors, shape (N, D)
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            inverted lists, shape (N,), and codes, shape (N, M)
+        """
+        descriptors = np.asarray(descriptors, dtype=np.float32)
+        list_ids = assign(descriptors, self.coarse_centroids)
+        codes = self.quantizer.encode(descriptors - self.coarse_centroids[list_ids])
+        return list_ids, codes
+
+    def search(
+        self, descriptors: np.ndarray, k: int = 1, nprobe: int = 8
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the approximate nearest map descriptors of query descriptors
+
+        Parameters
+        ----------
+        descriptors : np.ndarray
+            query descriptors, shape (Q, D)
+        k : int, optional
+            number of neighbours per query descriptor, by default 1
+        nprobe : int, optional
+            number of inverted lists visited per query descriptor, by default 8
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            map image of the neighbours, -1 if fewer than k were found, and their
+            approximate squared distances, shape (Q, k), nearest first
+        """
+        queries = np.asarray(descriptors, dtype=np.float32)
+        nprobe = min(nprobe, len(self.coarse_centroids))
+        coarse = (
+            (queries**2).sum(axis=1)[:, None]
+            + (self.coarse_centroids**2).sum(axis=1)[None]
+            - 2 * (queries @ self.coarse_centroids.T)
+        )
+        probes = np.argpartition(coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+        # |r - p|^2 = |r|^2 - 2 r.p + |p|^2 for the residual r = q - c of a query
+        # to a list centroid, where r.p = q.p - c.p and |r|^2 is the coarse distance
+        query_products = self.quantizer.inner_products(queries)
+        code_norms = (self.quantizer.codebooks**2).sum(axis=2)[None]
+
+        best_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        best_images = np.full((len(queries), k), -1, dtype=np.int32)
+        for list_id in np.unique(probes):
+            start, end = self.list_offsets[list_id], self.list_offsets[list_id + 1]
+            if start == end:
+                continue
+            rows = np.flatnonzero((probes == list_id).any(axis=1))
+            tables = code_norms - 2 * (
+                query_products[rows] - self.centroid_products[list_id][None]
+            )
+            distances = np.concatenate(
+                [
+                    best_distances[rows],
+                    coarse[rows, list_id][:, None]
+                    + self.quantizer.distances(tables, self.codes[start:end]),
+                ],
+                axis=1,
+            )
+            images = np.concatenate(
+                [
+                    best_images[rows],
+                    np.broadcast_to(self.image_ids[start:end], (len(rows), end - start)),
+                ],
+                axis=1,
+            )
+            top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            best_distances[rows] = np.take_along_axis(distances, top, axis=1)
+            best_images[rows] = np.take_along_axis(images, top, axis=1)
+
+        order = np.argsort(best_distances, axis=1, kind="stable")
+        return (
+            np.take_along_axis(best_images, order, axis=1),
+            np.take_along_axis(best_distances, order, axis=1),
+        )
+
+    def vote(
+        self,
+        key_points: ImageKeyPoints,
+        k: int = 1,
+        nprobe: int = 8,
+        max_distance: Optional[float] = None,
+    ) -> np.ndarray:
+        """Count the query keypoints having a neighbour in each map image
+
+        Parameters
+        ----------
+        key_points : ImageKeyPoints
+            local features of the query image
+        k : int, optional
+            number of neighbours per query keypoint, by default 1
+        nprobe : int, optional
+            number of inverted lists visited per query keypoint, by default 8
+        max_distance : Optional[float], optional
+            maximum approximate squared distance of a neighbour to vote, by
+            default None
+
+        Returns
+        -------
+        np.ndarray
+            number of votes per map image, shape (len(index),)
+        """
+        descriptors = key_points.numpy().descriptors
+        if len(descriptors) == 0:
+            return np.zeros(len(self), dtype=np.int64)
+        images, distances = self.search(descriptors, k, nprobe)
+        valid = images > -1
+        if max_distance is not None:
+            valid &= distances <= max_distance
+        # A keypoint votes once per image, whatever its number of neighbours in it
+        pairs = np.unique(
+            np.stack([np.nonzero(valid)[0], images[valid]], axis=1), axis=0
+        )
+        return np.bincount(pairs[:, 1], minlength=len(self)).astype(np.int64)
+
+    @classmethod
+    def build(
+        cls,
+        key_points: List[ImageKeyPoints],
+        names: Sequence[str],
+        num_lists: int = 64,
+        num_subquantizers: int = 32,
+        logger: Optional[logging.Logger] = None,
+        **kmeans_kwargs,
+    ) -> DescriptorIndex:
+        """Train the coarse centroids and the quantizer on the map images and index
+        their descriptors
+
+        Parameters
+        ----------
+        key_points : List[ImageKeyPoints]
+            local features of the map images
+        names : Sequence[str]
+            names of the map images
+        num_lists : int, optional
+            number of inverted lists, by default 64
+        num_subquantizers : int, optional
+            number of bytes per descriptor, by default 32
+        logger : Optional[logging.Logger], optional
+            logger to use for logging, by default None
+
+        Returns
+        -------
+        DescriptorIndex
+            the index
+        """
+        logger = logger if logger is not None else logging.getLogger(__name__)
+        descriptors = [
+            np.asarray(kp.numpy().descriptors, dtype=np.float32) for kp in key_points
+        ]
+        image_ids = np.repeat(np.arange(len(descriptors)), [len(d) for d in descriptors])
+        descriptors = np.concatenate(descriptors)
+
+        coarse_centroids = kmeans(descriptors, num_lists, **kmeans_kwargs)
+        list_ids = assign(descriptors, coarse_centroids)
+        residuals = descriptors - coarse_centroids[list_ids]
+        quantizer = ProductQuantizer.train(
+            residuals, num_subquantizers, **kmeans_kwargs
+        )
+        index = cls(
+            coarse_centroids,
+            quantizer,
+            list_ids,
+            quantizer.encode(residuals),
+            image_ids,
+            names,
+            cls.feature_checksums(key_points),
+        )
+        logger.info(
+            f"Descriptor index built over {index.num_descriptors} descriptors of "
+            f"{len(index)} images with {num_lists} lists and {num_subquantizers} "
+            f"bytes per descriptor"
+        )
+        return index
+
+    def synced(
+        self,
+        names: Sequence[str],
+        key_points: Sequence[ImageKeyPoints],
+        changed: Sequence[str] = (),
+    ) -> DescriptorIndex:
+        """Index of a new state of the map, keeping the centroids and the quantizer.
+
+        The entries of the images still in the map are reused, the descriptors of
+        the added images and of the images listed in `changed` are encoded, and
+        the entries of the removed images are dropped. The index built at describe
+        time is synced by the map reader, see BaseMapReader.load_descriptor_index().
+
+        Parameters
+        ----------
+        names : Sequence[str]
+            names of the map images after the change
+        key_points : Sequence[ImageKeyPoints]
+            local features of the map images after the change
+        changed : Sequence[str], optional
+            names of the images whose features changed, by default ()
+
+        Returns
+        -------
+        DescriptorIndex
+            the synced index
+        """
+        changed = set(changed)
+        new_indices = {name: idx for idx, name in enumerate(names)}
+        # New index of the image of each old entry, -1 to drop it
+        remap = np.array(
+            [
+                new_indices.get(name, -1) if name not in changed else -1
+                for name in self.names
+            ],
+            dtype=np.int64,
+        )
+        keep = remap[self.image_ids] > -1 if len(self.names) else np.zeros(0, bool)
+        list_ids = [self.list_ids[keep]]
+        codes = [self.codes[keep]]
+        image_ids = [remap[self.image_ids[keep]]]
+
+        kept = set(remap[remap > -1].tolist())
+        for idx in range(len(names)):
+            if idx in kept:
+                continue
+            descriptors = key_points[idx].numpy().descriptors
+            new_list_ids, new_codes = self.encode(descriptors)
+            list_ids.append(new_list_ids)
+            codes.append(new_codes)
+            image_ids.append(np.full(len(descriptors), idx))
+        return DescriptorIndex(
+            self.coarse_centroids,
+            self.quantizer,
+            np.concatenate(list_ids),
+            np.concatenate(codes),
+            np.concatenate(image_ids),
+            names,
+            self._synced_checksums(names, key_points, changed),
+        )
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            "coarse_centroids": self.coarse_centroids,
+            "codebooks": self.quantizer.codebooks,
+            "list_ids": self.list_ids,
+            "codes": self.codes,
+            "image_ids": self.image_ids,
+        }
+
+    @classmethod
+    def _from_arrays(
+        cls, data: Any, names: List[str], checksums: Optional[np.ndarray]
+    ) -> DescriptorIndex:
+        return cls(
+            coarse_centroids=data["coarse_centroids"],
+            quantizer=ProductQuantizer(data["codebooks"]),
+            list_ids=data["list_ids"],
+            codes=data["codes"],
+            image_ids=data["image_ids"],
+            names=names,
+            checksums=checksums,
+        )
+
+
+class VotingShortlister(TileShortlister):
+    """Shortlister keeping the map images that get the most votes from the query
+    keypoints in a DescriptorIndex.
+
+    Each query keypoint looks up its approximate nearest map descriptors in a
+    single batched search and votes for their images, so the per-query cost does
+    not depend on a matcher run per map image.
+
+    Parameters
+    ----------
+    index : DescriptorIndex
+        descriptor index over the map images, built in the order of the map reader,
+        e.g. BaseMapReader.descriptor_index
+    top_k : int, optional
+        number of images to shortlist, by default 5
+    k : int, optional
+        number of neighbours per query keypoint, by default 1
+    nprobe : int, optional
+        number of inverted lists visited per query keypoint, by default 8
+    min_votes : int, optional
+        minimum number of votes to shortlist an image, by default 0
+    logger : logging.Logger, optional
+        logger to use for logging, by default None
+    """
+
+    def __init__(
+        self,
+        index: DescriptorIndex,
+        top_k: int = 5,
+        k: int = 1,
+        nprobe: int = 8,
+        min_votes: int = 0,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.index = index
+        self.top_k = top_k
+        self.k = k
+        self.nprobe = nprobe
+        self.min_votes = min_votes
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+
+    def shortlist(self, drone_image: DroneImage) -> np.ndarray:
+        votes = self.index.vote(drone_image.key_points, self.k, self.nprobe)
+        order = np.argsort(-votes, kind="stable")[: self.top_k]
+        order = order[votes[order] >= self.min_votes]
+        self.logger.debug(
+            f"Voting shortlist: {order.tolist()} with {votes[order].tolist()} votes"
+        )
+        return order
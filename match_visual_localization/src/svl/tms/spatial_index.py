@@ -0,0 +1,397 @@
+from __future__ import annotations
+
+import math
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from svl.tms.data_structures import GeoSatelliteImage
+
+# Length of one degree of latitude in meters (mean Earth radius of 6371.0088 km)
+METERS_PER_DEGREE = 111_195.08
+
+
+class TileSpatialIndex:
+    """Uniform grid index over the footprints of the satellite images.
+
+    Every footprint is registered in all the grid cells it overlaps. The cells are
+    stored in a compressed layout: the sorted keys of the non-empty cells and, for
+    each of them, a range of rows in a single array of image indices. A query
+    only looks at the images registered in the cells it touches.
+
+    Parameters
+    ----------
+    bounds : np.ndarray
+        footprints of the images, shape (N, 4) with columns
+        (lat_min, lon_min, lat_max, lon_max). Rows with NaN values are ignored.
+    cell_size : Optional[Tuple[float, float]], optional
+        size of a cell in degrees (lat, lon), by default None which uses the
+        median footprint size
+    """
+
+    def __init__(
+        self, bounds: np.ndarray, cell_size: Optional[Tuple[float, float]] = None
+    ) -> None:
+        bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+        self.bounds = bounds
+        valid = ~np.isnan(bounds).any(axis=1)
+        self._valid_ids = np.flatnonzero(valid)
+        if len(self._valid_ids) == 0:
+            raise ValueError("No image with valid bounds to index")
+        valid_bounds = bounds[valid]
+
+        if cell_size is None:
+            extents = valid_bounds[:, 2:] - valid_bounds[:, :2]
+            cell_size = tuple(np.median(extents, axis=0))
+        self.cell_size = np.maximum(np.asarray(cell_size, dtype=np.float64), 1e-9)
+        self.origin = valid_bounds[:, :2].min(axis=0)
+        upper = valid_bounds[:, 2:].max(axis=0)
+        self.grid_shape = (
+            np.floor((upper - self.origin) / self.cell_size).astype(np.int64) + 1
+        )
+
+        # Register every footprint in the cells it overlaps
+        first = self._cell_coordinates(valid_bounds[:, :2])
+        last = self._cell_coordinates(valid_bounds[:, 2:])
+        num_rows = last[:, 0] - first[:, 0] + 1
+        num_cols = last[:, 1] - first[:, 1] + 1
+        counts = num_rows * num_cols
+        image_ids = np.repeat(self._valid_ids, counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        rows = np.repeat(first[:, 0], counts) + local // np.repeat(num_cols, counts)
+        cols = np.repeat(first[:, 1], counts) + local % np.repeat(num_cols, counts)
+        keys = self._cell_keys(rows, cols)
+
+        order = np.argsort(keys, kind="stable")
+        keys, self._cell_images = keys[order], image_ids[order]
+        self._cell_keys_sorted, self._cell_starts = np.unique(keys, return_index=True)
+        self._cell_ends = np.append(self._cell_starts[1:], len(keys))
+
+    @classmethod
+    def from_images(
+        cls,
+        images: Iterable[GeoSatelliteImage],
+        cell_size: Optional[Tuple[float, float]] = None,
+    ) -> TileSpatialIndex:
+        """Build the index from the corners of satellite images.
+
+        Parameters
+        ----------
+        images : Iterable[GeoSatelliteImage]
+            satellite images, the position in the iterable is the index returned by
+            the queries. Images without corners are not indexed.
+        cell_size : Optional[Tuple[float, float]], optional
+            size of a cell in degrees (lat, lon), by default None
+
+        Returns
+        -------
+        TileSpatialIndex
+            the spatial index
+        """
+        bounds = []
+        for image in images:
+            if image.top_left is None or image.bottom_right is None:
+                bounds.append([np.nan] * 4)
+                continue
+            lats = (image.top_left.lat, image.bottom_right.lat)
+            longs = (image.top_left.long, image.bottom_right.long)
+            bounds.append([min(lats), min(longs), max(lats), max(longs)])
+        return cls(np.array(bounds, dtype=np.float64), cell_size)
+
+    def __len__(self) -> int:
+        """Number of indexed images"""
+        return len(self._valid_ids)
+
+    def _cell_coordinates(self, points: np.ndarray) -> np.ndarray:
+        """Cell (row, col) of (lat, lon) points, not clipped to the grid"""
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+
+    def _cell_keys(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        return rows * self.grid_shape[1] + cols
+
+    def _images_in_cells(
+        self, rows: np.ndarray, cols: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Images registered in the given cells, one entry per (cell, image) pair.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            position of the cell in the input arrays and the image index
+        """
+        inside = (
+            (rows >= 0)
+            & (rows < self.grid_shape[0])
+            & (cols >= 0)
+            & (cols < self.grid_shape[1])
+        )
+        keys = np.where(inside, self._cell_keys(rows, cols), -1)
+        pos = np.searchsorted(self._cell_keys_sorted, keys)
+        pos = np.minimum(pos, len(self._cell_keys_sorted) - 1)
+        found = inside & (self._cell_keys_sorted[pos] == keys)
+        starts = np.where(found, self._cell_starts[pos], 0)
+        counts = np.where(found, self._cell_ends[pos] - self._cell_starts[pos], 0)
+
+        query_ids = np.repeat(np.arange(len(keys)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return query_ids, self._cell_images[np.repeat(starts, counts) + offsets]
+
+    def query_points(
+        self, lats: np.ndarray, longs: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the images containing each of a batch of points.
+
+        Parameters
+        ----------
+        lats : np.ndarray
+            latitudes of the points, shape (P,)
+        longs : np.ndarray
+            longitudes of the points, shape (P,)
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            pairs (point index, image index) for every image containing a point,
+            sorted by point index
+        """
+        points = np.stack(
+            [np.asarray(lats, dtype=np.float64), np.asarray(longs, dtype=np.float64)],
+            axis=-1,
+        ).reshape(-1, 2)
+        cells = self._cell_coordinates(points)
+        point_ids, image_ids = self._images_in_cells(cells[:, 0], cells[:, 1])
+        bounds = self.bounds[image_ids]
+        candidates = points[point_ids]
+        inside = (
+            (bounds[:, 0] <= candidates[:, 0])
+            & (candidates[:, 0] <= bounds[:, 2])
+            & (bounds[:, 1] <= candidates[:, 1])
+            & (candidates[:, 1] <= bounds[:, 3])
+        )
+        return point_ids[inside], image_ids[inside]
+
+    def query_point(self, lat: float, long: float) -> np.ndarray:
+        """Find the images containing a point.
+
+        Parameters
+        ----------
+        lat : float
+            latitude of the point
+        long : float
+            longitude of the point
+
+        Returns
+        -------
+        np.ndarray
+            indices of the images containing the point
+        """
+        return self.query_points(np.array([lat]), np.array([long]))[1]
+
+    def locate_points(self, lats: np.ndarray, longs: np.ndarray) -> np.ndarray:
+        """Find one image containing each of a batch of points.
+
+        Parameters
+        ----------
+        lats : np.ndarray
+            latitudes of the points, shape (P,)
+        longs : np.ndarray
+            longitudes of the points, shape (P,)
+
+        Returns
+        -------
+        np.ndarray
+            index of the first image containing each point, -1 if there is none,
+            shape (P,)
+        """
+        lats = np.asarray(lats, dtype=np.float64).reshape(-1)
+        point_ids, image_ids = self.query_points(lats, longs)
+        located = np.full(len(lats), -1, dtype=np.int64)
+        # Assign in reverse order so that the lowest image index wins
+        order = np.lexsort((-image_ids, point_ids))
+        located[point_ids[order]] = image_ids[order]
+        return located
+
+    def query_bbox(
+        self, lat_min: float, lon_min: float, lat_max: float, lon_max: float
+    ) -> np.ndarray:
+        """Find the images intersecting a bounding box.
+
+        Parameters
+        ----------
+        lat_min : float
+            minimum latitude of the box
+        lon_min : float
+            minimum longitude of the box
+        lat_max : float
+            maximum latitude of the box
+        lon_max : float
+            maximum longitude of the box
+
+        Returns
+        -------
+        np.ndarray
+            sorted indices of the images intersecting the box
+        """
+        first = self._cell_coordinates(np.array([lat_min, lon_min]))
+        last = self._cell_coordinates(np.array([lat_max, lon_max]))
+        first = np.maximum(first, 0)
+        last = np.minimum(last, self.grid_shape - 1)
+        if np.any(last < first):
+            return np.empty(0, dtype=np.int64)
+        rows, cols = np.meshgrid(
+            np.arange(first[0], last[0] + 1),
+            np.arange(first[1], last[1] + 1),
+            indexing="ij",
+        )
+        _, image_ids = self._images_in_cells(rows.ravel(), cols.ravel())
+        image_ids = np.unique(image_ids)
+        bounds = self.bounds[image_ids]
+        intersects = (
+            (bounds[:, 0] <= lat_max)
+            & (lat_min <= bounds[:, 2])
+            & (bounds[:, 1] <= lon_max)
+            & (lon_min <= bounds[:, 3])
+        )
+        return image_ids[intersects]
+
+    def distances(self, lat: float, long: float, image_ids: np.ndarray) -> np.ndarray:
+        """Approximate distance in meters from a point to image footprints.
+
+        The distance is 0 for the footprints containing the point. It uses an
+        equirectangular approximation, which is accurate at the scale of a map.
+
+        Parameters
+        ----------
+        lat : float
+            latitude of the point
+        long : float
+            longitude of the point
+        image_ids : np.ndarray
+            indices of the images
+
+        Returns
+        -------
+        np.ndarray
+            distances in meters, shape (len(image_ids),)
+        """
+        bounds = self.bounds[image_ids]
+        dlat = np.maximum(np.maximum(bounds[:, 0] - lat, lat - bounds[:, 2]), 0.0)
+        dlon = np.maximum(np.maximum(bounds[:, 1] - long, long - bounds[:, 3]), 0.0)
+        dlon = dlon * math.cos(math.radians(lat))
+        return np.hypot(dlat, dlon) * METERS_PER_DEGREE
+
+    def nearest(
+        self, lat: float, long: float, k: int = 1
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the k images whose footprints are the closest to a point.
+
+        The cells are visited by rings of increasing distance around the cell of
+        the point, and the search stops as soon as no image in the next rings can
+        be closer than the current k-th closest image.
+
+        Parameters
+        ----------
+        lat : float
+            latitude of the point
+        long : float
+            longitude of the point
+        k : int, optional
+            number of images to return, by default 1
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            indices of the images and their distances in meters, sorted by distance
+        """
+        k = min(k, len(self))
+        row, col = self._cell_coordinates(np.array([lat, long]))
+        max_ring = int(
+            max(
+                abs(row),
+                abs(row - self.grid_shape[0] + 1),
+                abs(col),
+                abs(col - self.grid_shape[1] + 1),
+            )
+        )
+        ring_step = METERS_PER_DEGREE * min(
+            self.cell_size[0], self.cell_size[1] * math.cos(math.radians(lat))
+        )
+
+        # Rings closer than the grid do not contain any cell
+        first_ring = int(
+            max(
+                0,
+                -row,
+                row - self.grid_shape[0] + 1,
+                -col,
+                col - self.grid_shape[1] + 1,
+            )
+        )
+
+        candidates = np.empty(0, dtype=np.int64)
+        for ring in range(first_ring, max_ring + 1):
+            offsets = np.arange(-ring, ring + 1)
+            if ring == 0:
+                rows, cols = np.array([row]), np.array([col])
+            else:
+                edge = np.full(len(offsets), ring)
+                rows = row + np.concatenate([-edge, edge, offsets[1:-1], offsets[1:-1]])
+                cols = col + np.concatenate(
+                    [offsets, offsets, -edge[1:-1], edge[1:-1]]
+                )
+            _, image_ids = self._images_in_cells(rows, cols)
+            if len(image_ids):
+                candidates = np.union1d(candidates, image_ids)
+            if len(candidates) >= k:
+                dists = self.distances(lat, long, candidates)
+                kth = np.partition(dists, k - 1)[k - 1]
+                # Images not seen yet do not overlap any cell up to this ring
+                if kth <= ring * ring_step:
+                    break
+
+        dists = self.distances(lat, long, candidates)
+        order = np.argsort(dists, kind="stable")[:k]
+        return candidates[order], dists[order]
+
+    def nearest_many(
+        self, lats: np.ndarray, longs: np.ndarray, k: int = 1
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the k nearest images of each of a batch of points.
+
+        Parameters
+        ----------
+        lats : np.ndarray
+            latitudes of the points, shape (P,)
+        longs : np.ndarray
+            longitudes of the points, shape (P,)
+        k : int, optional
+            number of images to return per point, by default 1
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            indices of the images and their distances in meters, shape (P, k)
+        """
+        k = min(k, len(self))
+        lats = np.asarray(lats, dtype=np.float64).reshape(-1)
+        longs = np.asarray(longs, dtype=np.float64).reshape(-1)
+        image_ids = np.empty((len(lats), k), dtype=np.int64)
+        dists = np.empty((len(lats), k), dtype=np.float64)
+
+        # Points inside a footprint whose k nearest images are all containing it
+        # are answered by the vectorized containment query
+        point_ids, containing = self.query_points(lats, longs)
+        num_containing = np.bincount(point_ids, minlength=len(lats))
+        solved = num_containing >= k
+        if k > 0 and solved.any():
+            keep = solved[point_ids]
+            rank = np.arange(len(point_ids)) - np.repeat(
+                np.cumsum(num_containing) - num_containing, num_containing
+            )
+            keep &= rank < k
+            image_ids[point_ids[keep], rank[keep]] = containing[keep]
+            dists[solved] = 0.0
+
+        for idx in np.flatnonzero(~solved):
+            image_ids[idx], dists[idx] = self.nearest(lats[idx], longs[idx], k)
+        return image_ids, dists
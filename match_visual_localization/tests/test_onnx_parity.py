@@ -0,0 +1,109 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("onnxruntime")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+import superglue_lib.models.superglue as superglue_module  # noqa: E402
+from svl.keypoint_pipeline.detection_and_description import (  # noqa: E402
+    SUPERPOINT_WEIGHTS,
+    SuperPointAlgorithm,
+)
+from svl.keypoint_pipeline.evaluation import (  # noqa: E402
+    keypoint_agreement,
+    match_agreement,
+    warp_image,
+)
+from svl.keypoint_pipeline.export import (  # noqa: E402
+    export_superglue_onnx,
+    export_superpoint_onnx,
+)
+from svl.keypoint_pipeline.matcher import SuperGlueMatcher  # noqa: E402
+from svl.keypoint_pipeline.onnx_backend import (  # noqa: E402
+    OnnxSuperGlueMatcher,
+    OnnxSuperPointAlgorithm,
+)
+from svl.keypoint_pipeline.typing import (  # noqa: E402
+    OnnxSuperGlueConfig,
+    OnnxSuperPointConfig,
+    SuperGlueConfig,
+    SuperPointConfig,
+)
+
+SUPERGLUE_WEIGHTS = (
+    Path(superglue_module.__file__).parent / "weights/superglue_outdoor.pth"
+)
+MAX_KEYPOINTS = 256
+MIN_REPEATABILITY = 0.999
+MIN_DESCRIPTOR_SIMILARITY = 0.999
+MIN_MATCH_JACCARD = 0.99
+
+pytestmark = pytest.mark.skipif(
+    not (SUPERPOINT_WEIGHTS.exists() and SUPERGLUE_WEIGHTS.exists()),
+    reason="SuperPoint and SuperGlue weights are not available",
+)
+
+
+@pytest.fixture(scope="module")
+def image() -> np.ndarray:
+    """Synthetic grayscale image with blobs and edges for the detector"""
+    rng = np.random.default_rng(0)
+    image = np.zeros((240, 320), dtype=np.float32)
+    for _ in range(60):
+        top, left = rng.integers(0, 220), rng.integers(0, 300)
+        height, width = rng.integers(5, 30, size=2)
+        image[top : top + height, left : left + width] += rng.uniform(0.2, 1.0)
+    image += rng.normal(0.0, 0.02, size=image.shape)
+    return (np.clip(image / image.max(), 0.0, 1.0) * 255).astype(np.uint8)
+
+
+@pytest.fixture(scope="module")
+def models(tmp_path_factory):
+    """Torch models and the ONNX Runtime models exported from them"""
+    model_dir = tmp_path_factory.mktemp("onnx")
+    detector = SuperPointAlgorithm(SuperPointConfig(max_keypoints=MAX_KEYPOINTS))
+    matcher = SuperGlueMatcher(SuperGlueConfig())
+    export_superpoint_onnx(detector.detector, model_dir / "superpoint.onnx")
+    export_superglue_onnx(matcher.matcher, model_dir / "superglue.onnx")
+    onnx_detector = OnnxSuperPointAlgorithm(
+        OnnxSuperPointConfig(
+            model_path=str(model_dir / "superpoint.onnx"),
+            max_keypoints=MAX_KEYPOINTS,
+        )
+    )
+    onnx_matcher = OnnxSuperGlueMatcher(
+        OnnxSuperGlueConfig(model_path=str(model_dir / "superglue.onnx"))
+    )
+    return detector, matcher, onnx_detector, onnx_matcher
+
+
+def test_superpoint_parity(image, models):
+    detector, _, onnx_detector, _ = models
+    reference = detector.detect_and_describe_keypoints(image)
+    candidate = onnx_detector.detect_and_describe_keypoints(image)
+
+    agreement = keypoint_agreement(reference, candidate)
+    assert agreement["reference_keypoints"] > 0
+    assert agreement["candidate_keypoints"] == agreement["reference_keypoints"]
+    assert agreement["repeatability"] >= MIN_REPEATABILITY
+    assert agreement["descriptor_similarity"] >= MIN_DESCRIPTOR_SIMILARITY
+
+
+def test_superglue_parity(image, models):
+    detector, matcher, _, onnx_matcher = models
+    warped, _ = warp_image(image)
+    keypoints_1, keypoints_2 = detector.detect_and_describe_keypoints_batch(
+        [image, warped]
+    )
+
+    reference, _ = matcher.match_keypoints(keypoints_1, keypoints_2)
+    candidate, _ = onnx_matcher.match_keypoints(keypoints_1, keypoints_2)
+
+    agreement = match_agreement(np.asarray(reference), np.asarray(candidate))
+    assert agreement["reference_matches"] > 0
+    assert agreement["jaccard"] >= MIN_MATCH_JACCARD
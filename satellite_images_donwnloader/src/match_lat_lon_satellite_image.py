@@ -26,18 +26,14 @@ input_lon  = float(input("Enter longitude: "))
 # Print the entered input
 print(f"Your Coordinates: {input_lat}, {input_lon}")
 
-matched = False
-for idx, row in df.iterrows():
-    lat_huge = row['Top_left_lat']
-    lat_small = row["Bottom_right_lat"]
-
-    long_huge = row['Bottom_right_long']
-    long_small = row['Top_left_lon']
-    if lat_small <= input_lat and input_lat <= lat_huge\
-          and long_small <= input_lon and input_lon <= long_huge:
-        matched = True
-        print(row['Filename'])
-        break
-        
-if matched is False:
-    print("Not match")
\ No newline at end of file
+contains = (
+    (df["Bottom_right_lat"] <= input_lat)
+    & (input_lat <= df["Top_left_lat"])
+    & (df["Top_left_lon"] <= input_lon)
+    & (input_lon <= df["Bottom_right_long"])
+)
+matched_rows = df[contains]
+if len(matched_rows) > 0:
+    print(matched_rows["Filename"].iloc[0])
+else:
+    print("Not match")